@@ -38,7 +38,50 @@ quark_opts = [
     cfg.StrOpt("default_ipam_strategy",
                default="ANY",
                help=_("Default IPAM strategy to use when"
-                      "none is provided."))
+                      "none is provided.")),
+    cfg.IntOpt("ipam_optimistic_retries",
+               default=10,
+               help=_("Times the optimistic IPAM strategies retry claiming "
+                      "an address after losing it to a concurrent "
+                      "allocation.")),
+    cfg.IntOpt("ipam_cursor_shards",
+               default=16,
+               help=_("Number of shards the sharded IPAM strategies split "
+                      "each subnet into to spread concurrent allocations.")),
+    cfg.DictOpt("ipam_warm_pool_sizes",
+                default={},
+                help=_("Addresses to keep reserved per subnet, keyed by "
+                       "network id. Allocations on these networks claim "
+                       "a reserved address first, quark-ipam-warm-pool "
+                       "tops the pools up.")),
+    cfg.BoolOpt("notification_batching",
+                default=False,
+                help=_("Send IPAM notifications from a background worker, "
+                       "grouping the events of each type into a single "
+                       "notification with an 'events' list payload.")),
+    cfg.IntOpt("notification_queue_size",
+               default=10000,
+               help=_("Events the batching worker may fall behind by.")),
+    cfg.IntOpt("notification_batch_size",
+               default=100,
+               help=_("Most events sent in one batch.")),
+    cfg.FloatOpt("notification_batch_interval",
+                 default=1.0,
+                 help=_("Seconds the batching worker waits for a batch to "
+                        "fill up.")),
+    cfg.StrOpt("notification_overflow",
+               default="drop",
+               help=_("What to do with events when the notification queue "
+                      "is full, 'drop' them or 'block' the request until "
+                      "there is room.")),
+    cfg.ListOpt("replica_connections",
+                default=[],
+                help=_("SQLAlchemy connection strings of read replicas. "
+                       "Read-only plugin calls take turns over them, all "
+                       "calls go to the primary when empty.")),
+    cfg.IntOpt("replica_retry_interval",
+               default=30,
+               help=_("Seconds a failed read replica is skipped for."))
 ]
 
 
@@ -0,0 +1,85 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron.api import extensions
+from neutron import manager
+from neutron.openstack.common import log as logging
+from neutron import wsgi
+
+RESOURCE_NAME = 'instance_network_info'
+RESOURCE_COLLECTION = RESOURCE_NAME
+EXTENDED_ATTRIBUTES_2_0 = {
+    RESOURCE_COLLECTION: {}
+}
+
+LOG = logging.getLogger(__name__)
+
+
+class InstanceNetworkInfoController(wsgi.Controller):
+
+    def __init__(self, plugin):
+        self._resource_name = RESOURCE_NAME
+        self._plugin = plugin
+
+    def index(self, request):
+        device_ids = request.GET.getall("device_id")
+        return {"instance_network_info":
+                self._plugin.get_instance_network_info(request.context,
+                                                       device_ids)}
+
+    def show(self, request, id):
+        return {"instance_network_info":
+                self._plugin.get_instance_network_info(request.context,
+                                                       [id])[0]}
+
+
+class Instance_network_info(object):
+    """Read-only network info of instances, keyed by device_id."""
+    @classmethod
+    def get_name(cls):
+        return "Instance network info"
+
+    @classmethod
+    def get_alias(cls):
+        return RESOURCE_COLLECTION
+
+    @classmethod
+    def get_description(cls):
+        return ("Ports, fixed IPs, subnets, host routes, DNS nameservers and "
+                "gateways of instances in a single call")
+
+    @classmethod
+    def get_namespace(cls):
+        return ("http://docs.openstack.org/network/ext/"
+                "instance_network_info/api/v2.0")
+
+    @classmethod
+    def get_updated(cls):
+        return "2014-03-01T10:00:00-00:00"
+
+    def get_extended_resources(self, version):
+        if version == "2.0":
+            return EXTENDED_ATTRIBUTES_2_0
+        else:
+            return {}
+
+    @classmethod
+    def get_resources(cls):
+        """Returns Ext Resources."""
+        controller = InstanceNetworkInfoController(
+            manager.NeutronManager.get_plugin())
+        return [extensions.ResourceExtension(
+            Instance_network_info.get_alias(),
+            controller)]
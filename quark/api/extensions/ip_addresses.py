@@ -15,6 +15,7 @@
 
 import webob
 
+from neutron.api import api_common
 from neutron.api import extensions
 from neutron.common import exceptions
 from neutron import manager
@@ -43,8 +44,15 @@ class IpAddressesController(wsgi.Controller):
 
     def index(self, request):
         context = request.context
+        limit, marker = api_common.get_limit_and_marker(request)
+        page_reverse = api_common.get_page_reverse(request)
+        filters = dict((key, value) for key, value in request.GET.items()
+                       if key not in ("limit", "marker", "page_reverse"))
         return {"ip_addresses":
-                self._plugin.get_ip_addresses(context, **request.GET)}
+                self._plugin.get_ip_addresses(context, limit=limit,
+                                              marker=marker,
+                                              page_reverse=page_reverse,
+                                              **filters)}
 
     def show(self, request, id):
         context = request.context
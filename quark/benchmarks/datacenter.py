@@ -0,0 +1,135 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Seeds a synthetic datacenter for the IPAM benchmarks.
+
+Addresses are inserted in bulk at the bottom of every subnet, allocated ones
+first and then the deallocated history, after which the free range indexes,
+counters and reuse queue are rebuilt the way quark-ipam-repair does.
+"""
+
+import datetime
+
+import netaddr
+from neutron.openstack.common import timeutils
+from neutron.openstack.common import uuidutils
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.tools import ipam_repair
+
+V4_SUPERNET = netaddr.IPNetwork("10.0.0.0/8")
+V6_SUPERNET = netaddr.IPNetwork("fd00::/16")
+V6_PREFIX = 64
+# Policies exclude blocks of four addresses at the start of every subnet
+EXCLUDE_PREFIXES = {4: 30, 6: 126}
+FIRST_MAC = int(netaddr.EUI("AA:BB:00:00:00:00"))
+MAC_RANGE_SIZE = 2 ** 24
+
+
+def _nth_subnet(supernet, prefix, n):
+    width = supernet.version == 4 and 32 or 128
+    size = 2 ** (width - prefix)
+    first = netaddr.IPAddress(supernet.first + n * size,
+                              version=supernet.version)
+    return netaddr.IPNetwork("%s/%d" % (first, prefix))
+
+
+def _excluded_cidrs(cidr, count):
+    blocks = cidr.subnet(EXCLUDE_PREFIXES[cidr.version], count=count)
+    return [str(block) for block in blocks]
+
+
+def _address_rows(context, net_id, subnet, allocated, history,
+                  deallocated_at):
+    ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+    cidr = netaddr.IPNetwork(subnet["cidr"])
+    now = timeutils.utcnow()
+    rows = []
+    address = cidr.first
+    while len(rows) < allocated + history and address <= cidr.last:
+        if address not in ip_policy:
+            ip = netaddr.IPAddress(address, version=cidr.version)
+            row = dict(id=uuidutils.generate_uuid(), address=address,
+                       address_readable=str(ip), subnet_id=subnet["id"],
+                       network_id=net_id, version=cidr.version,
+                       tenant_id=context.tenant_id, created_at=now,
+                       _deallocated=0, allocated_at=now, deallocated_at=None)
+            if len(rows) >= allocated:
+                row.update(_deallocated=1, allocated_at=None,
+                           deallocated_at=deallocated_at)
+            rows.append(row)
+        address += 1
+    return rows
+
+
+def seed_network(context, index, v4_subnets, v6_subnets, v4_prefix,
+                 policy_excludes, allocated, history, deallocated_at):
+    """Creates one network with its subnets, policy and addresses."""
+    v4_cidrs = [_nth_subnet(V4_SUPERNET, v4_prefix, index * v4_subnets + i)
+                for i in xrange(v4_subnets)]
+    v6_cidrs = [_nth_subnet(V6_SUPERNET, V6_PREFIX, index * v6_subnets + i)
+                for i in xrange(v6_subnets)]
+
+    with context.session.begin():
+        net = db_api.network_create(context, name="benchmark-%d" % index,
+                                    network_plugin="BASE")
+        if policy_excludes:
+            exclude = []
+            for cidr in v4_cidrs + v6_cidrs:
+                exclude.extend(_excluded_cidrs(cidr, policy_excludes))
+            net["ip_policy"] = db_api.ip_policy_create(context,
+                                                       exclude=exclude)
+        subnets = [db_api.subnet_create(context, network=net, cidr=str(cidr),
+                                        ip_version=cidr.version,
+                                        next_auto_assign_ip=cidr.first)
+                   for cidr in v4_cidrs + v6_cidrs]
+
+    with context.session.begin():
+        for subnet in subnets:
+            rows = _address_rows(context, net["id"], subnet, allocated,
+                                 history, deallocated_at)
+            if rows:
+                context.session.execute(
+                    models.IPAddress.__table__.insert(), rows)
+            ipam_repair.repair_subnet(context, subnet)
+    return net
+
+
+def seed(context, networks, v4_subnets, v6_subnets, v4_prefix,
+         policy_excludes, mac_ranges, allocated, history, history_age):
+    """Seeds the whole datacenter, returns the ids of its networks.
+
+    Every subnet gets allocated addresses and history deallocated ones,
+    deallocated history_age seconds ago.
+    """
+    deallocated_at = (timeutils.utcnow() -
+                      datetime.timedelta(seconds=history_age))
+    net_ids = []
+    for index in xrange(networks):
+        net = seed_network(context, index, v4_subnets, v6_subnets,
+                           v4_prefix, policy_excludes, allocated, history,
+                           deallocated_at)
+        net_ids.append(net["id"])
+
+    with context.session.begin():
+        for index in xrange(mac_ranges):
+            first = FIRST_MAC + index * MAC_RANGE_SIZE
+            db_api.mac_address_range_create(
+                context, cidr="%s/24" % netaddr.EUI(first),
+                first_address=first, last_address=first + MAC_RANGE_SIZE,
+                next_auto_assign_mac=first)
+    return net_ids
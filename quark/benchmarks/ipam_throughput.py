@@ -0,0 +1,228 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures IPAM allocation cost on a synthetic datacenter.
+
+For every strategy the sqlite file is seeded from scratch, see datacenter,
+then ports are allocated a MAC and IPs and deallocated again, one
+transaction each, round robin over the networks. The results, including
+the seed parameters, are written as JSON so two releases can be diffed.
+"""
+
+import json
+import os
+import sys
+import time
+
+from neutron.common import config as neutron_cfg
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import uuidutils
+from oslo.config import cfg
+from sqlalchemy import event
+
+from quark.benchmarks import datacenter
+from quark.db import models
+from quark import ipam
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+SEED_OPTS = ["networks", "v4_subnets", "v6_subnets", "v4_prefix",
+             "policy_excludes", "mac_ranges", "allocated", "history",
+             "history_age"]
+
+benchmark_opts = [
+    cfg.StrOpt("db_file", default="ipam-benchmark.sqlite",
+               help=_("SQLite file the datacenter is seeded into, "
+                      "overwritten")),
+    cfg.ListOpt("strategies", default=["ANY", "BOTH", "BOTH_REQUIRED"],
+                help=_("IPAM strategies to benchmark")),
+    cfg.IntOpt("networks", default=4,
+               help=_("Networks in the datacenter")),
+    cfg.IntOpt("v4_subnets", default=2,
+               help=_("IPv4 subnets per network")),
+    cfg.IntOpt("v6_subnets", default=1,
+               help=_("IPv6 subnets per network")),
+    cfg.IntOpt("v4_prefix", default=20,
+               help=_("Prefix length of the IPv4 subnets")),
+    cfg.IntOpt("policy_excludes", default=2,
+               help=_("Blocks the IP policy of every network excludes per "
+                      "subnet, 0 for no policies")),
+    cfg.IntOpt("mac_ranges", default=1,
+               help=_("MAC address ranges")),
+    cfg.IntOpt("allocated", default=1000,
+               help=_("Allocated addresses per subnet")),
+    cfg.IntOpt("history", default=1000,
+               help=_("Deallocated addresses per subnet")),
+    cfg.IntOpt("history_age", default=0,
+               help=_("Seconds ago the history was deallocated, past "
+                      "ipam_reuse_after it is reallocated")),
+    cfg.IntOpt("ports", default=1000,
+               help=_("Ports allocated and deallocated per strategy")),
+    cfg.IntOpt("outstanding", default=10,
+               help=_("Ports held before they are deallocated")),
+    cfg.StrOpt("output",
+               help=_("File the JSON results are written to, stdout if "
+                      "unset"))
+]
+
+CONF.register_cli_opts(benchmark_opts, "benchmark")
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+class StatementCounter(object):
+    """Counts the SQL statements an engine executes."""
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._executed)
+
+    def _executed(self, *args):
+        self.count += 1
+
+
+class Measurement(object):
+    """Latencies and statement counts of one kind of operation."""
+    def __init__(self, counter):
+        self.counter = counter
+        self.latencies = []
+        self.statements = 0
+        self.failures = 0
+
+    def run(self, func, *args):
+        statements = self.counter.count
+        start = time.time()
+        try:
+            result = func(*args)
+        except Exception as e:
+            LOG.debug("Benchmarked call failed: %s" % e)
+            self.failures += 1
+            return None
+        self.latencies.append(time.time() - start)
+        self.statements += self.counter.count - statements
+        return result
+
+    def results(self):
+        done = len(self.latencies)
+        elapsed = sum(self.latencies)
+        return dict(count=done,
+                    failures=self.failures,
+                    per_second=elapsed and done / elapsed or 0.0,
+                    p50_ms=_percentile(self.latencies, 50) * 1000,
+                    p99_ms=_percentile(self.latencies, 99) * 1000,
+                    statements=done and self.statements / float(done) or 0.0)
+
+
+def _allocate(context, strategy, net_id, reuse_after):
+    port_id = uuidutils.generate_uuid()
+    with context.session.begin():
+        mac = strategy.allocate_mac_address(context, net_id, port_id,
+                                            reuse_after)
+        addresses = strategy.allocate_ip_address(
+            context, net_id, port_id, reuse_after,
+            mac_address=mac["address"])
+    return dict(id=port_id, device_id=port_id, mac=mac,
+                ip_addresses=addresses)
+
+
+def _deallocate(context, strategy, port):
+    with context.session.begin():
+        strategy.deallocate_ip_addresses_bulk(context, [port])
+        strategy.deallocate_mac_address(context, port["mac"]["address"])
+
+
+def _reset_database(engine):
+    models.BASEV2.metadata.drop_all(engine)
+    models.BASEV2.metadata.create_all(engine)
+
+
+def run_strategy(strategy_name, counter):
+    bench = CONF.benchmark
+    engine = neutron_session.get_engine()
+    _reset_database(engine)
+    admin = neutron_context.get_admin_context()
+    seed_start = time.time()
+    seed_args = [getattr(bench, opt) for opt in SEED_OPTS]
+    net_ids = datacenter.seed(admin, *seed_args)
+    LOG.info("Seeded %d networks for %s in %.1fs" %
+             (len(net_ids), strategy_name, time.time() - seed_start))
+
+    strategy = ipam.IPAM_REGISTRY.get_strategy(strategy_name)
+    context = neutron_context.Context("benchmark", "benchmark")
+    reuse_after = CONF.QUARK.ipam_reuse_after
+    allocations = Measurement(counter)
+    deallocations = Measurement(counter)
+    held = []
+    for i in xrange(bench.ports):
+        port = allocations.run(_allocate, context, strategy,
+                               net_ids[i % len(net_ids)], reuse_after)
+        if port is not None:
+            held.append(port)
+        if len(held) >= bench.outstanding:
+            deallocations.run(_deallocate, context, strategy, held.pop(0))
+    for port in held:
+        deallocations.run(_deallocate, context, strategy, port)
+    return dict(strategy=strategy_name,
+                allocate=allocations.results(),
+                deallocate=deallocations.results())
+
+
+def main():
+    neutron_cfg.init(sys.argv[1:])
+    neutron_cfg.setup_logging(neutron_cfg.cfg.CONF)
+    bench = CONF.benchmark
+    if os.path.exists(bench.db_file):
+        os.remove(bench.db_file)
+    CONF.set_override("connection",
+                      "sqlite:///%s" % os.path.abspath(bench.db_file),
+                      "database")
+    neutron_db_api.configure_db()
+    counter = StatementCounter(neutron_session.get_engine())
+
+    results = dict(
+        seed=dict([(opt, getattr(bench, opt)) for opt in SEED_OPTS]),
+        ports=bench.ports,
+        outstanding=bench.outstanding,
+        ipam_reuse_after=CONF.QUARK.ipam_reuse_after,
+        strategies=[run_strategy(name, counter)
+                    for name in bench.strategies])
+
+    for result in results["strategies"]:
+        allocate = result["allocate"]
+        LOG.info("%s: %.1f allocations/s, p50 %.1fms, p99 %.1fms, %.1f "
+                 "statements per allocation" % (
+                     result["strategy"], allocate["per_second"],
+                     allocate["p50_ms"], allocate["p99_ms"],
+                     allocate["statements"]))
+
+    if bench.output:
+        with open(bench.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures what the criteria cache of db_api._model_query saves.
+
+Every lookup runs cold, with the cache dropped before each call, and warm,
+with the criteria of its filter shape already built. Lookups go through
+_model_query alone and through the finders the API nodes call most, by id
+against an in-memory database, and the results are written as JSON.
+"""
+
+import json
+import sys
+import time
+
+import netaddr
+from neutron.common import config as neutron_cfg
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark.db import models
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+query_cache_opts = [
+    cfg.IntOpt("iterations", default=2000,
+               help=_("Calls timed per lookup, cold and warm each")),
+    cfg.StrOpt("output",
+               help=_("File the JSON results are written to, stdout if "
+                      "unset"))
+]
+
+CONF.register_cli_opts(query_cache_opts, "query_benchmark")
+
+
+def seed(context):
+    """Creates one of everything the finders look up, returns their ids."""
+    with context.session.begin():
+        net = db_api.network_create(context, name="benchmark",
+                                    network_plugin="BASE")
+        subnet = db_api.subnet_create(context, network=net,
+                                      cidr="10.0.0.0/24", ip_version=4,
+                                      next_auto_assign_ip=0)
+        address = netaddr.IPAddress("10.0.0.2")
+        ip = db_api.ip_address_create(context, address=address,
+                                      subnet_id=subnet["id"],
+                                      network_id=net["id"],
+                                      version=4)
+        first = int(netaddr.EUI("AA:BB:CC:00:00:00"))
+        mac_range = db_api.mac_address_range_create(
+            context, cidr="AA:BB:CC/24", first_address=first,
+            last_address=first + 2 ** 24, next_auto_assign_mac=first)
+        mac = db_api.mac_address_create(
+            context, address=first, mac_address_range_id=mac_range["id"])
+        port = db_api.port_create(context, network_id=net["id"],
+                                  backend_key="benchmark",
+                                  mac_address=mac["address"],
+                                  device_id="benchmark",
+                                  addresses=[ip])
+        group = db_api.security_group_create(context, name="benchmark")
+    return dict(network=net["id"], subnet=subnet["id"], ip=ip["id"],
+                mac=mac["address"], port=port["id"], group=group["id"])
+
+
+def lookups(ids):
+    """(name, function, args, filters) of every lookup timed."""
+    one = dict(scope=db_api.ONE)
+    return [
+        ("model_query", db_api._model_query, (models.Port,),
+         dict(filters=dict(id=[ids["port"]]))),
+        ("port_find", db_api.port_find, (),
+         dict(one, id=ids["port"])),
+        ("ip_address_find", db_api.ip_address_find, (),
+         dict(one, id=ids["ip"])),
+        ("subnet_find", db_api.subnet_find, (),
+         dict(one, id=ids["subnet"])),
+        ("network_find", db_api.network_find, (),
+         dict(one, id=ids["network"])),
+        ("mac_address_find", db_api.mac_address_find, (),
+         dict(one, address=ids["mac"])),
+        ("security_group_find", db_api.security_group_find, (),
+         dict(one, id=ids["group"]))]
+
+
+def _timed(context, func, args, kwargs, iterations, cold):
+    elapsed = 0.0
+    for i in xrange(iterations):
+        if cold:
+            db_api._CRITERIA_CACHE.clear()
+        start = time.time()
+        func(context, *args, **kwargs)
+        elapsed += time.time() - start
+    return elapsed / iterations * 1000000
+
+
+def run(context, ids, iterations):
+    results = []
+    for name, func, args, kwargs in lookups(ids):
+        cold = _timed(context, func, args, kwargs, iterations, True)
+        warm = _timed(context, func, args, kwargs, iterations, False)
+        results.append(dict(lookup=name, cold_us=cold, warm_us=warm,
+                            saved=cold and (cold - warm) / cold or 0.0))
+    return results
+
+
+def main():
+    neutron_cfg.init(sys.argv[1:])
+    neutron_cfg.setup_logging(neutron_cfg.cfg.CONF)
+    bench = CONF.query_benchmark
+    CONF.set_override("connection", "sqlite://", "database")
+    neutron_db_api.configure_db()
+    models.BASEV2.metadata.create_all(neutron_session.get_engine())
+    context = neutron_context.get_admin_context()
+
+    results = dict(iterations=bench.iterations,
+                   lookups=run(context, seed(context), bench.iterations))
+    for result in results["lookups"]:
+        LOG.info("%s: %.1fus cold, %.1fus warm, %.0f%% saved" % (
+            result["lookup"], result["cold_us"], result["warm_us"],
+            result["saved"] * 100))
+
+    if bench.output:
+        with open(bench.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,21 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 from logging import config as logging_config
 
+from quark.db import models
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
 # Interpret the config file for Python logging.
-# This line sets up loggers basically.
-logging_config.fileConfig(config.config_file_name)
+# This line sets up loggers basically. Configs built in code, like the
+# migration tests', come without a file.
+if config.config_file_name:
+    logging_config.fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
 # for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+target_metadata = models.BASEV2.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
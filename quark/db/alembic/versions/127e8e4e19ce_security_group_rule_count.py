@@ -0,0 +1,26 @@
+"""Security group rule count
+
+Revision ID: 127e8e4e19ce
+Revises: 9392cd4f56a7
+Create Date: 2026-10-16 10:01:42.864205
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '127e8e4e19ce'
+down_revision = '9392cd4f56a7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # NULL counters are seeded from a COUNT of the rules when first touched
+    op.add_column("quark_security_groups",
+                  sa.Column("rule_count", sa.Integer()))
+
+
+def downgrade():
+    # SQLite can't drop columns, older code ignores the leftover
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_column("quark_security_groups", "rule_count")
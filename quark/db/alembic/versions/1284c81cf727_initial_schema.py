@@ -0,0 +1,271 @@
+"""Initial schema
+
+The schema as deployments built it with create_all before the migrations
+existed. Those are stamped at this revision and upgraded from there.
+
+Revision ID: 1284c81cf727
+Revises: None
+Create Date: 2026-10-16 09:12:31.402781
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1284c81cf727'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+TABLES = ["quark_nvp_driver_security_profile", "quark_nvp_driver_qos",
+          "quark_nvp_driver_lswitchport", "quark_nvp_driver_lswitch",
+          "quark_tags", "quark_port_security_group_associations",
+          "quark_port_ip_address_associations", "quark_ports",
+          "quark_security_group_rule", "quark_security_groups",
+          "quark_mac_addresses", "quark_mac_address_ranges",
+          "quark_dns_nameservers", "quark_routes", "quark_ip_addresses",
+          "quark_subnets", "quark_networks", "quark_ip_policy_cidrs",
+          "quark_ip_policy", "quark_tag_associations"]
+
+
+def _inet():
+    """The INET type as it stood, decimal digits on sqlite, else a BLOB."""
+    return sa.LargeBinary().with_variant(sa.CHAR(39), "sqlite")
+
+
+def upgrade():
+    op.create_table(
+        "quark_tag_associations",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("discriminator", sa.String(255)),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_ip_policy",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("name", sa.String(255)),
+        sa.Column("description", sa.String(255)),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_ip_policy_cidrs",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("ip_policy_id", sa.String(36),
+                  sa.ForeignKey("quark_ip_policy.id", ondelete="CASCADE")),
+        sa.Column("cidr", sa.String(64)),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_networks",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("name", sa.String(255)),
+        sa.Column("ip_policy_id", sa.String(36),
+                  sa.ForeignKey("quark_ip_policy.id")),
+        sa.Column("network_plugin", sa.String(36)),
+        sa.Column("ipam_strategy", sa.String(255)),
+        sa.Column("tenant_id", sa.String(255)),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_networks_tenant_id", "quark_networks",
+                    ["tenant_id"])
+
+    op.create_table(
+        "quark_subnets",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("tag_association_uuid", sa.String(36),
+                  sa.ForeignKey("quark_tag_associations.id")),
+        sa.Column("name", sa.String(255)),
+        sa.Column("network_id", sa.String(36),
+                  sa.ForeignKey("quark_networks.id")),
+        sa.Column("_cidr", sa.String(64), nullable=False),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("segment_id", sa.String(255)),
+        sa.Column("first_ip", _inet()),
+        sa.Column("last_ip", _inet()),
+        sa.Column("ip_version", sa.Integer()),
+        sa.Column("next_auto_assign_ip", _inet()),
+        sa.Column("enable_dhcp", sa.Boolean()),
+        sa.Column("ip_policy_id", sa.String(36),
+                  sa.ForeignKey("quark_ip_policy.id")),
+        sa.Column("do_not_use", sa.Boolean()),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_subnets_tenant_id", "quark_subnets",
+                    ["tenant_id"])
+    op.create_index("ix_quark_subnets_segment_id", "quark_subnets",
+                    ["segment_id"])
+
+    op.create_table(
+        "quark_ip_addresses",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("address_readable", sa.String(128), nullable=False),
+        sa.Column("address", _inet(), nullable=False),
+        sa.Column("subnet_id", sa.String(36),
+                  sa.ForeignKey("quark_subnets.id", ondelete="CASCADE")),
+        sa.Column("network_id", sa.String(36),
+                  sa.ForeignKey("quark_networks.id", ondelete="CASCADE")),
+        sa.Column("version", sa.Integer()),
+        sa.Column("allocated_at", sa.DateTime()),
+        sa.Column("_deallocated", sa.Boolean()),
+        sa.Column("used_by_tenant_id", sa.String(255)),
+        sa.Column("deallocated_at", sa.DateTime()),
+        mysql_engine="InnoDB")
+
+    op.create_table(
+        "quark_routes",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("tag_association_uuid", sa.String(36),
+                  sa.ForeignKey("quark_tag_associations.id")),
+        sa.Column("cidr", sa.String(64)),
+        sa.Column("gateway", sa.String(64)),
+        sa.Column("subnet_id", sa.String(36),
+                  sa.ForeignKey("quark_subnets.id", ondelete="CASCADE")),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_dns_nameservers",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("tag_association_uuid", sa.String(36),
+                  sa.ForeignKey("quark_tag_associations.id")),
+        sa.Column("ip", _inet()),
+        sa.Column("subnet_id", sa.String(36),
+                  sa.ForeignKey("quark_subnets.id", ondelete="CASCADE")),
+        mysql_engine="InnoDB")
+
+    op.create_table(
+        "quark_mac_address_ranges",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("cidr", sa.String(255), nullable=False),
+        sa.Column("first_address", sa.BigInteger(), nullable=False),
+        sa.Column("last_address", sa.BigInteger(), nullable=False),
+        sa.Column("next_auto_assign_mac", sa.BigInteger(), nullable=False),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_mac_addresses",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("address", sa.BigInteger(), primary_key=True),
+        sa.Column("mac_address_range_id", sa.String(36),
+                  sa.ForeignKey("quark_mac_address_ranges.id",
+                                ondelete="CASCADE"),
+                  nullable=False),
+        sa.Column("deallocated", sa.Boolean()),
+        sa.Column("deallocated_at", sa.DateTime()),
+        mysql_engine="InnoDB")
+
+    op.create_table(
+        "quark_security_groups",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("description", sa.String(255), nullable=False),
+        sa.Column("tenant_id", sa.String(255)),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_security_groups_tenant_id",
+                    "quark_security_groups", ["tenant_id"])
+    op.create_table(
+        "quark_security_group_rule",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("group_id", sa.String(36),
+                  sa.ForeignKey("quark_security_groups.id"),
+                  nullable=False),
+        sa.Column("direction", sa.String(10), nullable=False),
+        sa.Column("ethertype", sa.String(4), nullable=False),
+        sa.Column("port_range_max", sa.Integer()),
+        sa.Column("port_range_min", sa.Integer()),
+        sa.Column("protocol", sa.Integer()),
+        sa.Column("remote_ip_prefix", sa.String(22)),
+        sa.Column("remote_group_id", sa.String(36)),
+        mysql_engine="InnoDB")
+
+    op.create_table(
+        "quark_ports",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("name", sa.String(255)),
+        sa.Column("admin_state_up", sa.Boolean()),
+        sa.Column("network_id", sa.String(36),
+                  sa.ForeignKey("quark_networks.id"), nullable=False),
+        sa.Column("backend_key", sa.String(36), nullable=False),
+        sa.Column("mac_address", sa.BigInteger()),
+        sa.Column("device_id", sa.String(255), nullable=False),
+        sa.Column("device_owner", sa.String(255)),
+        sa.Column("bridge", sa.String(255)),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_ports_device_id", "quark_ports", ["device_id"])
+    op.create_index("idx_ports_1", "quark_ports", ["device_id", "tenant_id"])
+    op.create_index("idx_ports_2", "quark_ports",
+                    ["device_owner", "network_id"])
+
+    op.create_table(
+        "quark_port_ip_address_associations",
+        sa.Column("port_id", sa.String(36), sa.ForeignKey("quark_ports.id")),
+        sa.Column("ip_address_id", sa.String(36),
+                  sa.ForeignKey("quark_ip_addresses.id")),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_port_security_group_associations",
+        sa.Column("port_id", sa.String(36), sa.ForeignKey("quark_ports.id")),
+        sa.Column("group_id", sa.String(36),
+                  sa.ForeignKey("quark_security_groups.id")),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_tags",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("association_uuid", sa.String(36),
+                  sa.ForeignKey("quark_tag_associations.id"),
+                  nullable=False),
+        sa.Column("tag", sa.String(255), nullable=False),
+        mysql_engine="InnoDB")
+
+    # Tables of quark.drivers.optimized_nvp_driver
+    op.create_table(
+        "quark_nvp_driver_lswitch",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("nvp_id", sa.String(36), nullable=False),
+        sa.Column("network_id", sa.String(36), nullable=False),
+        sa.Column("display_name", sa.String(255)),
+        sa.Column("port_count", sa.Integer()),
+        sa.Column("transport_zone", sa.String(36)),
+        sa.Column("transport_connector", sa.String(20)),
+        sa.Column("segment_id", sa.Integer()),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_nvp_driver_lswitchport",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("port_id", sa.String(36), nullable=False),
+        sa.Column("switch_id", sa.String(36),
+                  sa.ForeignKey("quark_nvp_driver_lswitch.id"),
+                  nullable=False),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_nvp_driver_qos",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("display_name", sa.String(255), nullable=False),
+        sa.Column("max_bandwidth_rate", sa.Integer(), nullable=False),
+        sa.Column("min_bandwidth_rate", sa.Integer(), nullable=False),
+        mysql_engine="InnoDB")
+    op.create_table(
+        "quark_nvp_driver_security_profile",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("nvp_id", sa.String(36), nullable=False),
+        mysql_engine="InnoDB")
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_table(table)
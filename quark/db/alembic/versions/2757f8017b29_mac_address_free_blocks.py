@@ -0,0 +1,48 @@
+"""MAC address free blocks and counts
+
+Revision ID: 2757f8017b29
+Revises: d657f84071ce
+Create Date: 2026-10-16 09:38:55.019643
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2757f8017b29'
+down_revision = 'd657f84071ce'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+COLUMNS = [("free_blocks_indexed", sa.Boolean()),
+           ("generated_count", sa.Integer()),
+           ("allocated_count", sa.Integer())]
+
+
+def upgrade():
+    for name, type_ in COLUMNS:
+        op.add_column("quark_mac_address_ranges", sa.Column(name, type_))
+    op.create_table(
+        "quark_mac_address_free_blocks",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("mac_address_range_id", sa.String(36),
+                  sa.ForeignKey("quark_mac_address_ranges.id",
+                                ondelete="CASCADE"),
+                  nullable=False),
+        sa.Column("first_address", sa.BigInteger(), nullable=False),
+        sa.Column("last_address", sa.BigInteger(), nullable=False),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_mac_address_free_blocks_mac_address_range_id",
+                    "quark_mac_address_free_blocks", ["mac_address_range_id"])
+
+
+def downgrade():
+    op.drop_index("ix_quark_mac_address_free_blocks_mac_address_range_id",
+                  "quark_mac_address_free_blocks")
+    op.drop_table("quark_mac_address_free_blocks")
+    # SQLite can't drop columns, older code ignores the leftovers
+    if op.get_bind().dialect.name == "sqlite":
+        return
+    for name, type_ in COLUMNS:
+        op.drop_column("quark_mac_address_ranges", name)
@@ -0,0 +1,48 @@
+"""Subnet IP count deltas
+
+Revision ID: 2f81c6a4d3e9
+Revises: 4c7d2e91f0b5
+Create Date: 2026-10-16 23:02:41.905733
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2f81c6a4d3e9'
+down_revision = '4c7d2e91f0b5'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "quark_subnet_ip_count_deltas",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("subnet_id", sa.String(36),
+                  sa.ForeignKey("quark_subnets.id", ondelete="CASCADE"),
+                  nullable=False),
+        sa.Column("generated", sa.Integer(), nullable=False),
+        sa.Column("allocated", sa.Integer(), nullable=False),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_subnet_ip_count_deltas_subnet_id",
+                    "quark_subnet_ip_count_deltas", ["subnet_id"])
+
+
+def downgrade():
+    # Fold the pending deltas into the counters before they're dropped
+    subnets = sa.sql.table("quark_subnets", sa.sql.column("id"),
+                           sa.sql.column("generated_count"),
+                           sa.sql.column("allocated_count"))
+    deltas = sa.sql.table("quark_subnet_ip_count_deltas",
+                          sa.sql.column("subnet_id"),
+                          sa.sql.column("generated"),
+                          sa.sql.column("allocated"))
+    for counter, delta in (("generated_count", "generated"),
+                           ("allocated_count", "allocated")):
+        pending = sa.select([sa.func.coalesce(sa.func.sum(deltas.c[delta]),
+                                              0)]).where(
+            deltas.c.subnet_id == subnets.c.id).as_scalar()
+        op.execute(subnets.update().values(
+            {counter: subnets.c[counter] + pending}))
+    op.drop_table("quark_subnet_ip_count_deltas")
@@ -0,0 +1,36 @@
+"""Hot path indexes
+
+Revision ID: 3a47813ce501
+Revises: 4cd15567f355
+Create Date: 2026-10-16 10:47:05.118245
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a47813ce501'
+down_revision = '4cd15567f355'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index("idx_quark_ip_addresses_reallocate", "quark_ip_addresses",
+                    ["network_id", "_deallocated", "deallocated_at",
+                     "version"])
+    op.create_index("idx_quark_ip_addresses_network_address",
+                    "quark_ip_addresses", ["network_id", "address"],
+                    mysql_length=16)
+    op.create_index("idx_quark_mac_addresses_deallocated",
+                    "quark_mac_addresses", ["deallocated", "deallocated_at"])
+    op.create_index("idx_quark_port_ip_address_associations_ip",
+                    "quark_port_ip_address_associations", ["ip_address_id"])
+
+
+def downgrade():
+    op.drop_index("idx_quark_port_ip_address_associations_ip",
+                  "quark_port_ip_address_associations")
+    op.drop_index("idx_quark_mac_addresses_deallocated",
+                  "quark_mac_addresses")
+    op.drop_index("idx_quark_ip_addresses_network_address",
+                  "quark_ip_addresses")
+    op.drop_index("idx_quark_ip_addresses_reallocate", "quark_ip_addresses")
@@ -0,0 +1,59 @@
+"""IP and MAC address archives
+
+Revision ID: 43f52ce04930
+Revises: 561832f14669
+Create Date: 2026-10-16 10:26:50.418716
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '43f52ce04930'
+down_revision = '561832f14669'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def _inet():
+    # Addresses still stored as decimal digits, 52b9f3d1a8c4 rewrites them
+    return sa.LargeBinary().with_variant(sa.CHAR(39), "sqlite")
+
+
+def upgrade():
+    op.create_table(
+        "quark_ip_addresses_archive",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("address_readable", sa.String(128), nullable=False),
+        sa.Column("address", _inet(), nullable=False),
+        sa.Column("subnet_id", sa.String(36)),
+        sa.Column("network_id", sa.String(36)),
+        sa.Column("version", sa.Integer()),
+        sa.Column("allocated_at", sa.DateTime()),
+        sa.Column("_deallocated", sa.Boolean()),
+        sa.Column("used_by_tenant_id", sa.String(255)),
+        sa.Column("deallocated_at", sa.DateTime()),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_ip_addresses_archive_address_readable",
+                    "quark_ip_addresses_archive", ["address_readable"])
+    op.create_table(
+        "quark_mac_addresses_archive",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("tenant_id", sa.String(255)),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("address", sa.BigInteger(), nullable=False),
+        sa.Column("mac_address_range_id", sa.String(36), nullable=False),
+        sa.Column("deallocated", sa.Boolean()),
+        sa.Column("deallocated_at", sa.DateTime()),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_mac_addresses_archive_address",
+                    "quark_mac_addresses_archive", ["address"])
+
+
+def downgrade():
+    op.drop_index("ix_quark_mac_addresses_archive_address",
+                  "quark_mac_addresses_archive")
+    op.drop_table("quark_mac_addresses_archive")
+    op.drop_index("ix_quark_ip_addresses_archive_address_readable",
+                  "quark_ip_addresses_archive")
+    op.drop_table("quark_ip_addresses_archive")
@@ -0,0 +1,22 @@
+"""Count ports by network
+
+Revision ID: 4c7d2e91f0b5
+Revises: 52b9f3d1a8c4
+Create Date: 2026-10-16 22:31:14.380512
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c7d2e91f0b5'
+down_revision = '52b9f3d1a8c4'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index("idx_quark_ports_network_id", "quark_ports",
+                    ["network_id"])
+
+
+def downgrade():
+    op.drop_index("idx_quark_ports_network_id", "quark_ports")
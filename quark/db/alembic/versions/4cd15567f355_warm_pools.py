@@ -0,0 +1,33 @@
+"""Warm pools
+
+Revision ID: 4cd15567f355
+Revises: 43f52ce04930
+Create Date: 2026-10-16 10:35:12.657093
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4cd15567f355'
+down_revision = '43f52ce04930'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TABLES = ["quark_ip_addresses", "quark_ip_addresses_archive"]
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column("reserved_at", sa.DateTime()))
+    op.create_index("idx_quark_ip_addresses_reserved", "quark_ip_addresses",
+                    ["network_id", "reserved_at"])
+
+
+def downgrade():
+    op.drop_index("idx_quark_ip_addresses_reserved", "quark_ip_addresses")
+    # SQLite can't drop columns, older code ignores the leftovers
+    if op.get_bind().dialect.name == "sqlite":
+        return
+    for table in TABLES:
+        op.drop_column(table, "reserved_at")
@@ -0,0 +1,108 @@
+"""Fixed width INET encoding
+
+Revision ID: 52b9f3d1a8c4
+Revises: 3a47813ce501
+Create Date: 2026-10-16 14:03:52.660197
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52b9f3d1a8c4'
+down_revision = '3a47813ce501'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+from quark.db import custom_types
+
+# Every INET column, by table
+INET_COLUMNS = {
+    "quark_ip_addresses": ["address"],
+    "quark_ip_addresses_archive": ["address"],
+    "quark_dns_nameservers": ["ip"],
+    "quark_subnet_free_ranges": ["first_ip", "last_ip"],
+    "quark_subnets": ["first_ip", "last_ip", "next_auto_assign_ip"]}
+NOT_NULL = [("quark_ip_addresses", "address"),
+            ("quark_ip_addresses_archive", "address"),
+            ("quark_subnet_free_ranges", "first_ip"),
+            ("quark_subnet_free_ranges", "last_ip")]
+
+BATCH_SIZE = 1000
+
+
+def _old_to_db(value, dialect_name):
+    # Addresses used to be stored as their decimal digits
+    return custom_types.inet_to_db(long(str(value)), dialect_name)
+
+
+def _db_to_old(value, dialect_name):
+    return str(custom_types.inet_from_db(value, dialect_name))
+
+
+def _rewrite(table_name, columns, convert):
+    """Rewrites the columns of every row of a table, a batch at a time."""
+    bind = op.get_bind()
+    dialect_name = bind.dialect.name
+    # Untyped columns, the values are converted here
+    table = sa.sql.table(table_name, sa.sql.column("id"),
+                         *[sa.sql.column(name) for name in columns])
+    update = table.update().where(table.c.id == sa.bindparam("_id")).values(
+        dict([(name, sa.bindparam("_%s" % name)) for name in columns]))
+    last_id = None
+    while True:
+        query = sa.select([table.c.id] + [table.c[name] for name in columns])
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        rows = bind.execute(query.order_by(table.c.id).limit(BATCH_SIZE))
+        rows = rows.fetchall()
+        if not rows:
+            return
+        params = []
+        for row in rows:
+            values = {"_id": row[0]}
+            for i, name in enumerate(columns):
+                value = row[i + 1]
+                if value is not None:
+                    value = convert(value, dialect_name)
+                values["_%s" % name] = value
+            params.append(values)
+        bind.execute(update, params)
+        last_id = rows[-1][0]
+
+
+def _alter_mysql_columns(type_):
+    op.drop_index("idx_quark_ip_addresses_network_address",
+                  "quark_ip_addresses")
+    for table_name, columns in INET_COLUMNS.items():
+        for name in columns:
+            nullable = (table_name, name) not in NOT_NULL
+            op.alter_column(table_name, name, type_=type_,
+                            existing_nullable=nullable)
+
+
+def upgrade():
+    for table_name, columns in INET_COLUMNS.items():
+        _rewrite(table_name, columns, _old_to_db)
+    # MySQL can index the fixed width column without a prefix length
+    if op.get_bind().dialect.name == "mysql":
+        _alter_mysql_columns(mysql.BINARY(custom_types.INET_BYTES))
+        op.create_index("idx_quark_ip_addresses_network_address",
+                        "quark_ip_addresses", ["network_id", "address"])
+    op.create_index("idx_quark_subnets_first_ip", "quark_subnets",
+                    ["first_ip", "last_ip"])
+    op.create_index("idx_quark_subnet_free_ranges_first_ip",
+                    "quark_subnet_free_ranges", ["subnet_id", "first_ip"])
+
+
+def downgrade():
+    op.drop_index("idx_quark_subnet_free_ranges_first_ip",
+                  "quark_subnet_free_ranges")
+    op.drop_index("idx_quark_subnets_first_ip", "quark_subnets")
+    if op.get_bind().dialect.name == "mysql":
+        _alter_mysql_columns(sa.LargeBinary())
+        op.create_index("idx_quark_ip_addresses_network_address",
+                        "quark_ip_addresses", ["network_id", "address"],
+                        mysql_length=16)
+    for table_name, columns in INET_COLUMNS.items():
+        _rewrite(table_name, columns, _db_to_old)
@@ -0,0 +1,39 @@
+"""IP address reuse queue
+
+Revision ID: 561832f14669
+Revises: fa9260862452
+Create Date: 2026-10-16 10:17:26.902331
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '561832f14669'
+down_revision = 'fa9260862452'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Filled as addresses are deallocated, quark-ipam-repair queues the older
+    # ones
+    op.create_table(
+        "quark_ip_address_reuse",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("address_id", sa.String(36),
+                  sa.ForeignKey("quark_ip_addresses.id", ondelete="CASCADE"),
+                  primary_key=True),
+        sa.Column("network_id", sa.String(36)),
+        sa.Column("subnet_id", sa.String(36)),
+        sa.Column("version", sa.Integer()),
+        sa.Column("deallocated_at", sa.DateTime()),
+        mysql_engine="InnoDB")
+    op.create_index("idx_quark_ip_address_reuse_queue",
+                    "quark_ip_address_reuse",
+                    ["network_id", "version", "deallocated_at"])
+
+
+def downgrade():
+    op.drop_index("idx_quark_ip_address_reuse_queue",
+                  "quark_ip_address_reuse")
+    op.drop_table("quark_ip_address_reuse")
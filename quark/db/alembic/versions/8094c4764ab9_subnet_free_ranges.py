@@ -0,0 +1,46 @@
+"""Subnet free ranges
+
+Revision ID: 8094c4764ab9
+Revises: 1284c81cf727
+Create Date: 2026-10-16 09:21:47.203915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8094c4764ab9'
+down_revision = '1284c81cf727'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def _inet():
+    # Addresses still stored as decimal digits, 52b9f3d1a8c4 rewrites them
+    return sa.LargeBinary().with_variant(sa.CHAR(39), "sqlite")
+
+
+def upgrade():
+    # Subnets are indexed on first use, until then allocation probes
+    op.add_column("quark_subnets",
+                  sa.Column("free_ranges_indexed", sa.Boolean()))
+    op.create_table(
+        "quark_subnet_free_ranges",
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("id", sa.String(36), primary_key=True),
+        sa.Column("subnet_id", sa.String(36),
+                  sa.ForeignKey("quark_subnets.id", ondelete="CASCADE"),
+                  nullable=False),
+        sa.Column("first_ip", _inet(), nullable=False),
+        sa.Column("last_ip", _inet(), nullable=False),
+        mysql_engine="InnoDB")
+    op.create_index("ix_quark_subnet_free_ranges_subnet_id",
+                    "quark_subnet_free_ranges", ["subnet_id"])
+
+
+def downgrade():
+    op.drop_index("ix_quark_subnet_free_ranges_subnet_id",
+                  "quark_subnet_free_ranges")
+    op.drop_table("quark_subnet_free_ranges")
+    # SQLite can't drop columns, older code ignores the leftover
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_column("quark_subnets", "free_ranges_indexed")
@@ -0,0 +1,29 @@
+"""Pagination indexes
+
+Revision ID: 9392cd4f56a7
+Revises: ed8287da9aaa
+Create Date: 2026-10-16 09:52:19.330847
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9392cd4f56a7'
+down_revision = 'ed8287da9aaa'
+
+from alembic import op
+
+
+# Paginated listings are ordered and resumed on (created_at, id)
+TABLES = ["quark_ip_addresses", "quark_subnets", "quark_security_group_rule",
+          "quark_security_groups", "quark_ports", "quark_networks"]
+
+
+def upgrade():
+    for table in TABLES:
+        op.create_index("idx_%s_created_at" % table, table,
+                        ["created_at", "id"])
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index("idx_%s_created_at" % table, table)
@@ -0,0 +1,31 @@
+"""Subnet IP counts
+
+Revision ID: d657f84071ce
+Revises: 8094c4764ab9
+Create Date: 2026-10-16 09:30:08.771402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd657f84071ce'
+down_revision = '8094c4764ab9'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+COLUMNS = ["generated_count", "allocated_count"]
+
+
+def upgrade():
+    # NULL counters are seeded from a COUNT of the addresses when first read
+    for name in COLUMNS:
+        op.add_column("quark_subnets", sa.Column(name, sa.Integer()))
+
+
+def downgrade():
+    # SQLite can't drop columns, older code ignores the leftovers
+    if op.get_bind().dialect.name == "sqlite":
+        return
+    for name in COLUMNS:
+        op.drop_column("quark_subnets", name)
@@ -0,0 +1,24 @@
+"""IP policy revision
+
+Revision ID: ed8287da9aaa
+Revises: 2757f8017b29
+Create Date: 2026-10-16 09:44:31.587120
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'ed8287da9aaa'
+down_revision = '2757f8017b29'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column("quark_ip_policy", sa.Column("revision", sa.Integer()))
+
+
+def downgrade():
+    # SQLite can't drop columns, older code ignores the leftover
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_column("quark_ip_policy", "revision")
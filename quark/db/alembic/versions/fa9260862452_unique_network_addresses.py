@@ -0,0 +1,32 @@
+"""Unique addresses per network
+
+Revision ID: fa9260862452
+Revises: 127e8e4e19ce
+Create Date: 2026-10-16 10:09:03.145578
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'fa9260862452'
+down_revision = '127e8e4e19ce'
+
+from alembic import op
+
+
+NAME = "uq_quark_ip_addresses_network_id_address"
+COLUMNS = ["network_id", "address_readable"]
+
+
+def upgrade():
+    # SQLite can't add constraints to a table, a unique index does the same
+    if op.get_bind().dialect.name == "sqlite":
+        op.create_index(NAME, "quark_ip_addresses", COLUMNS, unique=True)
+    else:
+        op.create_unique_constraint(NAME, "quark_ip_addresses", COLUMNS)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "sqlite":
+        op.drop_index(NAME, "quark_ip_addresses")
+    else:
+        op.drop_constraint(NAME, "quark_ip_addresses", "unique")
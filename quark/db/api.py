@@ -15,15 +15,20 @@
 
 import datetime
 import inspect
+import random
 
+import netaddr
+from neutron.common import exceptions
+from neutron.db import sqlalchemyutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import timeutils
 from neutron.openstack.common import uuidutils
 from sqlalchemy import event
 from sqlalchemy import func as sql_func
-from sqlalchemy import and_, asc, orm, or_
+from sqlalchemy import and_, asc, orm, or_, sql
 
 from quark.db import models
+from quark import ip_policy_cache
 from quark import network_strategy
 
 
@@ -33,6 +38,32 @@ LOG = logging.getLogger(__name__)
 ONE = "one"
 ALL = "all"
 
+# Relationships the list views render for every row. Each path is batch
+# loaded with one extra query per hop for the whole result set rather than
+# lazily loaded per row, so listing N rows costs the same as listing one.
+PORT_LIST_LOADS = ("ip_addresses", "security_groups")
+NETWORK_LIST_LOADS = ("subnets",)
+SUBNET_LIST_LOADS = ("routes", "dns_nameservers", "ip_policy.exclude",
+                     "network.ip_policy.exclude")
+IP_ADDRESS_LIST_LOADS = ("ports",)
+SECURITY_GROUP_LIST_LOADS = ("rules",)
+
+# Keyset order of paginated listings, backed by (created_at, id) indexes
+DEFAULT_SORTS = [("created_at", True), ("id", True)]
+
+# Model attributes the views read to render each API field, for the fields
+# that aren't simply the attribute of the same name.
+PORT_FIELD_ATTRS = {"fixed_ips": ("ip_addresses",)}
+NETWORK_FIELD_ATTRS = {}
+SUBNET_FIELD_ATTRS = {
+    "cidr": ("_cidr",),
+    "shared": ("network_id",),
+    "allocation_pools": ("_cidr", "ip_policy_id", "ip_policy", "network_id",
+                         "network"),
+    "host_routes": ("routes",),
+    "gateway_ip": ("routes",)}
+SECURITY_GROUP_FIELD_ATTRS = {"security_group_rules": ("rules",)}
+
 
 # NOTE(jkoelker) init event listener that will ensure id is filled in
 #                on object creation (prior to commit).
@@ -61,61 +92,98 @@ def _listify(filters):
             filters[key] = listified
 
 
-def _model_query(context, model, filters, fields=None):
-    filters = filters or {}
-    model_filters = []
-
-    if filters.get("name"):
-        model_filters.append(model.name.in_(filters["name"]))
-
-    if filters.get("network_id"):
-        model_filters.append(model.network_id.in_(filters["network_id"]))
-
-    if filters.get("mac_address"):
-        model_filters.append(model.mac_address.in_(filters["mac_address"]))
-
-    if filters.get("segment_id"):
-        model_filters.append(model.segment_id.in_(filters["segment_id"]))
-
-    if filters.get("id"):
-        model_filters.append(model.id.in_(filters["id"]))
-
-    if filters.get("reuse_after"):
-        reuse_after = filters["reuse_after"]
-        reuse = (timeutils.utcnow() -
-                 datetime.timedelta(seconds=reuse_after))
-        model_filters.append(model.deallocated_at <= reuse)
-
-    if filters.get("subnet_id"):
-        model_filters.append(model.subnet_id.in_(filters["subnet_id"]))
-
-    if filters.get("deallocated"):
-        model_filters.append(model.deallocated == filters["deallocated"])
-
-    if filters.get("_deallocated") is not None:
-        if filters.get("_deallocated"):
-            model_filters.append(model._deallocated == 1)
+def _reuse_horizon(reuse_after):
+    return timeutils.utcnow() - datetime.timedelta(seconds=reuse_after)
+
+
+# How _model_query turns filters into criteria, in the order it applies
+# them: (filter, model attribute, comparison, value conversion). IN filters
+# take a list, FLAG filters compare against a constant picked by the truth
+# of the value and apply unless it's None, the rest apply when truthy.
+IN, EQ, LE, FLAG = "in", "eq", "le", "flag"
+MODEL_FILTERS = [
+    ("name", "name", IN, None),
+    ("network_id", "network_id", IN, None),
+    ("mac_address", "mac_address", IN, None),
+    ("segment_id", "segment_id", IN, None),
+    ("id", "id", IN, None),
+    ("reuse_after", "deallocated_at", LE, _reuse_horizon),
+    ("subnet_id", "subnet_id", IN, None),
+    ("deallocated", "deallocated", EQ, None),
+    ("_deallocated", "_deallocated", FLAG, None),
+    ("address", "address", EQ, None),
+    ("version", "version", IN, None),
+    ("ip_version", "ip_version", EQ, None),
+    ("ip_address", "address", EQ, int),
+    ("mac_address_range_id", "mac_address_range_id", EQ, None),
+    ("cidr", "cidr", EQ, None),
+    ("tenant_id", "tenant_id", IN, None)]
+
+# Criteria built so far, keyed by model and filter shape. Shapes with long
+# IN lists are built every time, the cache is dropped when it fills up.
+CRITERIA_CACHE_MAX_ENTRIES = 1024
+CRITERIA_CACHE_MAX_IN = 16
+_CRITERIA_CACHE = {}
+
+
+def _filter_shape(filters):
+    """Splits filters into their shape and the values to bind.
+
+    The shape names the filters that apply, with the length of IN lists
+    and the truth of FLAG values, so criteria built for one shape fit every
+    filters of the same shape.
+    """
+    shape = []
+    values = {}
+    for key, attr, comparison, convert in MODEL_FILTERS:
+        value = filters.get(key)
+        if comparison == FLAG:
+            if value is not None:
+                shape.append((key, bool(value)))
+            continue
+        if not value:
+            continue
+        if comparison == IN:
+            value = list(value)
+            shape.append((key, len(value)))
+            for i, item in enumerate(value):
+                values["filter_%s_%d" % (key, i)] = item
         else:
-            model_filters.append(model._deallocated != 1)
-
-    if filters.get("address"):
-        model_filters.append(model.address == filters["address"])
-
-    if filters.get("version"):
-        model_filters.append(model.version.in_(filters["version"]))
-
-    if filters.get("ip_version"):
-        model_filters.append(model.ip_version == filters["ip_version"])
+            if convert:
+                value = convert(value)
+            shape.append((key, None))
+            values["filter_%s" % key] = value
+    return tuple(shape), values
+
+
+def _build_criteria(model, shape):
+    comparisons = dict([(key, (attr, comparison))
+                        for key, attr, comparison, convert in MODEL_FILTERS])
+    clauses = []
+    for key, arg in shape:
+        attr, comparison = comparisons[key]
+        column = getattr(model, attr)
+        if comparison == IN:
+            clauses.append(column.in_([sql.bindparam("filter_%s_%d" % (key, i))
+                                       for i in xrange(arg)]))
+        elif comparison == FLAG and arg:
+            clauses.append(column == 1)
+        elif comparison == FLAG:
+            clauses.append(column != 1)
+        elif comparison == LE:
+            clauses.append(column <= sql.bindparam("filter_%s" % key))
+        else:
+            clauses.append(column == sql.bindparam("filter_%s" % key))
+    return and_(*clauses)
 
-    if filters.get("ip_address"):
-        model_filters.append(model.address == int(filters["ip_address"]))
 
-    if filters.get("mac_address_range_id"):
-        model_filters.append(model.mac_address_range_id ==
-                             filters["mac_address_range_id"])
+def _model_query(context, model, filters, fields=None):
+    """Returns the criteria for filters, a list of at most one clause.
 
-    if filters.get("cidr"):
-        model_filters.append(model.cidr == filters["cidr"])
+    The clause is built once per model and filter shape out of bound
+    parameters, later calls only bind their values.
+    """
+    filters = filters or {}
 
     # Inject the tenant id if none is set. We don't need unqualified queries.
     # This works even when a non-shared, other-tenant owned network is passed
@@ -124,10 +192,75 @@ def _model_query(context, model, filters, fields=None):
     if not filters and not context.is_admin:
         filters["tenant_id"] = [context.tenant_id]
 
-    if filters.get("tenant_id"):
-        model_filters.append(model.tenant_id.in_(filters["tenant_id"]))
-
-    return model_filters
+    shape, values = _filter_shape(filters)
+    if not shape:
+        return []
+    cache_key = (model, shape)
+    criteria = _CRITERIA_CACHE.get(cache_key)
+    if criteria is None:
+        criteria = _build_criteria(model, shape)
+        if all([arg is None or arg <= CRITERIA_CACHE_MAX_IN
+                for key, arg in shape]):
+            if len(_CRITERIA_CACHE) >= CRITERIA_CACHE_MAX_ENTRIES:
+                _CRITERIA_CACHE.clear()
+            _CRITERIA_CACHE[cache_key] = criteria
+    return [criteria.params(values)]
+
+
+def _eager_load(query, paths):
+    return query.options(*[orm.subqueryload_all(path) for path in paths])
+
+
+def _load_fields(query, model, fields, paths, field_attrs):
+    """Loads only what rendering the requested API fields needs.
+
+    Columns of other fields are deferred and relationships nobody asked for
+    aren't loaded at all. Without fields everything in paths is eager loaded.
+    """
+    if not fields:
+        return _eager_load(query, paths)
+
+    attrs = set()
+    for field in fields:
+        attrs.update(field_attrs.get(field, (field,)))
+
+    options = [orm.subqueryload_all(path) for path in paths
+               if path.split(".")[0] in attrs]
+    for prop in orm.class_mapper(model).iterate_properties:
+        if prop.key in attrs:
+            continue
+        if isinstance(prop, orm.RelationshipProperty):
+            options.append(orm.noload(prop.key))
+        elif isinstance(prop, orm.ColumnProperty):
+            if not [col for col in prop.columns if col.primary_key]:
+                options.append(orm.defer(prop.key))
+    return query.options(*options)
+
+
+def _paginate(context, query, model, limit=None, sorts=None, marker=None,
+              page_reverse=False):
+    """Keyset pagination of a finder query.
+
+    Pages resume right after the marker row on the sort keys instead of
+    skipping over an offset, so any page costs the same as the first one.
+    """
+    if not (limit or sorts or marker):
+        return query
+
+    sorts = list(sorts or DEFAULT_SORTS)
+    if "id" not in [key for key, direction in sorts]:
+        sorts.append(("id", True))
+    if page_reverse:
+        sorts = [(key, not direction) for key, direction in sorts]
+
+    marker_obj = None
+    if marker:
+        marker_obj = context.session.query(model).get(marker)
+        if not marker_obj:
+            raise exceptions.BadRequest(resource=model.__tablename__,
+                                        msg="Marker %s not found" % marker)
+    return sqlalchemyutils.paginate_query(query, model, limit, sorts,
+                                          marker_obj)
 
 
 def scoped(f):
@@ -158,9 +291,10 @@ def scoped(f):
 
 
 @scoped
-def port_find(context, **filters):
-    query = context.session.query(models.Port).\
-        options(orm.joinedload(models.Port.ip_addresses))
+def port_find(context, fields=None, limit=None, sorts=None, marker=None,
+              page_reverse=False, **filters):
+    query = _load_fields(context.session.query(models.Port), models.Port,
+                         fields, PORT_LIST_LOADS, PORT_FIELD_ATTRS)
 
     model_filters = _model_query(context, models.Port, filters)
     if filters.get("ip_address_id"):
@@ -170,7 +304,25 @@ def port_find(context, **filters):
     if filters.get("device_id"):
         model_filters.append(models.Port.device_id.in_(filters["device_id"]))
 
-    return query.filter(*model_filters).order_by(asc(models.Port.created_at))
+    return _paginate(context, query.filter(*model_filters), models.Port,
+                     limit, sorts or DEFAULT_SORTS, marker, page_reverse)
+
+
+def port_find_network_info(context, device_ids):
+    """Loads the ports of devices with everything their network info needs.
+
+    Always the same six queries, however many devices, ports or subnets:
+    ports, their addresses, the subnets of those, subnet routes, subnet DNS
+    nameservers and port security groups.
+    """
+    query = context.session.query(models.Port).options(
+        orm.subqueryload_all("ip_addresses.subnet.routes"),
+        orm.subqueryload_all("ip_addresses.subnet.dns_nameservers"),
+        orm.subqueryload(models.Port.security_groups))
+    query = query.filter(models.Port.device_id.in_(device_ids))
+    if not context.is_admin:
+        query = query.filter(models.Port.tenant_id == context.tenant_id)
+    return query.order_by(asc(models.Port.created_at)).all()
 
 
 def port_count_all(context, **filters):
@@ -201,13 +353,33 @@ def port_delete(context, port):
     context.session.delete(port)
 
 
+def port_delete_bulk(context, ports):
+    for port in ports:
+        context.session.delete(port)
+
+
 def ip_address_update(context, address, **kwargs):
+    if "deallocated" in kwargs:
+        ip_address_set_deallocated(context, address,
+                                   kwargs.pop("deallocated"))
     address.update(kwargs)
     context.session.add(address)
     return address
 
 
-def ip_address_create(context, **address_dict):
+def ip_address_set_deallocated(context, address, deallocated):
+    """Marks an address deallocated or allocated again.
+
+    Shifts the allocated counter of its subnet along when the state
+    changes, so nothing flips deallocated behind the counters' back.
+    """
+    if bool(address["_deallocated"]) != bool(deallocated):
+        subnet_adjust_ip_counts(context, address["subnet_id"],
+                                allocated=deallocated and -1 or 1)
+    address["deallocated"] = deallocated
+
+
+def _ip_address_model(context, address_dict):
     ip_address = models.IPAddress()
     address = address_dict.pop("address")
     ip_address.update(address_dict)
@@ -220,8 +392,103 @@ def ip_address_create(context, **address_dict):
     return ip_address
 
 
+def _adjust_ip_counts_by_subnet(context, ip_addresses, allocated=0,
+                                generated=0):
+    per_subnet = {}
+    for ip_address in ip_addresses:
+        subnet_id = ip_address["subnet_id"]
+        per_subnet[subnet_id] = per_subnet.get(subnet_id, 0) + 1
+    for subnet_id, count in per_subnet.items():
+        subnet_adjust_ip_counts(context, subnet_id,
+                                allocated=allocated * count,
+                                generated=generated * count)
+
+
+def ip_address_create(context, **address_dict):
+    subnet_adjust_ip_counts(context, address_dict.get("subnet_id"),
+                            allocated=1, generated=1)
+    return _ip_address_model(context, address_dict)
+
+
+def ip_address_claim(context, **address_dict):
+    """Creates an address without writing to the row of its subnet.
+
+    The counter shift is recorded as a pending delta instead, for
+    allocators that don't lock the subnet. Only for subnets with
+    initialized counters, a NULL counter is seeded from a COUNT that
+    already includes the address.
+    """
+    subnet_ip_counts_record(context, address_dict["subnet_id"], allocated=1,
+                            generated=1)
+    return _ip_address_model(context, address_dict)
+
+
+def ip_address_create_bulk(context, address_dicts):
+    """Creates several addresses, shifting each subnet's counters once."""
+    _adjust_ip_counts_by_subnet(context, address_dicts, allocated=1,
+                                generated=1)
+    return [_ip_address_model(context, address_dict)
+            for address_dict in address_dicts]
+
+
+def ip_address_reallocate_bulk(context, ip_addresses):
+    """Marks deallocated addresses as allocated again."""
+    _adjust_ip_counts_by_subnet(context, ip_addresses, allocated=1)
+    now = timeutils.utcnow()
+    for ip_address in ip_addresses:
+        ip_address.update(dict(deallocated=False, deallocated_at=None,
+                               allocated_at=now))
+        context.session.add(ip_address)
+    return ip_addresses
+
+
+def ip_address_shared_ids(context, ip_address_ids, port_ids):
+    """Returns which addresses are mapped to a port outside of port_ids."""
+    if not ip_address_ids:
+        return set()
+    association = models.port_ip_association_table
+    query = context.session.query(association.c.ip_address_id).filter(
+        association.c.ip_address_id.in_(ip_address_ids),
+        ~association.c.port_id.in_(port_ids))
+    return set([row[0] for row in query.distinct()])
+
+
+def ip_address_deallocate_bulk(context, ip_addresses):
+    """Marks addresses deallocated and queues them with one UPDATE.
+
+    Does what setting deallocated on every address does, subnet counters
+    included, without a write per address.
+    """
+    if not ip_addresses:
+        return
+    now = timeutils.utcnow()
+    ids = [address["id"] for address in ip_addresses]
+    _adjust_ip_counts_by_subnet(
+        context, [address for address in ip_addresses
+                  if not address["_deallocated"]], allocated=-1)
+
+    query = context.session.query(models.IPAddress)
+    query.filter(models.IPAddress.id.in_(ids)).update(
+        dict(_deallocated=1, deallocated_at=now, allocated_at=None),
+        synchronize_session=False)
+
+    queue = models.IPAddressReuse
+    query = context.session.query(queue)
+    query.filter(queue.address_id.in_(ids)).delete(
+        synchronize_session="fetch")
+    context.session.execute(queue.__table__.insert(), [
+        dict(address_id=address["id"], network_id=address["network_id"],
+             subnet_id=address["subnet_id"], version=address["version"],
+             deallocated_at=now)
+        for address in ip_addresses])
+    for address in ip_addresses:
+        context.session.expire(address, ["_deallocated", "deallocated_at",
+                                         "allocated_at", "reuse_entry"])
+
+
 @scoped
-def ip_address_find(context, lock_mode=False, **filters):
+def ip_address_find(context, lock_mode=False, limit=None, sorts=None,
+                    marker=None, page_reverse=False, **filters):
     query = context.session.query(models.IPAddress)
 
     ip_shared = filters.pop("shared", None)
@@ -243,11 +510,233 @@ def ip_address_find(context, lock_mode=False, **filters):
         else:
             query = query.filter(stmt.c.ports_count <= 1)
 
+    # Warm pool reservations belong to no tenant until claimed
+    reserved = filters.pop("reserved", None)
+    if reserved is not None:
+        if reserved:
+            query = query.filter(models.IPAddress.reserved_at != sql.null())
+        else:
+            query = query.filter(models.IPAddress.reserved_at == sql.null())
+
     model_filters = _model_query(context, models.IPAddress, filters)
     if filters.get("device_id"):
         model_filters.append(models.IPAddress.ports.any(
             models.Port.device_id.in_(filters["device_id"])))
-    return query.filter(*model_filters)
+    query = _eager_load(query.filter(*model_filters), IP_ADDRESS_LIST_LOADS)
+    return _paginate(context, query, models.IPAddress, limit, sorts, marker,
+                     page_reverse)
+
+
+def _reuse_queue_filters(network_id=None, subnet_id=None, version=None,
+                         reuse_after=None, ip_address=None):
+    queue = models.IPAddressReuse
+    query_filters = []
+    if network_id:
+        query_filters.append(queue.network_id.in_(network_id))
+    if subnet_id:
+        query_filters.append(queue.subnet_id.in_(subnet_id))
+    if version:
+        query_filters.append(queue.version.in_(version))
+    if reuse_after:
+        reuse = timeutils.utcnow() - datetime.timedelta(seconds=reuse_after)
+        query_filters.append(queue.deallocated_at <= reuse)
+    if ip_address:
+        query_filters.append(models.IPAddress.address == int(ip_address))
+    return query_filters
+
+
+def _reuse_queue_query(context, lock_mode):
+    queue = models.IPAddressReuse
+    query = context.session.query(models.IPAddress).join(
+        queue, queue.address_id == models.IPAddress.id)
+    query = query.options(orm.contains_eager(models.IPAddress.reuse_entry))
+    if lock_mode:
+        query = query.with_lockmode("update")
+    return query
+
+
+@scoped
+def ip_address_reuse_find(context, lock_mode=False, **filters):
+    """Finds reusable addresses, the longest deallocated first."""
+    query = _reuse_queue_query(context, lock_mode)
+    query = query.filter(*_reuse_queue_filters(**filters))
+    return query.order_by(models.IPAddressReuse.deallocated_at)
+
+
+@scoped
+def ip_address_find_reusable(context, lock_mode=False, **filters):
+    """Finds the first reusable address of each IP version.
+
+    One query instead of an ip_address_reuse_find limited to one row per
+    version.
+    """
+    queue = models.IPAddressReuse
+    query_filters = _reuse_queue_filters(**filters)
+    heads = context.session.query(
+        queue.version,
+        sql_func.min(queue.deallocated_at).label("deallocated_at"))
+    heads = heads.join(models.IPAddress,
+                       queue.address_id == models.IPAddress.id)
+    heads = heads.filter(*query_filters).group_by(queue.version).subquery()
+
+    query = _reuse_queue_query(context, lock_mode).join(
+        heads, and_(queue.version == heads.c.version,
+                    queue.deallocated_at == heads.c.deallocated_at))
+    query = query.filter(*query_filters).order_by(queue.version)
+
+    # Addresses deallocated together tie, only hand out one per version
+    addresses = []
+    for address in query:
+        if not addresses or addresses[-1]["version"] != address["version"]:
+            addresses.append(address)
+    return addresses
+
+
+def ip_address_reuse_queue_rebuild(context, subnet):
+    """Queues the deallocated addresses of a subnet missing from the queue.
+
+    Addresses deallocated before the reuse queue existed can only be handed
+    out again once they're queued.
+    """
+    queue = models.IPAddressReuse
+    queued = context.session.query(queue.address_id).filter(
+        queue.subnet_id == subnet["id"])
+    query = context.session.query(models.IPAddress).filter(
+        models.IPAddress.subnet_id == subnet["id"],
+        models.IPAddress._deallocated == 1,
+        ~models.IPAddress.ports.any(),
+        ~models.IPAddress.id.in_(queued))
+    for address in query:
+        address["reuse_entry"] = models.IPAddressReuse(
+            network_id=address["network_id"],
+            subnet_id=address["subnet_id"], version=address["version"],
+            deallocated_at=address["deallocated_at"])
+        context.session.add(address)
+
+
+def ip_address_archive(context, deallocated_before, limit):
+    """Moves addresses deallocated before a time into the archive table.
+
+    Moves at most limit addresses, the longest deallocated first, and
+    returns how many were moved. Their addresses go back into the free
+    range index, so only subnets that have one are compacted.
+    """
+    query = context.session.query(models.IPAddress).join(
+        models.Subnet, models.Subnet.id == models.IPAddress.subnet_id)
+    query = query.filter(
+        models.Subnet.free_ranges_indexed == 1,
+        models.IPAddress._deallocated == 1,
+        models.IPAddress.deallocated_at < deallocated_before,
+        ~models.IPAddress.ports.any())
+    query = query.order_by(asc(models.IPAddress.deallocated_at))
+    addresses = query.limit(limit).with_lockmode("update").all()
+
+    _adjust_ip_counts_by_subnet(context, addresses, generated=-1)
+    columns = [column.key for column in models.IPAddress.__table__.columns]
+    for address in addresses:
+        archived = models.IPAddressArchive()
+        for column in columns:
+            archived[column] = address[column]
+        context.session.add(archived)
+        context.session.delete(address)
+        subnet_free_range_release(context, address["subnet_id"],
+                                  int(address["address"]))
+    return len(addresses)
+
+
+@scoped
+def ip_address_archive_find(context, **filters):
+    query = context.session.query(models.IPAddressArchive)
+    model_filters = _model_query(context, models.IPAddressArchive, filters)
+    query = query.filter(*model_filters)
+    return query.order_by(asc(models.IPAddressArchive.deallocated_at))
+
+
+def ip_address_pool_reserve(context, ip_addresses):
+    """Parks newly created addresses in their network's warm pool.
+
+    Reserved addresses stay counted as allocated, so claiming one later
+    doesn't touch the subnet.
+    """
+    now = timeutils.utcnow()
+    for ip_address in ip_addresses:
+        ip_address["reserved_at"] = now
+        ip_address["tenant_id"] = None
+        context.session.add(ip_address)
+    return ip_addresses
+
+
+def ip_address_pool_claim(context, network_id, candidates, version=None,
+                          segment_id=None):
+    """Claims a reserved address of the network's warm pool.
+
+    Reads up to candidates reserved addresses without locks and takes the
+    first one a conditional UPDATE still finds reserved. The UPDATE locks
+    the row, so a claim racing another for the same candidate waits until
+    that transaction ends before moving on, the shuffle keeps such
+    collisions rare. Returns None when the pool is empty or every candidate
+    was claimed by somebody else.
+    """
+    query = context.session.query(models.IPAddress.id).join(
+        models.Subnet, models.Subnet.id == models.IPAddress.subnet_id)
+    query = query.filter(models.IPAddress.network_id == network_id,
+                         models.IPAddress.reserved_at != sql.null(),
+                         models.Subnet.do_not_use == 0)
+    if version:
+        query = query.filter(models.IPAddress.version == version)
+    if segment_id:
+        query = query.filter(models.Subnet.segment_id == segment_id)
+    address_ids = [row.id for row in query.limit(candidates)]
+    # Spread concurrent claims over the candidates
+    random.shuffle(address_ids)
+
+    now = timeutils.utcnow()
+    for address_id in address_ids:
+        query = context.session.query(models.IPAddress).filter(
+            models.IPAddress.id == address_id,
+            models.IPAddress.reserved_at != sql.null())
+        claimed = query.update(dict(reserved_at=None, allocated_at=now,
+                                    tenant_id=context.tenant_id),
+                               synchronize_session=False)
+        if claimed:
+            query = context.session.query(models.IPAddress).filter(
+                models.IPAddress.id == address_id)
+            return query.populate_existing().one()
+    return None
+
+
+def ip_address_pool_counts(context, network_id):
+    """Returns how many reserved addresses each subnet of a network has."""
+    query = context.session.query(models.IPAddress.subnet_id,
+                                  sql_func.count(models.IPAddress.id))
+    query = query.filter(models.IPAddress.network_id == network_id,
+                         models.IPAddress.reserved_at != sql.null())
+    return dict(query.group_by(models.IPAddress.subnet_id).all())
+
+
+@scoped
+def ip_address_pool_find(context, lock_mode=False, **filters):
+    """Finds reserved addresses, the most recently reserved first."""
+    query = context.session.query(models.IPAddress).filter(
+        models.IPAddress.reserved_at != sql.null())
+    if lock_mode:
+        query = query.with_lockmode("update")
+    model_filters = _model_query(context, models.IPAddress, filters)
+    query = query.filter(*model_filters)
+    return query.order_by(models.IPAddress.reserved_at.desc())
+
+
+def ip_address_pool_release(context, ip_addresses):
+    """Hands reserved addresses back as ordinary deallocated addresses."""
+    if not ip_addresses:
+        return
+    ids = [address["id"] for address in ip_addresses]
+    query = context.session.query(models.IPAddress)
+    query.filter(models.IPAddress.id.in_(ids)).update(
+        dict(reserved_at=None), synchronize_session=False)
+    for address in ip_addresses:
+        context.session.expire(address, ["reserved_at"])
+    ip_address_deallocate_bulk(context, ip_addresses)
 
 
 @scoped
@@ -259,13 +748,29 @@ def mac_address_find(context, lock_mode=False, **filters):
     return query.filter(*model_filters)
 
 
+def _mac_range_generated_count(range_id=models.MacAddressRange.id):
+    # Counters of ranges that predate them are seeded with a COUNT on the
+    # mac_address_range_id index
+    count = sql.select([sql_func.count(models.MacAddress.address)]).where(
+        models.MacAddress.mac_address_range_id == range_id).as_scalar()
+    return sql_func.coalesce(models.MacAddressRange.generated_count, count)
+
+
+def _mac_range_allocated_count(range_id=models.MacAddressRange.id):
+    count = sql.select([sql_func.count(models.MacAddress.address)]).where(
+        and_(models.MacAddress.mac_address_range_id == range_id,
+             models.MacAddress.deallocated != 1)).as_scalar()
+    return sql_func.coalesce(models.MacAddressRange.allocated_count, count)
+
+
 def mac_address_range_find_allocation_counts(context, address=None):
+    count = _mac_range_generated_count()
     query = context.session.query(models.MacAddressRange,
-                                  sql_func.count(models.MacAddress.address).
-                                  label("count")).with_lockmode("update")
-    query = query.outerjoin(models.MacAddress)
-    query = query.group_by(models.MacAddressRange)
-    query = query.order_by("count DESC")
+                                  count.label("count")).\
+        with_lockmode("update")
+    query = query.filter(count < models.MacAddressRange.last_address -
+                         models.MacAddressRange.first_address)
+    query = query.order_by(count.desc())
     if address:
         query = query.filter(models.MacAddressRange.last_address >= address)
         query = query.filter(models.MacAddressRange.first_address <= address)
@@ -282,6 +787,11 @@ def mac_address_range_find(context, **filters):
 def mac_address_range_create(context, **range_dict):
     new_range = models.MacAddressRange()
     new_range.update(range_dict)
+    # last_address is exclusive, see _to_mac_range
+    new_range["free_blocks"].append(models.MacAddressFreeBlock(
+        first_address=new_range["first_address"],
+        last_address=new_range["last_address"] - 1))
+    new_range["free_blocks_indexed"] = True
     context.session.add(new_range)
     return new_range
 
@@ -290,13 +800,167 @@ def mac_address_range_delete(context, mac_address_range):
     context.session.delete(mac_address_range)
 
 
+def mac_address_range_adjust_counts(context, mac_address_range_id,
+                                    allocated=0, generated=0):
+    """Atomically shifts the denormalized MAC counters of a range.
+
+    Called before the MACs are added, so an uninitialized counter is
+    seeded with the count as it stood before the change.
+    """
+    if not mac_address_range_id or not (allocated or generated):
+        return
+    values = {}
+    if allocated:
+        values["allocated_count"] = _mac_range_allocated_count(
+            mac_address_range_id) + allocated
+    if generated:
+        values["generated_count"] = _mac_range_generated_count(
+            mac_address_range_id) + generated
+    query = context.session.query(models.MacAddressRange)
+    query.filter(models.MacAddressRange.id == mac_address_range_id).update(
+        values, synchronize_session=False)
+
+
+@scoped
+def mac_address_free_block_find(context, lock_mode=False, address=None,
+                                **filters):
+    query = context.session.query(models.MacAddressFreeBlock)
+    if lock_mode:
+        query = query.with_lockmode("update")
+    if address:
+        query = query.filter(
+            models.MacAddressFreeBlock.first_address <= address)
+        query = query.filter(
+            models.MacAddressFreeBlock.last_address >= address)
+    query = query.order_by(asc(models.MacAddressFreeBlock.first_address))
+    model_filters = _model_query(context, models.MacAddressFreeBlock,
+                                 filters)
+    return query.filter(*model_filters)
+
+
+def mac_address_free_block_create(context, **block_dict):
+    free_block = models.MacAddressFreeBlock()
+    free_block.update(block_dict)
+    context.session.add(free_block)
+    return free_block
+
+
+def mac_address_free_block_update(context, free_block, **kwargs):
+    free_block.update(kwargs)
+    context.session.add(free_block)
+    return free_block
+
+
+def mac_address_free_block_delete(context, free_block):
+    context.session.delete(free_block)
+
+
+def mac_address_range_rebuild(context, mac_address_range):
+    """Recomputes the free block index and counters of a MAC range."""
+    range_id = mac_address_range["id"]
+    query = context.session.query(models.MacAddress.address)
+    query = query.filter(models.MacAddress.mac_address_range_id == range_id)
+    used = sorted(set([int(row[0]) for row in query]))
+
+    query = context.session.query(sql_func.count(models.MacAddress.address))
+    query = query.filter(models.MacAddress.mac_address_range_id == range_id)
+    mac_address_range["generated_count"] = query.scalar()
+    query = query.filter(models.MacAddress.deallocated != 1)
+    mac_address_range["allocated_count"] = query.scalar()
+
+    query = context.session.query(models.MacAddressFreeBlock)
+    query.filter(models.MacAddressFreeBlock.mac_address_range_id ==
+                 range_id).delete(synchronize_session=False)
+    context.session.expire(mac_address_range, ["free_blocks"])
+
+    for first, last in _free_spans(mac_address_range["first_address"],
+                                   mac_address_range["last_address"] - 1,
+                                   used):
+        mac_address_free_block_create(context, mac_address_range_id=range_id,
+                                      first_address=first, last_address=last)
+    mac_address_range["free_blocks_indexed"] = True
+    context.session.add(mac_address_range)
+    return mac_address_range
+
+
+def mac_address_archive(context, deallocated_before, limit):
+    """Moves MACs deallocated before a time into the archive table.
+
+    Moves at most limit MACs, the longest deallocated first, and returns
+    how many were moved. Their addresses go back into the free block
+    index, so only ranges that have one are compacted.
+    """
+    query = context.session.query(models.MacAddress).join(
+        models.MacAddressRange,
+        models.MacAddressRange.id == models.MacAddress.mac_address_range_id)
+    query = query.filter(
+        models.MacAddressRange.free_blocks_indexed == 1,
+        models.MacAddress.deallocated == 1,
+        models.MacAddress.deallocated_at < deallocated_before)
+    query = query.order_by(asc(models.MacAddress.deallocated_at))
+    macs = query.limit(limit).with_lockmode("update").all()
+
+    _adjust_mac_counts_by_range(context, macs, generated=-1)
+    columns = [column.key for column in models.MacAddress.__table__.columns]
+    for mac in macs:
+        archived = models.MacAddressArchive()
+        for column in columns:
+            archived[column] = mac[column]
+        context.session.add(archived)
+        context.session.delete(mac)
+        mac_address_free_block_release(context, mac["mac_address_range_id"],
+                                       mac["address"])
+    return len(macs)
+
+
+@scoped
+def mac_address_archive_find(context, **filters):
+    query = context.session.query(models.MacAddressArchive)
+    model_filters = _model_query(context, models.MacAddressArchive, filters)
+    query = query.filter(*model_filters)
+    return query.order_by(asc(models.MacAddressArchive.deallocated_at))
+
+
+def mac_address_free_block_release(context, mac_address_range_id, address):
+    """Puts a MAC back into the free block index of its range."""
+    return _free_index_release(context, models.MacAddressFreeBlock,
+                               "mac_address_range_id", mac_address_range_id,
+                               "first_address", "last_address", address)
+
+
 def mac_address_update(context, mac, **kwargs):
+    if "deallocated" in kwargs:
+        was_deallocated = bool(mac["deallocated"])
+        if was_deallocated != bool(kwargs["deallocated"]):
+            mac_address_range_adjust_counts(
+                context, mac["mac_address_range_id"],
+                allocated=was_deallocated and 1 or -1)
     mac.update(kwargs)
     context.session.add(mac)
     return mac
 
 
-def mac_address_create(context, **mac_dict):
+def mac_address_deallocate_bulk(context, addresses):
+    """Marks MACs deallocated with one UPDATE.
+
+    Each range's counters are shifted once, by the number of its MACs that
+    were still allocated.
+    """
+    if not addresses:
+        return
+    mac = models.MacAddress
+    query = context.session.query(mac.mac_address_range_id,
+                                  sql_func.count(mac.address))
+    query = query.filter(mac.address.in_(addresses), mac.deallocated != 1)
+    for range_id, count in query.group_by(mac.mac_address_range_id).all():
+        mac_address_range_adjust_counts(context, range_id, allocated=-count)
+
+    query = context.session.query(mac).filter(mac.address.in_(addresses))
+    query.update(dict(deallocated=True, deallocated_at=timeutils.utcnow()),
+                 synchronize_session="fetch")
+
+
+def _mac_address_model(context, mac_dict):
     mac_address = models.MacAddress()
     mac_address.update(mac_dict)
     mac_address["tenant_id"] = context.tenant_id
@@ -306,8 +970,42 @@ def mac_address_create(context, **mac_dict):
     return mac_address
 
 
+def _adjust_mac_counts_by_range(context, macs, allocated=0, generated=0):
+    per_range = {}
+    for mac in macs:
+        range_id = mac["mac_address_range_id"]
+        per_range[range_id] = per_range.get(range_id, 0) + 1
+    for range_id, count in per_range.items():
+        mac_address_range_adjust_counts(context, range_id,
+                                        allocated=allocated * count,
+                                        generated=generated * count)
+
+
+def mac_address_create(context, **mac_dict):
+    mac_address_range_adjust_counts(context,
+                                    mac_dict.get("mac_address_range_id"),
+                                    allocated=1, generated=1)
+    return _mac_address_model(context, mac_dict)
+
+
+def mac_address_create_bulk(context, mac_dicts):
+    """Creates several MACs, shifting each range's counters once."""
+    _adjust_mac_counts_by_range(context, mac_dicts, allocated=1, generated=1)
+    return [_mac_address_model(context, mac_dict) for mac_dict in mac_dicts]
+
+
+def mac_address_reallocate_bulk(context, macs):
+    """Marks deallocated MACs as allocated again."""
+    _adjust_mac_counts_by_range(context, macs, allocated=1)
+    for mac in macs:
+        mac.update(dict(deallocated=False, deallocated_at=None))
+        context.session.add(mac)
+    return macs
+
+
 @scoped
-def network_find(context, fields=None, **filters):
+def network_find(context, fields=None, limit=None, sorts=None, marker=None,
+                 page_reverse=False, **filters):
     ids = []
     defaults = []
     if "id" in filters:
@@ -326,7 +1024,9 @@ def network_find(context, fields=None, **filters):
             if not defaults:
                 return []
         filters.pop("shared")
-    return _network_find(context, fields, defaults=defaults, **filters)
+    query = _network_find(context, fields, defaults=defaults, **filters)
+    return _paginate(context, query, models.Network, limit, sorts, marker,
+                     page_reverse)
 
 
 def _network_find(context, fields, defaults=None, **filters):
@@ -342,7 +1042,8 @@ def _network_find(context, fields, defaults=None, **filters):
     else:
         query = query.filter(*model_filters)
 
-    return query
+    return _load_fields(query, models.Network, fields, NETWORK_LIST_LOADS,
+                        NETWORK_FIELD_ATTRS)
 
 
 def network_find_all(context, fields=None, **filters):
@@ -356,6 +1057,22 @@ def network_create(context, **network):
     return new_net
 
 
+def network_port_count(context, network_id):
+    """Returns the number of ports on a network, for ports_per_network.
+
+    The ports are counted on the network_id index rather than kept in a
+    counter on the network row, so creates and deletes never write to the
+    network. Only the quota check locks the network row, until the
+    transaction ends, so concurrent creates checking the same quota are
+    serialized rather than all seeing room for one more port.
+    """
+    count = sql.select([sql_func.count(models.Port.id)]).where(
+        models.Port.network_id == network_id).as_scalar()
+    query = context.session.query(count)
+    query = query.filter(models.Network.id == network_id)
+    return query.with_lockmode("update").scalar() or 0
+
+
 def network_update(context, network, **kwargs):
     network.update(kwargs)
     context.session.add(network)
@@ -372,16 +1089,26 @@ def network_delete(context, network):
     context.session.delete(network)
 
 
-def subnet_find_allocation_counts(context, net_id, **filters):
-    query = context.session.query(models.Subnet,
-                                  sql_func.count(models.IPAddress.address).
-                                  label("count")).with_lockmode('update')
+def subnet_find_allocation_counts(context, net_id, lock_mode=True,
+                                  containing=None, **filters):
+    """Subnets of a network with their generated counts, fullest first.
+
+    With containing only the subnets holding that address are read, and
+    locked, a range scan of the (first_ip, last_ip) index.
+    """
+    count = _subnet_generated_count() + _subnet_pending_count("generated")
+    query = context.session.query(models.Subnet, count.label("count"))
+    if lock_mode:
+        query = query.with_lockmode('update')
     query = query.filter_by(do_not_use=False)
-    query = query.outerjoin(models.Subnet.generated_ips)
-    query = query.group_by(models.Subnet)
-    query = query.order_by("count DESC")
+    query = query.order_by(count.desc())
 
     query = query.filter(models.Subnet.network_id == net_id)
+    if containing is not None:
+        # Subnets store their bounds IPv4 mapped
+        mapped = int(netaddr.IPAddress(containing).ipv6())
+        query = query.filter(models.Subnet.first_ip <= mapped,
+                             models.Subnet.last_ip >= mapped)
     if "ip_version" in filters:
         query = query.filter(models.Subnet.ip_version == filters["ip_version"])
     if "segment_id" in filters and filters["segment_id"]:
@@ -393,13 +1120,114 @@ def subnet_find_allocation_counts(context, net_id, **filters):
 
 
 @scoped
-def subnet_find(context, **filters):
+def subnet_find(context, fields=None, limit=None, sorts=None, marker=None,
+                page_reverse=False, **filters):
     if "shared" in filters and True in filters["shared"]:
         return []
-    query = context.session.query(models.Subnet).\
-        options(orm.joinedload(models.Subnet.routes))
+    query = _load_fields(context.session.query(models.Subnet), models.Subnet,
+                         fields, SUBNET_LIST_LOADS, SUBNET_FIELD_ATTRS)
     model_filters = _model_query(context, models.Subnet, filters)
-    return query.filter(*model_filters)
+    return _paginate(context, query.filter(*model_filters), models.Subnet,
+                     limit, sorts, marker, page_reverse)
+
+
+def _subnet_generated_count(subnet_id=models.Subnet.id):
+    # Counters of subnets that predate them are seeded with a COUNT on the
+    # subnet_id index
+    count = sql.select([sql_func.count(models.IPAddress.id)]).where(
+        models.IPAddress.subnet_id == subnet_id).as_scalar()
+    return sql_func.coalesce(models.Subnet.generated_count, count)
+
+
+def _subnet_allocated_count(subnet_id=models.Subnet.id):
+    count = sql.select([sql_func.count(models.IPAddress.id)]).where(
+        and_(models.IPAddress.subnet_id == subnet_id,
+             models.IPAddress._deallocated != 1)).as_scalar()
+    return sql_func.coalesce(models.Subnet.allocated_count, count)
+
+
+def _subnet_pending_count(delta, subnet_id=models.Subnet.id):
+    column = getattr(models.SubnetIPCountDelta, delta)
+    pending = sql.select([sql_func.sum(column)]).where(
+        models.SubnetIPCountDelta.subnet_id == subnet_id).as_scalar()
+    return sql_func.coalesce(pending, 0)
+
+
+def subnet_adjust_ip_counts(context, subnet_id, allocated=0, generated=0):
+    """Atomically shifts the denormalized address counters of a subnet.
+
+    Called before the addresses are added, so an uninitialized counter is
+    seeded with the count as it stood before the change.
+    """
+    if not subnet_id or not (allocated or generated):
+        return
+    values = {}
+    if allocated:
+        values["allocated_count"] = _subnet_allocated_count(
+            subnet_id) + allocated
+    if generated:
+        values["generated_count"] = _subnet_generated_count(
+            subnet_id) + generated
+    query = context.session.query(models.Subnet)
+    query.filter(models.Subnet.id == subnet_id).update(
+        values, synchronize_session=False)
+
+
+def subnet_ip_counts_record(context, subnet_id, allocated=0, generated=0):
+    """Records a shift of the address counters of a subnet as a delta.
+
+    Unlike subnet_adjust_ip_counts nothing is written to the subnet row,
+    the delta is only an INSERT. subnet_find_allocation_counts adds pending
+    deltas in until subnet_ip_count_deltas_fold moves them to the subnet.
+    """
+    delta = models.SubnetIPCountDelta(subnet_id=subnet_id,
+                                      allocated=allocated,
+                                      generated=generated)
+    context.session.add(delta)
+    return delta
+
+
+def subnet_ip_count_deltas_subnet_ids(context):
+    """Ids of the subnets with pending counter deltas."""
+    query = context.session.query(models.SubnetIPCountDelta.subnet_id)
+    return [row[0] for row in query.distinct()]
+
+
+def subnet_ip_count_deltas_fold(context, subnet_id):
+    """Moves the pending counter deltas of a subnet into its counters.
+
+    The deltas folded are locked, ones recorded meanwhile are left for the
+    next fold. Returns how many deltas were folded.
+    """
+    query = context.session.query(models.SubnetIPCountDelta).filter(
+        models.SubnetIPCountDelta.subnet_id == subnet_id)
+    deltas = query.with_lockmode("update").all()
+    if not deltas:
+        return 0
+    subnet_adjust_ip_counts(
+        context, subnet_id,
+        allocated=sum(delta["allocated"] for delta in deltas),
+        generated=sum(delta["generated"] for delta in deltas))
+    query.filter(models.SubnetIPCountDelta.id.in_(
+        [delta["id"] for delta in deltas])).delete(synchronize_session=False)
+    return len(deltas)
+
+
+def subnet_ip_counts_rebuild(context, subnet):
+    """Recomputes the denormalized address counters of a subnet.
+
+    Pending deltas are dropped, the recount already includes them.
+    """
+    query = context.session.query(models.SubnetIPCountDelta).filter(
+        models.SubnetIPCountDelta.subnet_id == subnet["id"])
+    query.delete(synchronize_session=False)
+    query = context.session.query(sql_func.count(models.IPAddress.id))
+    query = query.filter(models.IPAddress.subnet_id == subnet["id"])
+    subnet["generated_count"] = query.scalar()
+    query = query.filter(models.IPAddress._deallocated != 1)
+    subnet["allocated_count"] = query.scalar()
+    context.session.add(subnet)
+    return subnet
 
 
 def subnet_count_all(context, **filters):
@@ -419,6 +1247,13 @@ def subnet_create(context, **subnet_dict):
     subnet = models.Subnet()
     subnet.update(subnet_dict)
     subnet["tenant_id"] = context.tenant_id
+
+    # A brand new subnet has never generated an address, so the whole CIDR
+    # is free
+    cidr = netaddr.IPNetwork(subnet["cidr"])
+    subnet["free_ranges"].append(models.SubnetFreeRange(first_ip=cidr.first,
+                                                        last_ip=cidr.last))
+    subnet["free_ranges_indexed"] = True
     context.session.add(subnet)
     return subnet
 
@@ -429,6 +1264,152 @@ def subnet_update(context, subnet, **kwargs):
     return subnet
 
 
+@scoped
+def subnet_free_range_find(context, lock_mode=False, containing=None,
+                           after=None, **filters):
+    """Finds free ranges in address order.
+
+    With scope ONE and lock_mode only the first range past after is read
+    and locked, a LIMIT 1 scan of the (subnet_id, first_ip) index. Unlocked
+    reads always refresh the ranges the session holds, optimistic claims
+    change them with UPDATEs that bypass the session.
+    """
+    query = context.session.query(models.SubnetFreeRange)
+    if lock_mode:
+        query = query.with_lockmode("update")
+    else:
+        query = query.populate_existing()
+    if containing is not None:
+        query = query.filter(models.SubnetFreeRange.first_ip <= containing,
+                             models.SubnetFreeRange.last_ip >= containing)
+    if after is not None:
+        query = query.filter(models.SubnetFreeRange.first_ip > after)
+    query = query.order_by(asc(models.SubnetFreeRange.first_ip))
+    model_filters = _model_query(context, models.SubnetFreeRange, filters)
+    return query.filter(*model_filters)
+
+
+def subnet_free_range_create(context, **range_dict):
+    free_range = models.SubnetFreeRange()
+    free_range.update(range_dict)
+    context.session.add(free_range)
+    return free_range
+
+
+def subnet_free_range_update(context, free_range, **kwargs):
+    free_range.update(kwargs)
+    context.session.add(free_range)
+    return free_range
+
+
+def subnet_free_range_delete(context, free_range):
+    context.session.delete(free_range)
+
+
+def subnet_free_range_take(context, subnet_id, range_id, first_ip, last_ip,
+                           address):
+    """Removes address from a free range, splitting it if needed.
+
+    Only applies while the range still spans exactly [first_ip, last_ip], so
+    allocators that read the range without a lock can't both take the same
+    address. Returns whether the range was still as the caller saw it.
+    """
+    query = context.session.query(models.SubnetFreeRange).filter(
+        models.SubnetFreeRange.id == range_id,
+        models.SubnetFreeRange.first_ip == first_ip,
+        models.SubnetFreeRange.last_ip == last_ip)
+    if first_ip == last_ip:
+        return query.delete(synchronize_session=False) == 1
+    if address == first_ip:
+        values = dict(first_ip=address + 1)
+    else:
+        values = dict(last_ip=address - 1)
+    if query.update(values, synchronize_session=False) != 1:
+        return False
+    if first_ip < address < last_ip:
+        subnet_free_range_create(context, subnet_id=subnet_id,
+                                 first_ip=address + 1, last_ip=last_ip)
+    return True
+
+
+def _free_index_release(context, model, owner_key, owner_id, first_key,
+                        last_key, address):
+    """Puts address back into a run-length free index.
+
+    Grows a neighbouring span onto it, or joins the two spans it separates,
+    so the index stays as compact as a rebuild would leave it.
+    """
+    query = context.session.query(model).filter(
+        getattr(model, owner_key) == owner_id)
+    below = query.filter(getattr(model, last_key) == address - 1).first()
+    above = query.filter(getattr(model, first_key) == address + 1).first()
+    if below and above:
+        below[last_key] = above[last_key]
+        context.session.delete(above)
+        free_span = below
+    elif below:
+        below[last_key] = address
+        free_span = below
+    elif above:
+        above[first_key] = address
+        free_span = above
+    else:
+        free_span = model()
+        free_span.update({owner_key: owner_id, first_key: address,
+                          last_key: address})
+    context.session.add(free_span)
+    return free_span
+
+
+def subnet_free_range_release(context, subnet_id, address):
+    """Puts an address back into the free range index of its subnet."""
+    return _free_index_release(context, models.SubnetFreeRange, "subnet_id",
+                               subnet_id, "first_ip", "last_ip", address)
+
+
+def _free_spans(first, last, used):
+    """Yields the inclusive spans of [first, last] missing from used.
+
+    used must be sorted ascending.
+    """
+    start = first
+    for address in used:
+        if address < start:
+            continue
+        if address > last:
+            break
+        if address > start:
+            yield start, address - 1
+        start = address + 1
+    if start <= last:
+        yield start, last
+
+
+def subnet_free_ranges_rebuild(context, subnet):
+    """Recomputes the free range index of a persisted subnet.
+
+    Every address ever generated for the subnet, allocated or not, is
+    considered used. Deallocated addresses are handed back out through
+    reallocation, not through the free range index.
+    """
+    query = context.session.query(models.IPAddress.address)
+    query = query.filter(models.IPAddress.subnet_id == subnet["id"])
+    used = sorted(set([int(row[0]) for row in query]))
+
+    query = context.session.query(models.SubnetFreeRange)
+    query.filter(models.SubnetFreeRange.subnet_id == subnet["id"]).delete(
+        synchronize_session=False)
+    context.session.expire(subnet, ["free_ranges"])
+
+    cidr = netaddr.IPNetwork(subnet["cidr"])
+    for first, last in _free_spans(cidr.first, cidr.last, used):
+        subnet_free_range_create(context, subnet_id=subnet["id"],
+                                 first_ip=first, last_ip=last)
+    subnet["free_ranges_indexed"] = True
+    context.session.add(subnet)
+    return subnet
+
+
 @scoped
 def route_find(context, fields=None, **filters):
     query = context.session.query(models.Route)
@@ -469,11 +1450,15 @@ def dns_delete(context, dns):
 
 
 @scoped
-def security_group_find(context, **filters):
-    query = context.session.query(models.SecurityGroup).\
-        options(orm.joinedload(models.SecurityGroup.rules))
+def security_group_find(context, fields=None, limit=None, sorts=None,
+                        marker=None, page_reverse=False, **filters):
+    query = _load_fields(context.session.query(models.SecurityGroup),
+                         models.SecurityGroup, fields,
+                         SECURITY_GROUP_LIST_LOADS,
+                         SECURITY_GROUP_FIELD_ATTRS)
     model_filters = _model_query(context, models.SecurityGroup, filters)
-    return query.filter(*model_filters)
+    return _paginate(context, query.filter(*model_filters),
+                     models.SecurityGroup, limit, sorts, marker, page_reverse)
 
 
 def security_group_create(context, **sec_group_dict):
@@ -495,10 +1480,13 @@ def security_group_delete(context, group):
 
 
 @scoped
-def security_group_rule_find(context, **filters):
+def security_group_rule_find(context, limit=None, sorts=None, marker=None,
+                             page_reverse=False, **filters):
     query = context.session.query(models.SecurityGroupRule)
     model_filters = _model_query(context, models.SecurityGroupRule, filters)
-    return query.filter(*model_filters)
+    return _paginate(context, query.filter(*model_filters),
+                     models.SecurityGroupRule, limit, sorts, marker,
+                     page_reverse)
 
 
 def security_group_rule_create(context, **rule_dict):
@@ -506,14 +1494,37 @@ def security_group_rule_create(context, **rule_dict):
     new_rule.update(rule_dict)
     new_rule.group_id = rule_dict['security_group_id']
     new_rule.tenant_id = rule_dict['tenant_id']
+    security_group_adjust_rule_count(context, new_rule.group_id, 1)
     context.session.add(new_rule)
     return new_rule
 
 
 def security_group_rule_delete(context, rule):
+    security_group_adjust_rule_count(context, rule["group_id"], -1)
     context.session.delete(rule)
 
 
+def _rule_count(group_id):
+    count = sql.select([sql_func.count(models.SecurityGroupRule.id)]).where(
+        models.SecurityGroupRule.group_id == group_id).as_scalar()
+    return sql_func.coalesce(models.SecurityGroup.rule_count, count)
+
+
+def security_group_adjust_rule_count(context, group_id, delta):
+    """Atomically shifts the rule counter of a security group."""
+    query = context.session.query(models.SecurityGroup)
+    query.filter(models.SecurityGroup.id == group_id).update(
+        {"rule_count": _rule_count(group_id) + delta},
+        synchronize_session=False)
+
+
+def security_group_rule_count(context, group_id):
+    """Returns the number of rules in a group, locking the group row."""
+    query = context.session.query(_rule_count(group_id))
+    query = query.filter(models.SecurityGroup.id == group_id)
+    return query.with_lockmode("update").scalar() or 0
+
+
 def ip_policy_create(context, **ip_policy_dict):
     new_policy = models.IPPolicy()
     exclude = ip_policy_dict.pop("exclude")
@@ -524,6 +1535,7 @@ def ip_policy_create(context, **ip_policy_dict):
     new_policy.update(ip_policy_dict)
     new_policy["tenant_id"] = context.tenant_id
     context.session.add(new_policy)
+    ip_policy_cache.invalidate(new_policy["id"])
     return new_policy
 
 
@@ -543,9 +1555,12 @@ def ip_policy_update(context, ip_policy, **ip_policy_dict):
             models.IPPolicyCIDR(cidr=excluded_cidr))
 
     ip_policy.update(ip_policy_dict)
+    ip_policy["revision"] = (ip_policy["revision"] or 0) + 1
     context.session.add(ip_policy)
+    ip_policy_cache.invalidate(ip_policy["id"])
     return ip_policy
 
 
 def ip_policy_delete(context, ip_policy):
     context.session.delete(ip_policy)
+    ip_policy_cache.invalidate(ip_policy["id"])
@@ -13,36 +13,55 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import binascii
+
+from sqlalchemy.dialects import mysql
 from sqlalchemy.dialects import sqlite
 from sqlalchemy import types
 
+# IPv6 is 128 bits => 16 bytes, 2^128 == 3.4e38 => 39 digits
+INET_BYTES = 16
+INET_DIGITS = 39
+
+
+def inet_to_db(value, dialect_name):
+    """Encodes an address so the encodings sort like the addresses."""
+    if dialect_name == 'sqlite':
+        return "%0*d" % (INET_DIGITS, value)
+    return binascii.unhexlify("%0*x" % (INET_BYTES * 2, value))
+
+
+def inet_from_db(value, dialect_name):
+    if dialect_name == 'sqlite':
+        return long(value)
+    return long(binascii.hexlify(value), 16)
+
 
 class INET(types.TypeDecorator):
+    """IP addresses as integers, stored in a fixed width.
+
+    16 bytes big-endian, or 39 zero-padded digits on sqlite, so comparisons
+    and ORDER BY on the column follow the numeric order of the addresses and
+    range conditions can scan an index.
+    """
     impl = types.LargeBinary
 
     def load_dialect_impl(self, dialect):
         if dialect.name == 'sqlite':
-            # IPv6 is 128 bits => 2^128 == 3.4e38 => 39 digits
-            return dialect.type_descriptor(sqlite.CHAR(39))
+            return dialect.type_descriptor(sqlite.CHAR(INET_DIGITS))
+        if dialect.name == 'mysql':
+            return dialect.type_descriptor(mysql.BINARY(INET_BYTES))
         return dialect.type_descriptor(self.impl)
 
     def process_bind_param(self, value, dialect):
         if value is None:
             return value
-
-        if dialect.name == 'sqlite':
-            return str(value)
-
-        return value
+        return inet_to_db(int(value), dialect.name)
 
     def process_result_value(self, value, dialect):
         if value is None:
             return value
-
-        if dialect.name == 'sqlite':
-            return long(value)
-
-        return value
+        return inet_from_db(value, dialect.name)
 
 
 class MACAddress(types.TypeDecorator):
@@ -28,6 +28,7 @@ from neutron.openstack.common import log as logging
 from neutron.openstack.common import timeutils
 
 from quark.db import custom_types
+from quark import ip_policy_cache
 #NOTE(mdietz): This is the only way to actually create the quotas table,
 #              regardless if we need it. This is how it's done upstream.
 
@@ -114,6 +115,13 @@ class IPAddress(BASEV2, models.HasId):
     Gives us an IP address owner audit log for free, essentially.
     """
     __tablename__ = "quark_ip_addresses"
+    # Lets optimistic allocation claim an address by inserting it. Keyed on
+    # the readable form, the constraint predates the fixed width address
+    # column.
+    __table_args__ = (sa.UniqueConstraint(
+        "network_id", "address_readable",
+        name="uq_quark_ip_addresses_network_id_address"),
+        QuarkBase.__table_args__)
     address_readable = sa.Column(sa.String(128), nullable=False)
     address = sa.Column(custom_types.INET(), nullable=False)
     subnet_id = sa.Column(sa.String(36),
@@ -129,6 +137,8 @@ class IPAddress(BASEV2, models.HasId):
     _deallocated = sa.Column(sa.Boolean())
     # Legacy data
     used_by_tenant_id = sa.Column(sa.String(255))
+    reuse_entry = orm.relationship("IPAddressReuse", uselist=False,
+                                   cascade="all, delete-orphan")
 
     @hybrid.hybrid_property
     def deallocated(self):
@@ -141,6 +151,11 @@ class IPAddress(BASEV2, models.HasId):
         if val:
             self.deallocated_at = timeutils.utcnow()
             self.allocated_at = None
+            self.reuse_entry = IPAddressReuse(
+                network_id=self.network_id, subnet_id=self.subnet_id,
+                version=self.version, deallocated_at=self.deallocated_at)
+        else:
+            self.reuse_entry = None
 
     # TODO(jkoelker) update the expression to use the jointable as well
     @deallocated.expression
@@ -154,6 +169,68 @@ class IPAddress(BASEV2, models.HasId):
         return str(ip.ipv6())
 
     deallocated_at = sa.Column(sa.DateTime())
+    # Set while the address waits unowned in its network's warm pool
+    reserved_at = sa.Column(sa.DateTime())
+
+
+sa.Index("idx_quark_ip_addresses_reserved",
+         IPAddress.__table__.c.network_id,
+         IPAddress.__table__.c.reserved_at)
+# Reallocation scans of the deallocated addresses of a network
+sa.Index("idx_quark_ip_addresses_reallocate",
+         IPAddress.__table__.c.network_id,
+         IPAddress.__table__.c._deallocated,
+         IPAddress.__table__.c.deallocated_at,
+         IPAddress.__table__.c.version)
+# Lookups of an address in a network
+sa.Index("idx_quark_ip_addresses_network_address",
+         IPAddress.__table__.c.network_id,
+         IPAddress.__table__.c.address)
+
+
+class IPAddressReuse(BASEV2):
+    """Queue of the deallocated addresses waiting to be handed out again.
+
+    Holds one row per deallocated address, maintained through
+    IPAddress.deallocated, so reallocation never wades through the
+    allocation history kept in quark_ip_addresses. Popped oldest first off
+    the (network_id, version, deallocated_at) index.
+    """
+    __tablename__ = "quark_ip_address_reuse"
+    address_id = sa.Column(sa.String(36),
+                           sa.ForeignKey("quark_ip_addresses.id",
+                                         ondelete="CASCADE"),
+                           primary_key=True)
+    network_id = sa.Column(sa.String(36))
+    subnet_id = sa.Column(sa.String(36))
+    version = sa.Column(sa.Integer())
+    deallocated_at = sa.Column(sa.DateTime())
+
+
+sa.Index("idx_quark_ip_address_reuse_queue",
+         IPAddressReuse.__table__.c.network_id,
+         IPAddressReuse.__table__.c.version,
+         IPAddressReuse.__table__.c.deallocated_at)
+
+
+class IPAddressArchive(BASEV2, models.HasId):
+    """Addresses compacted out of quark_ip_addresses, same columns.
+
+    Keeps the owner audit log of long deallocated addresses without making
+    every allocation query wade through it. Holds no foreign keys so the
+    history outlives its networks and subnets.
+    """
+    __tablename__ = "quark_ip_addresses_archive"
+    address_readable = sa.Column(sa.String(128), nullable=False, index=True)
+    address = sa.Column(custom_types.INET(), nullable=False)
+    subnet_id = sa.Column(sa.String(36))
+    network_id = sa.Column(sa.String(36))
+    version = sa.Column(sa.Integer())
+    allocated_at = sa.Column(sa.DateTime())
+    _deallocated = sa.Column(sa.Boolean())
+    used_by_tenant_id = sa.Column(sa.String(255))
+    deallocated_at = sa.Column(sa.DateTime())
+    reserved_at = sa.Column(sa.DateTime())
 
 
 class Route(BASEV2, models.HasTenant, models.HasId, IsHazTags):
@@ -171,6 +248,47 @@ class DNSNameserver(BASEV2, models.HasTenant, models.HasId, IsHazTags):
                                                        ondelete="CASCADE"))
 
 
+class SubnetFreeRange(BASEV2, models.HasId):
+    """Run-length index of the never-generated addresses of a subnet.
+
+    Each row is an inclusive [first_ip, last_ip] span of the subnet CIDR for
+    which no quark_ip_addresses row exists. IP policies are deliberately not
+    applied here, they're filtered at allocation time, so a policy change
+    never invalidates the index. It can always be rebuilt from the
+    quark_ip_addresses table.
+    """
+    __tablename__ = "quark_subnet_free_ranges"
+    subnet_id = sa.Column(sa.String(36),
+                          sa.ForeignKey("quark_subnets.id",
+                                        ondelete="CASCADE"),
+                          nullable=False, index=True)
+    first_ip = sa.Column(custom_types.INET(), nullable=False)
+    last_ip = sa.Column(custom_types.INET(), nullable=False)
+
+
+# Finds the free range holding an address
+sa.Index("idx_quark_subnet_free_ranges_first_ip",
+         SubnetFreeRange.__table__.c.subnet_id,
+         SubnetFreeRange.__table__.c.first_ip)
+
+
+class SubnetIPCountDelta(BASEV2, models.HasId):
+    """A pending shift of the address counters of a subnet.
+
+    Allocators that don't lock the subnet insert one of these instead of
+    updating the counters on the subnet row, so concurrent claims never
+    queue on that row. Deltas are added in when the counts are read and
+    folded into the subnet periodically.
+    """
+    __tablename__ = "quark_subnet_ip_count_deltas"
+    subnet_id = sa.Column(sa.String(36),
+                          sa.ForeignKey("quark_subnets.id",
+                                        ondelete="CASCADE"),
+                          nullable=False, index=True)
+    generated = sa.Column(sa.Integer(), nullable=False, default=0)
+    allocated = sa.Column(sa.Integer(), nullable=False, default=0)
+
+
 class Subnet(BASEV2, models.HasId, IsHazTags):
     """Upstream model for IPs.
 
@@ -223,6 +341,13 @@ class Subnet(BASEV2, models.HasId, IsHazTags):
     generated_ips = orm.relationship(IPAddress,
                                      primaryjoin='Subnet.id=='
                                      'IPAddress.subnet_id')
+    free_ranges = orm.relationship(
+        SubnetFreeRange,
+        primaryjoin="SubnetFreeRange.subnet_id==Subnet.id",
+        cascade="delete")
+    # False until the free range index has been built. Allocation falls back
+    # to probing next_auto_assign_ip for subnets that haven't been indexed
+    free_ranges_indexed = sa.Column(sa.Boolean(), default=False)
     routes = orm.relationship(Route, primaryjoin="Route.subnet_id==Subnet.id",
                               backref='subnet', cascade='delete')
     enable_dhcp = sa.Column(sa.Boolean(), default=False)
@@ -233,9 +358,20 @@ class Subnet(BASEV2, models.HasId, IsHazTags):
         cascade='delete')
     ip_policy_id = sa.Column(sa.String(36),
                              sa.ForeignKey("quark_ip_policy.id"))
+    # Denormalized from quark_ip_addresses so subnet selection doesn't have
+    # to aggregate over every address ever generated. generated_count counts
+    # rows regardless of state, allocated_count only the live ones.
+    generated_count = sa.Column(sa.Integer(), default=0)
+    allocated_count = sa.Column(sa.Integer(), default=0)
     # Legacy data
     do_not_use = sa.Column(sa.Boolean(), default=False)
 
+
+# Finds the subnets holding an address
+sa.Index("idx_quark_subnets_first_ip", Subnet.__table__.c.first_ip,
+         Subnet.__table__.c.last_ip)
+
+
 port_ip_association_table = sa.Table(
     "quark_port_ip_address_associations",
     BASEV2.metadata,
@@ -245,6 +381,11 @@ port_ip_association_table = sa.Table(
               sa.ForeignKey("quark_ip_addresses.id")))
 
 
+# Finds the ports of an address, ip_addresses' backref
+sa.Index("idx_quark_port_ip_address_associations_ip",
+         port_ip_association_table.c.ip_address_id)
+
+
 port_group_association_table = sa.Table(
     "quark_port_security_group_associations",
     BASEV2.metadata,
@@ -279,6 +420,9 @@ class SecurityGroup(BASEV2, models.HasId):
                              cascade='delete',
                              primaryjoin=join)
     tenant_id = sa.Column(sa.String(255), index=True)
+    # Denormalized len(rules) for the security_rules_per_group quota. NULL
+    # until first touched, the rules are counted then.
+    rule_count = sa.Column(sa.Integer(), default=0)
 
 
 class Port(BASEV2, models.HasTenant, models.HasId):
@@ -320,6 +464,8 @@ class Port(BASEV2, models.HasTenant, models.HasId):
 sa.Index("idx_ports_1", Port.__table__.c.device_id, Port.__table__.c.tenant_id)
 sa.Index("idx_ports_2", Port.__table__.c.device_owner,
          Port.__table__.c.network_id)
+# The ports_per_network quota counts ports by network
+sa.Index("idx_quark_ports_network_id", Port.__table__.c.network_id)
 
 
 class MacAddress(BASEV2, models.HasTenant):
@@ -334,6 +480,41 @@ class MacAddress(BASEV2, models.HasTenant):
     orm.relationship(Port, backref="mac_address")
 
 
+# Reallocation scans of the deallocated MACs
+sa.Index("idx_quark_mac_addresses_deallocated",
+         MacAddress.__table__.c.deallocated,
+         MacAddress.__table__.c.deallocated_at)
+
+
+class MacAddressFreeBlock(BASEV2, models.HasId):
+    """Run-length index of the never-generated MACs of a MAC address range.
+
+    Each row is an inclusive [first_address, last_address] span for which no
+    quark_mac_addresses row exists. It can always be rebuilt from the
+    quark_mac_addresses table.
+    """
+    __tablename__ = "quark_mac_address_free_blocks"
+    mac_address_range_id = sa.Column(
+        sa.String(36),
+        sa.ForeignKey("quark_mac_address_ranges.id", ondelete="CASCADE"),
+        nullable=False, index=True)
+    first_address = sa.Column(sa.BigInteger(), nullable=False)
+    last_address = sa.Column(sa.BigInteger(), nullable=False)
+
+
+class MacAddressArchive(BASEV2, models.HasTenant, models.HasId):
+    """MACs compacted out of quark_mac_addresses, same columns.
+
+    The same MAC is archived once per time it was deallocated, so rows are
+    keyed on their own id rather than the address.
+    """
+    __tablename__ = "quark_mac_addresses_archive"
+    address = sa.Column(sa.BigInteger(), nullable=False, index=True)
+    mac_address_range_id = sa.Column(sa.String(36), nullable=False)
+    deallocated = sa.Column(sa.Boolean())
+    deallocated_at = sa.Column(sa.DateTime())
+
+
 class MacAddressRange(BASEV2, models.HasId):
     __tablename__ = "quark_mac_address_ranges"
     cidr = sa.Column(sa.String(255), nullable=False)
@@ -345,6 +526,12 @@ class MacAddressRange(BASEV2, models.HasId):
                                       'MacAddress.mac_address_range_id, '
                                       'MacAddress.deallocated!=1)',
                                       backref="mac_address_range")
+    free_blocks = orm.relationship(MacAddressFreeBlock, cascade="delete")
+    free_blocks_indexed = sa.Column(sa.Boolean(), default=False)
+    # Denormalized from quark_mac_addresses, same semantics as the Subnet
+    # counters.
+    generated_count = sa.Column(sa.Integer(), default=0)
+    allocated_count = sa.Column(sa.Integer(), default=0)
 
 
 class IPPolicy(BASEV2, models.HasId, models.HasTenant):
@@ -363,6 +550,13 @@ class IPPolicy(BASEV2, models.HasId, models.HasTenant):
         backref="ip_policy")
     name = sa.Column(sa.String(255), nullable=True)
     description = sa.Column(sa.String(255), nullable=True)
+    # Bumped on every update, part of the ip_policy_cache key
+    revision = sa.Column(sa.Integer(), default=0)
+
+    @staticmethod
+    def get_ip_policy_intervals(subnet):
+        ip_policy = subnet["ip_policy"] or subnet["network"]["ip_policy"]
+        return ip_policy_cache.get(ip_policy, subnet["cidr"])
 
     @staticmethod
     def get_ip_policy_cidrs(subnet):
@@ -408,3 +602,11 @@ class Network(BASEV2, models.HasId):
     network_plugin = sa.Column(sa.String(36))
     ipam_strategy = sa.Column(sa.String(255))
     tenant_id = sa.Column(sa.String(255), index=True)
+
+
+# Paginated listings are ordered and resumed on (created_at, id)
+for _model in (IPAddress, Subnet, SecurityGroupRule, SecurityGroup, Port,
+               Network):
+    sa.Index("idx_%s_created_at" % _model.__tablename__,
+             _model.__table__.c.created_at, _model.__table__.c.id)
+del _model
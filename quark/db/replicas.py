@@ -0,0 +1,96 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Sessions on the read replicas of CONF.QUARK.replica_connections.
+
+Read-only plugin calls take turns over the replicas. A replica that fails
+is skipped for replica_retry_interval seconds while its calls go to the
+primary.
+"""
+
+import threading
+import time
+
+from neutron.openstack.common.db.sqlalchemy import session as db_session
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+from sqlalchemy import orm
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+
+class Replica(object):
+    def __init__(self, connection):
+        # Built like neutron's primary engine, with its pool sizing and
+        # recycling and its checkout ping of MySQL connections
+        self.engine = db_session.create_engine(connection, sqlite_fk=True)
+        # Same session settings as neutron's primary sessions
+        self.maker = orm.sessionmaker(bind=self.engine, autocommit=True,
+                                      expire_on_commit=False)
+        self.down_until = 0
+
+
+class ReplicaSet(object):
+    """Hands out sessions on the replicas, round robin."""
+    def __init__(self, connections, retry_interval):
+        self.replicas = [Replica(connection) for connection in connections]
+        self.retry_interval = retry_interval
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def session(self):
+        """Returns a session on the next healthy replica, None if none is."""
+        now = time.time()
+        with self._lock:
+            for i in xrange(len(self.replicas)):
+                replica = self.replicas[self._next]
+                self._next = (self._next + 1) % len(self.replicas)
+                if replica.down_until <= now:
+                    session = replica.maker()
+                    session.replica = replica
+                    return session
+        return None
+
+    def failed(self, session):
+        """Skips the replica of session for a while."""
+        replica = session.replica
+        replica.down_until = time.time() + self.retry_interval
+        LOG.warn("Read replica %s failed, reading from the primary for %ds" %
+                 (replica.engine.url, self.retry_interval))
+
+
+_REPLICAS = None
+_REPLICAS_LOCK = threading.Lock()
+
+
+def get_replicas():
+    global _REPLICAS
+    with _REPLICAS_LOCK:
+        if _REPLICAS is None:
+            _REPLICAS = ReplicaSet(CONF.QUARK.replica_connections,
+                                   CONF.QUARK.replica_retry_interval)
+        return _REPLICAS
+
+
+def reset():
+    """Drops the replica engines, they're rebuilt from the config."""
+    global _REPLICAS
+    with _REPLICAS_LOCK:
+        if _REPLICAS is not None:
+            for replica in _REPLICAS.replicas:
+                replica.engine.dispose()
+        _REPLICAS = None
@@ -53,6 +53,17 @@ class BaseDriver(object):
                                            port_id))
         return {"uuid": port_id}
 
+    def create_ports(self, context, network_id, ports):
+        """Creates several ports on one network.
+
+        ports is a list of dicts of create_port keyword arguments, each with
+        a port_id. Returns the backend dicts in the same order. This default
+        is one create_port per port, drivers override it where their backend
+        can share work across the batch.
+        """
+        return [self.create_port(context, network_id, **port)
+                for port in ports]
+
     def update_port(self, context, port_id, **kwargs):
         LOG.info("update_port %s %s" % (context.tenant_id, port_id))
         return {"uuid": port_id}
@@ -60,6 +71,15 @@ class BaseDriver(object):
     def delete_port(self, context, port_id, **kwargs):
         LOG.info("delete_port %s %s" % (context.tenant_id, port_id))
 
+    def delete_ports(self, context, port_ids):
+        """Deletes several ports, possibly on different networks.
+
+        This default is one delete_port per port, drivers override it where
+        their backend can share work across the batch.
+        """
+        for port_id in port_ids:
+            self.delete_port(context, port_id)
+
     def diag_port(self, context, network_id, **kwargs):
         LOG.info("diag_port %s" % network_id)
         return {}
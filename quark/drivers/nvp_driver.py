@@ -160,14 +160,46 @@ class NVPDriver(base.BaseDriver):
 
     def create_port(self, context, network_id, port_id,
                     status=True, security_groups=[], allowed_pairs=[]):
-        tenant_id = context.tenant_id
         lswitch = self._create_or_choose_lswitch(context, network_id)
+        nvp_group_ids = self._get_security_groups_for_port(context,
+                                                           security_groups)
+        return self._create_lport(context, network_id, port_id, lswitch,
+                                  nvp_group_ids, status=status,
+                                  allowed_pairs=allowed_pairs)
+
+    def create_ports(self, context, network_id, ports):
+        """Creates several lports on one network.
+
+        NVP has no batch lport API, so every port still costs its own
+        create and attachment requests. The lookups around them are shared
+        by the batch: the lswitch is chosen once, unless switches are capped
+        by max_ports_per_switch and may fill up part way through, and each
+        distinct list of security groups has its profiles resolved once.
+        """
+        if self.limits['max_ports_per_switch']:
+            return super(NVPDriver, self).create_ports(context, network_id,
+                                                       ports)
+        lswitch = self._create_or_choose_lswitch(context, network_id)
+        profiles = {}
+        nvp_ports = []
+        for port in ports:
+            port = dict(port)
+            groups = tuple(port.pop("security_groups", None) or [])
+            if groups not in profiles:
+                profiles[groups] = self._get_security_groups_for_port(
+                    context, groups)
+            nvp_ports.append(self._create_lport(
+                context, network_id, lswitch=lswitch,
+                nvp_group_ids=profiles[groups], **port))
+        return nvp_ports
+
+    def _create_lport(self, context, network_id, port_id, lswitch,
+                      nvp_group_ids, status=True, allowed_pairs=[]):
+        tenant_id = context.tenant_id
         connection = self.get_connection()
         port = connection.lswitch_port(lswitch)
         port.admin_status_enabled(status)
         port.allowed_address_pairs(allowed_pairs)
-        nvp_group_ids = self._get_security_groups_for_port(context,
-                                                           security_groups)
         port.security_profiles(nvp_group_ids)
         tags = [dict(tag=network_id, scope="neutron_net_id"),
                 dict(tag=port_id, scope="neutron_port_id"),
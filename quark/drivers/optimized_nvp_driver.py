@@ -39,13 +39,12 @@ class OptimizedNVPDriver(NVPDriver):
         for switch in lswitches:
             self._lswitch_delete(context, switch.nvp_id)
 
-    def create_port(self, context, network_id, port_id,
-                    status=True, security_groups=[], allowed_pairs=[]):
+    def _create_lport(self, context, network_id, port_id, lswitch,
+                      nvp_group_ids, status=True, allowed_pairs=[]):
         nvp_port = super(OptimizedNVPDriver, self).\
-            create_port(context, network_id,
-                        port_id, status=status,
-                        security_groups=security_groups,
-                        allowed_pairs=allowed_pairs)
+            _create_lport(context, network_id, port_id, lswitch,
+                          nvp_group_ids, status=status,
+                          allowed_pairs=allowed_pairs)
         switch_nvp_id = nvp_port["lswitch"]
 
         # slightly inefficient for the sake of brevity. Lets the
@@ -76,7 +75,37 @@ class OptimizedNVPDriver(NVPDriver):
         super(OptimizedNVPDriver, self).\
             delete_port(context, port_id, lswitch_uuid=switch.nvp_id)
         context.session.delete(port)
-        switch.port_count = switch.port_count - 1
+        self._lswitch_release(context, switch, 1)
+
+    def delete_ports(self, context, port_ids):
+        """Deletes several lports with a single lookup of their switches.
+
+        NVP has no batch delete, so each lport still costs its own DELETE
+        request. The switches come from quark's tables in one query instead
+        of one per port, and each switch has its port count updated once.
+        Ports missing from those tables are looked up in NVP.
+        """
+        lports = self._lports_select_by_ids(context, port_ids)
+        switches = {}
+        for port in lports:
+            switch = port.switch
+            super(OptimizedNVPDriver, self).\
+                delete_port(context, port.port_id, lswitch_uuid=switch.nvp_id)
+            context.session.delete(port)
+            switches.setdefault(switch.id, [switch, 0])[1] += 1
+        known = set(port.port_id for port in lports)
+        for port_id in port_ids:
+            if port_id not in known:
+                super(OptimizedNVPDriver, self).delete_port(context, port_id)
+        for switch, count in switches.values():
+            self._lswitch_release(context, switch, count)
+
+    def _lswitch_release(self, context, switch, count):
+        """Takes count ports off switch, deleting it if it is left empty.
+
+        The last switch of a network is kept even when empty.
+        """
+        switch.port_count = switch.port_count - count
         if switch.port_count == 0:
             switches = self._lswitches_for_network(context, switch.network_id)
             if len(switches) > 1:
@@ -100,6 +129,12 @@ class OptimizedNVPDriver(NVPDriver):
         query = query.filter(LSwitchPort.port_id == port_id)
         return query.first()
 
+    def _lports_select_by_ids(self, context, port_ids):
+        query = context.session.query(LSwitchPort)
+        query = query.options(orm.joinedload("switch"))
+        query = query.filter(LSwitchPort.port_id.in_(port_ids))
+        return query.all()
+
     def _lswitch_delete(self, context, lswitch_uuid):
         switch = self._lswitch_select_by_nvp_id(context, lswitch_uuid)
         super(OptimizedNVPDriver, self).\
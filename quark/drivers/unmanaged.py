@@ -57,6 +57,15 @@ class UnmanagedDriver(object):
         bridge_name = STRATEGY.get_network(context, network_id)["bridge"]
         return {"uuid": port_id, "bridge": bridge_name}
 
+    def create_ports(self, context, network_id, ports):
+        """Creates several ports on one network.
+
+        ports is a list of dicts of create_port keyword arguments, each with
+        a port_id. Returns the backend dicts in the same order.
+        """
+        return [self.create_port(context, network_id, **port)
+                for port in ports]
+
     def update_port(self, context, port_id, **kwargs):
         LOG.info("update_port %s %s" % (context.tenant_id, port_id))
         return {"uuid": port_id}
@@ -64,6 +73,11 @@ class UnmanagedDriver(object):
     def delete_port(self, context, port_id, **kwargs):
         LOG.info("delete_port %s %s" % (context.tenant_id, port_id))
 
+    def delete_ports(self, context, port_ids):
+        """Deletes several ports, possibly on different networks."""
+        for port_id in port_ids:
+            self.delete_port(context, port_id)
+
     def diag_port(self, context, network_id, **kwargs):
         LOG.info("diag_port %s" % network_id)
         return {}
@@ -0,0 +1,146 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Process-wide cache of IP policies compiled to sorted integer intervals.
+"""
+
+import bisect
+
+import netaddr
+
+# Entries are tiny, this only guards against unbounded growth in a long
+# running process that sees a lot of subnet churn.
+MAX_ENTRIES = 4096
+
+_CACHE = {}
+
+
+class IPPolicyIntervals(object):
+    """The addresses of a subnet excluded by its IP policy.
+
+    Stored as sorted, disjoint, non-adjacent inclusive (first, last) integer
+    intervals in the native integer space of the subnet's IP version, clipped
+    to the subnet CIDR. Membership tests are a bisect over plain integers.
+    """
+    def __init__(self, version, cidr_first, cidr_last, intervals):
+        self.version = version
+        self.cidr_first = cidr_first
+        self.cidr_last = cidr_last
+        self.firsts = [first for first, last in intervals]
+        self.lasts = [last for first, last in intervals]
+        self.size = sum([last - first + 1 for first, last in intervals])
+
+    def __contains__(self, address):
+        address = int(address)
+        i = bisect.bisect_right(self.firsts, address) - 1
+        return i >= 0 and address <= self.lasts[i]
+
+    def __iter__(self):
+        return iter(zip(self.firsts, self.lasts))
+
+    def __len__(self):
+        return len(self.firsts)
+
+    def first_permitted(self, first, last):
+        """Returns the lowest address in [first, last] not excluded."""
+        candidate = first
+        i = bisect.bisect_right(self.firsts, candidate) - 1
+        if i >= 0 and candidate <= self.lasts[i]:
+            # Intervals are never adjacent, last + 1 is always permitted
+            candidate = self.lasts[i] + 1
+        if candidate > last:
+            return None
+        return candidate
+
+    def permitted(self):
+        """Yields the inclusive spans of the subnet CIDR not excluded."""
+        start = self.cidr_first
+        for first, last in self:
+            if first > start:
+                yield start, first - 1
+            start = last + 1
+        if start <= self.cidr_last:
+            yield start, self.cidr_last
+
+
+def compile_policy(cidr, excluded_cidrs):
+    """Compiles the exclusions of a policy applied to the subnet cidr.
+
+    The network and broadcast addresses of the subnet are always excluded.
+    Excluded CIDRs of the other IP version are ignored.
+    """
+    subnet_cidr = netaddr.IPNetwork(cidr)
+    spans = [(subnet_cidr.first, subnet_cidr.first),
+             (subnet_cidr.last, subnet_cidr.last)]
+    for excluded in excluded_cidrs:
+        excluded = netaddr.IPNetwork(excluded)
+        if excluded.version != subnet_cidr.version:
+            continue
+        first = max(excluded.first, subnet_cidr.first)
+        last = min(excluded.last, subnet_cidr.last)
+        if first <= last:
+            spans.append((first, last))
+    spans.sort()
+
+    intervals = []
+    for first, last in spans:
+        if intervals and first <= intervals[-1][1] + 1:
+            if last > intervals[-1][1]:
+                intervals[-1] = (intervals[-1][0], last)
+            continue
+        intervals.append((first, last))
+    return IPPolicyIntervals(subnet_cidr.version, subnet_cidr.first,
+                             subnet_cidr.last, intervals)
+
+
+def _excluded_cidrs(ip_policy):
+    return [excluded["cidr"] for excluded in ip_policy.get("exclude") or []]
+
+
+def get(ip_policy, cidr):
+    """Returns the compiled intervals of ip_policy applied to cidr.
+
+    Policy models are cached under their id and revision, subnets without a
+    policy under their CIDR alone. Anything else, like a bare dict policy, is
+    compiled on every call.
+    """
+    ip_policy = ip_policy or {}
+    policy_id = ip_policy.get("id")
+    if policy_id:
+        key = (policy_id, ip_policy.get("revision") or 0, cidr)
+    elif not ip_policy.get("exclude"):
+        key = (None, 0, cidr)
+    else:
+        return compile_policy(cidr, _excluded_cidrs(ip_policy))
+
+    compiled = _CACHE.get(key)
+    if compiled is None:
+        compiled = compile_policy(cidr, _excluded_cidrs(ip_policy))
+        if len(_CACHE) >= MAX_ENTRIES:
+            _CACHE.clear()
+        _CACHE[key] = compiled
+    return compiled
+
+
+def invalidate(policy_id):
+    """Drops every compiled entry of the policy."""
+    for key in list(_CACHE.keys()):
+        if key[0] == policy_id:
+            _CACHE.pop(key, None)
+
+
+def clear():
+    _CACHE.clear()
@@ -17,24 +17,168 @@
 Quark Pluggable IPAM
 """
 
+import hashlib
+import random
+
 import netaddr
 
 from neutron.common import exceptions
+from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common import log as logging
-from neutron.openstack.common.notifier import api as notifier_api
 from neutron.openstack.common import timeutils
 
 from oslo.config import cfg
 
 from quark.db import api as db_api
 from quark.db import models
+from quark import notifications
 
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
 
+class WarmPoolStats(object):
+    """Counts the allocations served from a warm pool and the misses."""
+    log_every = 1000
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        claims = self.hits + self.misses
+        if claims % self.log_every == 0:
+            LOG.info("Warm pool hit rate %.1f%% over %d claims" %
+                     (self.hit_rate() * 100, claims))
+
+    def hit_rate(self):
+        claims = self.hits + self.misses
+        if not claims:
+            return 0.0
+        return self.hits / float(claims)
+
+
+WARM_POOL_STATS = WarmPoolStats()
+
+
 class QuarkIpam(object):
+    # Whether subnets are row locked while an address is picked from them
+    lock_subnets = True
+
+    def _take_from_free_block(self, context, free_block, address):
+        first = free_block["first_address"]
+        last = free_block["last_address"]
+        if first == last:
+            db_api.mac_address_free_block_delete(context, free_block)
+        elif address == first:
+            db_api.mac_address_free_block_update(context, free_block,
+                                                 first_address=first + 1)
+        elif address == last:
+            db_api.mac_address_free_block_update(context, free_block,
+                                                 last_address=last - 1)
+        else:
+            db_api.mac_address_free_block_update(context, free_block,
+                                                 last_address=address - 1)
+            db_api.mac_address_free_block_create(
+                context,
+                mac_address_range_id=free_block["mac_address_range_id"],
+                first_address=address + 1, last_address=last)
+
+    def _next_free_mac(self, context, rng):
+        free_block = db_api.mac_address_free_block_find(
+            context, mac_address_range_id=rng["id"], lock_mode=True,
+            scope=db_api.ONE)
+        if not free_block:
+            return None
+        next_address = free_block["first_address"]
+        self._take_from_free_block(context, free_block, next_address)
+        return next_address
+
+    def _claim_free_mac(self, context, rng, address):
+        free_block = db_api.mac_address_free_block_find(
+            context, mac_address_range_id=rng["id"], address=address,
+            lock_mode=True, scope=db_api.ONE)
+        if free_block:
+            self._take_from_free_block(context, free_block, address)
+
+    def _probe_next_mac(self, context, rng):
+        """The next unused MAC of rng, None once past its last address."""
+        address = True
+        while address:
+            next_address = rng["next_auto_assign_mac"]
+            # last_address is exclusive
+            if next_address >= rng["last_address"]:
+                return None
+            rng["next_auto_assign_mac"] = next_address + 1
+            address = db_api.mac_address_find(
+                context, tenant_id=context.tenant_id,
+                scope=db_api.ONE, address=next_address)
+        return next_address
+
+    def _next_free_macs(self, context, rng, count):
+        free_blocks = db_api.mac_address_free_block_find(
+            context, mac_address_range_id=rng["id"], lock_mode=True,
+            scope=db_api.ALL) or []
+        next_addresses = []
+        for free_block in free_blocks:
+            wanted = count - len(next_addresses)
+            if wanted <= 0:
+                break
+            first = free_block["first_address"]
+            last = min(free_block["last_address"], first + wanted - 1)
+            if last == free_block["last_address"]:
+                db_api.mac_address_free_block_delete(context, free_block)
+            else:
+                db_api.mac_address_free_block_update(context, free_block,
+                                                     first_address=last + 1)
+            next_addresses.extend(xrange(first, last + 1))
+        return next_addresses
+
+    def allocate_mac_addresses_bulk(self, context, net_id, count,
+                                    reuse_after):
+        """Allocates count MAC addresses in one transaction.
+
+        Deallocated MACs past reuse_after are handed out first, then new ones
+        are taken from the ranges in the order allocate_mac_address would
+        try them.
+        """
+        with context.session.begin(subtransactions=True):
+            macs = db_api.mac_address_find(context, lock_mode=True,
+                                           reuse_after=reuse_after)
+            macs = macs.limit(count).all() if macs else []
+            macs = db_api.mac_address_reallocate_bulk(context, macs)
+
+            ranges = db_api.mac_address_range_find_allocation_counts(context)
+            for rng, addr_count in ranges:
+                wanted = min(count - len(macs),
+                             rng["last_address"] - rng["first_address"] -
+                             addr_count)
+                if wanted <= 0:
+                    continue
+                if rng.get("free_blocks_indexed"):
+                    next_addresses = self._next_free_macs(context, rng,
+                                                          wanted)
+                else:
+                    next_addresses = []
+                    for i in xrange(wanted):
+                        next_address = self._probe_next_mac(context, rng)
+                        if next_address is None:
+                            break
+                        next_addresses.append(next_address)
+                macs.extend(db_api.mac_address_create_bulk(
+                    context, [dict(address=address,
+                                   mac_address_range_id=rng["id"])
+                              for address in next_addresses]))
+
+            if len(macs) < count:
+                raise exceptions.MacAddressGenerationFailure(net_id=net_id)
+        return macs
+
     def allocate_mac_address(self, context, net_id, port_id, reuse_after,
                              mac_address=None):
         if mac_address:
@@ -61,14 +205,16 @@ class QuarkIpam(object):
                 next_address = None
                 if mac_address:
                     next_address = mac_address
+                    if rng.get("free_blocks_indexed"):
+                        self._claim_free_mac(context, rng, next_address)
+                elif rng.get("free_blocks_indexed"):
+                    next_address = self._next_free_mac(context, rng)
+                    if next_address is None:
+                        continue
                 else:
-                    address = True
-                    while address:
-                        next_address = rng["next_auto_assign_mac"]
-                        rng["next_auto_assign_mac"] = next_address + 1
-                        address = db_api.mac_address_find(
-                            context, tenant_id=context.tenant_id,
-                            scope=db_api.ONE, address=next_address)
+                    next_address = self._probe_next_mac(context, rng)
+                    if next_address is None:
+                        continue
 
                 address = db_api.mac_address_create(
                     context, address=next_address,
@@ -77,11 +223,45 @@ class QuarkIpam(object):
 
         raise exceptions.MacAddressGenerationFailure(net_id=net_id)
 
+    def _reallocation_subnet_ids(self, context, net_id, segment_id,
+                                 subnets):
+        """The subnets reallocated addresses may come from, [] is any."""
+        if subnets:
+            return subnets
+        if not segment_id:
+            return []
+        segment_subnets = db_api.subnet_find(context, network_id=net_id,
+                                             segment_id=segment_id)
+        sub_ids = [s["id"] for s in segment_subnets]
+        if not sub_ids:
+            raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+        return sub_ids
+
+    def _reallocate_ip(self, context, address):
+        """Hands a deallocated address out again.
+
+        Returns None and deletes the address instead if it isn't within its
+        subnet's CIDR.
+        """
+        #NOTE(mdietz): We should always be in the CIDR but we've
+        #              also said that before :-/
+        cidr = netaddr.IPNetwork(address["subnet"]["cidr"])
+        addr = netaddr.IPAddress(int(address["address"]),
+                                 version=int(cidr.version))
+        if addr in cidr:
+            return db_api.ip_address_update(
+                context, address, deallocated=False, deallocated_at=None,
+                allocated_at=timeutils.utcnow())
+        # Make sure we never find it again
+        context.session.delete(address)
+
     def attempt_to_reallocate_ip(self, context, net_id, port_id, reuse_after,
                                  version=None, ip_address=None,
                                  segment_id=None, subnets=None):
         version = version or [4, 6]
         elevated = context.elevated()
+        sub_ids = self._reallocation_subnet_ids(elevated, net_id, segment_id,
+                                                subnets)
 
         # We never want to take the chance of an infinite loop here. Instead,
         # we'll clean up multiple bad IPs if we find them (assuming something
@@ -90,48 +270,21 @@ class QuarkIpam(object):
         #TODO(mdietz & mpath): Perhaps remove, select for update might quash
         for times in xrange(3):
             with context.session.begin(subtransactions=True):
-
-                sub_ids = []
-                if subnets:
-                    sub_ids = subnets
-                else:
-                    if segment_id:
-                        subnets = db_api.subnet_find(elevated,
-                                                     network_id=net_id,
-                                                     segment_id=segment_id)
-                        sub_ids = [s["id"] for s in subnets]
-                        if not sub_ids:
-                            raise exceptions.IpAddressGenerationFailure(
-                                net_id=net_id)
-
                 ip_kwargs = {
                     "network_id": net_id, "reuse_after": reuse_after,
-                    "deallocated": True, "scope": db_api.ONE,
-                    "ip_address": ip_address, "lock_mode": True,
-                    "version": version, "order_by": "address"}
+                    "scope": db_api.ONE, "ip_address": ip_address,
+                    "lock_mode": True, "version": version}
 
                 if sub_ids:
                     ip_kwargs["subnet_id"] = sub_ids
 
-                address = db_api.ip_address_find(elevated, **ip_kwargs)
+                address = db_api.ip_address_reuse_find(elevated, **ip_kwargs)
 
-                if address:
-                    #NOTE(mdietz): We should always be in the CIDR but we've
-                    #              also said that before :-/
-                    if address.get("subnet"):
-                        cidr = netaddr.IPNetwork(address["subnet"]["cidr"])
-                        addr = netaddr.IPAddress(int(address["address"]),
-                                                 version=int(cidr.version))
-                        if addr in cidr:
-                            updated_address = db_api.ip_address_update(
-                                elevated, address, deallocated=False,
-                                deallocated_at=None,
-                                allocated_at=timeutils.utcnow())
-                            return [updated_address]
-                        else:
-                            # Make sure we never find it again
-                            context.session.delete(address)
-                            continue
+                if address and address.get("subnet"):
+                    updated_address = self._reallocate_ip(elevated, address)
+                    if updated_address:
+                        return [updated_address]
+                    continue
                 break
         return []
 
@@ -139,16 +292,26 @@ class QuarkIpam(object):
         return ip_addresses
 
     def _iterate_until_available_ip(self, context, subnet, network_id,
-                                    ip_policy_cidrs):
+                                    ip_policy):
+        last_ip = netaddr.IPNetwork(subnet["cidr"]).last
         address = True
         while address:
             next_ip_int = int(subnet["next_auto_assign_ip"])
+            subnet["next_auto_assign_ip"] = next_ip_int + 1
+            native_ip_int = next_ip_int
+            if subnet["ip_version"] == 4:
+                # IPv4 auto assignment is stored ipv4 mapped
+                native_ip_int = next_ip_int & 0xFFFFFFFF
+            # Never hand out addresses past the end of the CIDR, whatever
+            # the counters claimed
+            if native_ip_int > last_ip:
+                raise exceptions.IpAddressGenerationFailure(
+                    net_id=network_id)
+            if ip_policy and native_ip_int in ip_policy:
+                continue
             next_ip = netaddr.IPAddress(next_ip_int)
             if subnet["ip_version"] == 4:
                 next_ip = next_ip.ipv4()
-            subnet["next_auto_assign_ip"] = next_ip_int + 1
-            if ip_policy_cidrs and next_ip in ip_policy_cidrs:
-                continue
             address = db_api.ip_address_find(
                 context, network_id=network_id, ip_address=next_ip,
                 used_by_tenant_id=context.tenant_id, scope=db_api.ONE)
@@ -160,11 +323,123 @@ class QuarkIpam(object):
             next_addr = next_addr.ipv4()
         return next_ip
 
+    def _take_from_free_range(self, context, free_range, address):
+        first = int(free_range["first_ip"])
+        last = int(free_range["last_ip"])
+        if first == last:
+            db_api.subnet_free_range_delete(context, free_range)
+        elif address == first:
+            db_api.subnet_free_range_update(context, free_range,
+                                            first_ip=first + 1)
+        elif address == last:
+            db_api.subnet_free_range_update(context, free_range,
+                                            last_ip=last - 1)
+        else:
+            db_api.subnet_free_range_update(context, free_range,
+                                            last_ip=address - 1)
+            db_api.subnet_free_range_create(
+                context, subnet_id=free_range["subnet_id"],
+                first_ip=address + 1, last_ip=last)
+
+    def _free_ranges_in_order(self, context, subnet, lock_mode=True,
+                              start=None):
+        """Yields the free ranges of subnet, locking one at a time.
+
+        Each range is read with its own LIMIT 1 query so a fragmented
+        subnet never has its whole index locked and loaded. With start the
+        ranges ending before it are skipped.
+        """
+        after = None
+        if start is not None:
+            free_range = db_api.subnet_free_range_find(
+                context, subnet_id=subnet["id"], lock_mode=lock_mode,
+                containing=start, scope=db_api.ONE)
+            if free_range:
+                after = int(free_range["last_ip"])
+                yield free_range
+            else:
+                after = start
+        while True:
+            free_range = db_api.subnet_free_range_find(
+                context, subnet_id=subnet["id"], lock_mode=lock_mode,
+                after=after, scope=db_api.ONE)
+            if not free_range:
+                return
+            # Ranges don't overlap, and whatever the caller splits off this
+            # one lies within it
+            after = int(free_range["last_ip"])
+            yield free_range
+
+    def _next_free_ip(self, context, subnet, net_id, ip_policy):
+        for free_range in self._free_ranges_in_order(context, subnet):
+            next_ip = ip_policy.first_permitted(int(free_range["first_ip"]),
+                                                int(free_range["last_ip"]))
+            if next_ip is None:
+                continue
+            self._take_from_free_range(context, free_range, next_ip)
+            return netaddr.IPAddress(next_ip, version=subnet["ip_version"])
+        raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+
+    def _take_many_from_free_range(self, context, free_range, addresses):
+        """Removes the sorted addresses from the range, splitting it."""
+        last = int(free_range["last_ip"])
+        spans = []
+        start = int(free_range["first_ip"])
+        for address in addresses:
+            if address > start:
+                spans.append((start, address - 1))
+            start = address + 1
+        if start <= last:
+            spans.append((start, last))
+        if not spans:
+            db_api.subnet_free_range_delete(context, free_range)
+            return
+        db_api.subnet_free_range_update(context, free_range,
+                                        first_ip=spans[0][0],
+                                        last_ip=spans[0][1])
+        for first, last in spans[1:]:
+            db_api.subnet_free_range_create(
+                context, subnet_id=free_range["subnet_id"], first_ip=first,
+                last_ip=last)
+
+    def _next_free_ips(self, context, subnet, count, ip_policy):
+        """Takes up to count permitted addresses from the free ranges."""
+        next_ips = []
+        for free_range in self._free_ranges_in_order(context, subnet):
+            taken = []
+            first = int(free_range["first_ip"])
+            last = int(free_range["last_ip"])
+            while len(next_ips) + len(taken) < count:
+                next_ip = ip_policy.first_permitted(first, last)
+                if next_ip is None:
+                    break
+                taken.append(next_ip)
+                first = next_ip + 1
+            if taken:
+                self._take_many_from_free_range(context, free_range, taken)
+                next_ips.extend(taken)
+            if len(next_ips) >= count:
+                break
+        return [netaddr.IPAddress(ip, version=subnet["ip_version"])
+                for ip in next_ips]
+
+    def _claim_free_ip(self, context, subnet, ip_address):
+        address = int(ip_address)
+        free_ranges = db_api.subnet_free_range_find(
+            context, subnet_id=subnet["id"], containing=address,
+            lock_mode=True, scope=db_api.ALL)
+        for free_range in free_ranges:
+            if int(free_range["first_ip"]) <= address <= \
+                    int(free_range["last_ip"]):
+                self._take_from_free_range(context, free_range, address)
+                return
+
     def _allocate_ips_from_subnets(self, context, net_id, subnets,
-                                   ip_address=None):
+                                   ip_address=None, port_id=None,
+                                   mac_address=None):
         new_addresses = []
         for subnet in subnets:
-            ip_policy_cidrs = models.IPPolicy.get_ip_policy_cidrs(subnet)
+            ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
             # Creating this IP for the first time
             next_ip = None
             if ip_address:
@@ -175,9 +450,14 @@ class QuarkIpam(object):
                 if address:
                     raise exceptions.IpAddressGenerationFailure(
                         net_id=net_id)
+                if subnet.get("free_ranges_indexed"):
+                    self._claim_free_ip(context, subnet, next_ip)
+            elif subnet.get("free_ranges_indexed"):
+                next_ip = self._next_free_ip(context, subnet, net_id,
+                                             ip_policy)
             else:
                 next_ip = self._iterate_until_available_ip(
-                    context, subnet, net_id, ip_policy_cidrs)
+                    context, subnet, net_id, ip_policy)
 
             context.session.add(subnet)
             address = db_api.ip_address_create(
@@ -194,15 +474,30 @@ class QuarkIpam(object):
                            ip_address=addr["address_readable"],
                            device_ids=[p["device_id"] for p in addr["ports"]],
                            created_at=addr["created_at"])
-            notifier_api.notify(context,
-                                notifier_api.publisher_id("network"),
-                                "ip_block.address.create",
-                                notifier_api.CONF.default_notification_level,
-                                payload)
+            notifications.notify(context, "ip_block.address.create",
+                                 payload)
+
+    def _claim_pooled_ips(self, context, net_id, version, segment_id,
+                          allocated):
+        """Claims the addresses still missing from the warm pool."""
+        if net_id not in CONF.QUARK.ipam_warm_pool_sizes:
+            return []
+        have = [address["version"] for address in allocated]
+        claimed = []
+        for ver in self._bulk_versions(version):
+            if ver in have:
+                continue
+            address = db_api.ip_address_pool_claim(
+                context, net_id, CONF.QUARK.ipam_optimistic_retries,
+                version=ver, segment_id=segment_id)
+            WARM_POOL_STATS.record(address is not None)
+            if address is not None:
+                claimed.append(address)
+        return claimed
 
     def allocate_ip_address(self, context, net_id, port_id, reuse_after,
                             segment_id=None, version=None, ip_address=None,
-                            subnets=None):
+                            subnets=None, mac_address=None):
         elevated = context.elevated()
         if ip_address:
             ip_address = netaddr.IPAddress(ip_address)
@@ -219,35 +514,187 @@ class QuarkIpam(object):
             return realloc_ips
 
         new_addresses.extend(realloc_ips)
+        if not (ip_address or subnets):
+            new_addresses.extend(self._claim_pooled_ips(
+                context, net_id, version, segment_id, new_addresses))
+            if self.is_strategy_satisfied(new_addresses):
+                self._notify_new_addresses(context, new_addresses)
+                return new_addresses
+
         with context.session.begin(subtransactions=True):
             if not subnets:
                 subnets = self._choose_available_subnet(
                     elevated, net_id, version, segment_id=segment_id,
-                    ip_address=ip_address, reallocated_ips=realloc_ips)
+                    ip_address=ip_address, reallocated_ips=new_addresses)
             else:
                 subnets = [self.select_subnet(context, net_id, ip_address,
                                               segment_id, subnet_ids=subnets)]
 
             ips = self._allocate_ips_from_subnets(context, net_id,
-                                                  subnets, ip_address)
+                                                  subnets, ip_address,
+                                                  port_id=port_id,
+                                                  mac_address=mac_address)
             new_addresses.extend(ips)
 
         self._notify_new_addresses(context, new_addresses)
         return new_addresses
 
+    def _bulk_versions(self, version):
+        """The version filters a port needs one address of, None is any."""
+        return [version]
+
+    def _bulk_satisfied(self, ip_addresses):
+        return len(ip_addresses) > 0
+
+    def _reallocate_ips_bulk(self, context, net_id, count, reuse_after,
+                             version, subnet_ids):
+        ip_kwargs = {
+            "network_id": net_id, "reuse_after": reuse_after,
+            "lock_mode": True, "version": version and [version] or [4, 6]}
+        if subnet_ids:
+            ip_kwargs["subnet_id"] = subnet_ids
+        candidates = db_api.ip_address_reuse_find(context, **ip_kwargs)
+        candidates = candidates.limit(count).all() if candidates else []
+
+        addresses = []
+        for address in candidates:
+            #NOTE(mdietz): We should always be in the CIDR but we've
+            #              also said that before :-/
+            if address.get("subnet"):
+                cidr = netaddr.IPNetwork(address["subnet"]["cidr"])
+                addr = netaddr.IPAddress(int(address["address"]),
+                                         version=int(cidr.version))
+                if addr in cidr:
+                    addresses.append(address)
+                else:
+                    # Make sure we never find it again
+                    context.session.delete(address)
+        return db_api.ip_address_reallocate_bulk(context, addresses)
+
+    def _allocate_new_ips_bulk(self, context, net_id, count, version,
+                               segment_id, subnet_ids, port_ids=None,
+                               mac_addresses=None):
+        filters = {}
+        if version:
+            filters["ip_version"] = version
+        subnets = db_api.subnet_find_allocation_counts(
+            context, net_id, lock_mode=self.lock_subnets,
+            segment_id=segment_id, scope=db_api.ALL, subnet_id=subnet_ids,
+            **filters)
+        new_addresses = []
+        for subnet, ips_in_subnet in subnets:
+            wanted = count - len(new_addresses)
+            if wanted <= 0:
+                break
+            ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+            available = (netaddr.IPNetwork(subnet["cidr"]).size -
+                         ips_in_subnet - ip_policy.size)
+            if available <= 0:
+                continue
+            new_addresses.extend(self._create_new_ips(
+                context, subnet, net_id, min(wanted, available), ip_policy))
+        return new_addresses
+
+    def _create_new_ips(self, context, subnet, net_id, count, ip_policy):
+        """Generates up to count never used addresses in subnet."""
+        if subnet.get("free_ranges_indexed"):
+            next_ips = self._next_free_ips(context, subnet, count, ip_policy)
+        else:
+            next_ips = [self._iterate_until_available_ip(
+                context, subnet, net_id, ip_policy) for i in xrange(count)]
+        context.session.add(subnet)
+        return db_api.ip_address_create_bulk(
+            context, [dict(address=next_ip, subnet_id=subnet["id"],
+                           version=subnet["ip_version"], network_id=net_id)
+                      for next_ip in next_ips])
+
+    def allocate_ip_addresses_bulk(self, context, net_id, count, reuse_after,
+                                   segment_id=None, version=None,
+                                   subnets=None, port_ids=None,
+                                   mac_addresses=None):
+        """Allocates the addresses of count ports in one transaction.
+
+        Returns count lists of addresses, one per port, each shaped like the
+        return value of allocate_ip_address. Deallocated addresses past
+        reuse_after are handed out first, in address order, then new ones
+        are generated from the subnets subnet selection would pick.
+        port_ids and mac_addresses hold the id and MAC of each port, as
+        allocate_ip_address takes them, for strategies deriving addresses.
+        """
+        port_ids = port_ids or [None] * count
+        mac_addresses = mac_addresses or [None] * count
+        elevated = context.elevated()
+        per_version = []
+        with context.session.begin(subtransactions=True):
+            sub_ids = subnets
+            if not sub_ids and segment_id:
+                segment_subnets = db_api.subnet_find(elevated,
+                                                     network_id=net_id,
+                                                     segment_id=segment_id)
+                sub_ids = [s["id"] for s in segment_subnets]
+                if not sub_ids:
+                    raise exceptions.IpAddressGenerationFailure(
+                        net_id=net_id)
+
+            for ver in self._bulk_versions(version):
+                addresses = self._reallocate_ips_bulk(
+                    elevated, net_id, count, reuse_after, ver, sub_ids)
+                reused = len(addresses)
+                if reused < count:
+                    addresses.extend(self._allocate_new_ips_bulk(
+                        elevated, net_id, count - reused, ver, segment_id,
+                        subnets, port_ids=port_ids[reused:],
+                        mac_addresses=mac_addresses[reused:]))
+                per_version.append(addresses)
+
+            allocated = []
+            for i in xrange(count):
+                port_addresses = [version_addresses[i]
+                                  for version_addresses in per_version
+                                  if i < len(version_addresses)]
+                if not self._bulk_satisfied(port_addresses):
+                    raise exceptions.IpAddressGenerationFailure(
+                        net_id=net_id)
+                allocated.append(port_addresses)
+
+        self._notify_new_addresses(
+            context, [addr for addrs in allocated for addr in addrs])
+        return allocated
+
+    def reserve_ip_addresses(self, context, net_id, subnet_id, count):
+        """Creates up to count addresses of a subnet for its warm pool.
+
+        Returns the reserved addresses, fewer than count when the subnet
+        runs out of room.
+        """
+        with context.session.begin(subtransactions=True):
+            subnets = db_api.subnet_find_allocation_counts(
+                context, net_id, lock_mode=self.lock_subnets,
+                subnet_id=[subnet_id])
+            for subnet, ips_in_subnet in subnets:
+                ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+                room = (netaddr.IPNetwork(subnet["cidr"]).size -
+                        ips_in_subnet - ip_policy.size)
+                if room <= 0:
+                    break
+                addresses = self._create_new_ips(
+                    context, subnet, net_id, min(count, room), ip_policy)
+                return db_api.ip_address_pool_reserve(context, addresses)
+        return []
+
     def _deallocate_ip_address(self, context, address):
-        address["deallocated"] = 1
+        db_api.ip_address_set_deallocated(context, address, 1)
+        self._notify_deallocated_address(
+            context, address, [p["device_id"] for p in address["ports"]])
+
+    def _notify_deallocated_address(self, context, address, device_ids):
         payload = dict(used_by_tenant_id=address["used_by_tenant_id"],
                        ip_block_id=address["subnet_id"],
                        ip_address=address["address_readable"],
-                       device_ids=[p["device_id"] for p in address["ports"]],
+                       device_ids=device_ids,
                        created_at=address["created_at"],
                        deleted_at=timeutils.utcnow())
-        notifier_api.notify(context,
-                            notifier_api.publisher_id("network"),
-                            "ip_block.address.delete",
-                            notifier_api.CONF.default_notification_level,
-                            payload)
+        notifications.notify(context, "ip_block.address.delete", payload)
 
     def deallocate_ip_address(self, context, port, **kwargs):
         with context.session.begin(subtransactions=True):
@@ -277,24 +724,76 @@ class QuarkIpam(object):
             db_api.mac_address_update(context, mac, deallocated=True,
                                       deallocated_at=timeutils.utcnow())
 
+    def deallocate_ip_addresses_bulk(self, context, ports):
+        """Deallocates the addresses of several ports being deleted together.
+
+        Behaves like deallocate_ip_address called for each port, but which
+        addresses are still shared with a port outside of ports is worked out
+        with one query and the rest are deallocated with one UPDATE.
+        """
+        with context.session.begin(subtransactions=True):
+            addresses = {}
+            device_ids = {}
+            for port in ports:
+                for address in port["ip_addresses"]:
+                    addresses[address["id"]] = address
+                    device_ids.setdefault(address["id"], []).append(
+                        port["device_id"])
+            shared = db_api.ip_address_shared_ids(
+                context, addresses.keys(), [port["id"] for port in ports])
+            freed = [address for address_id, address in addresses.items()
+                     if address_id not in shared]
+            db_api.ip_address_deallocate_bulk(context, freed)
+        for address in freed:
+            self._notify_deallocated_address(context, address,
+                                             device_ids[address["id"]])
+
+    def deallocate_mac_addresses_bulk(self, context, addresses):
+        with context.session.begin(subtransactions=True):
+            db_api.mac_address_deallocate_bulk(context, addresses)
+
     def select_subnet(self, context, net_id, ip_address, segment_id,
                       subnet_ids=None, **filters):
-        subnets = db_api.subnet_find_allocation_counts(context, net_id,
-                                                       segment_id=segment_id,
-                                                       scope=db_api.ALL,
-                                                       subnet_id=subnet_ids,
-                                                       **filters)
+        subnets = db_api.subnet_find_allocation_counts(
+            context, net_id, lock_mode=self.lock_subnets,
+            containing=ip_address, segment_id=segment_id, scope=db_api.ALL,
+            subnet_id=subnet_ids, **filters)
         for subnet, ips_in_subnet in subnets:
-            ipnet = netaddr.IPNetwork(subnet["cidr"])
-            if ip_address and ip_address not in ipnet:
-                continue
-            ip_policy_cidrs = None
-            if not ip_address:
-                ip_policy_cidrs = models.IPPolicy.get_ip_policy_cidrs(subnet)
-            policy_size = ip_policy_cidrs.size if ip_policy_cidrs else 0
-            if ipnet.size > (ips_in_subnet + policy_size):
+            if self._subnet_has_room(subnet, ips_in_subnet, ip_address):
                 return subnet
 
+    def select_subnets_by_version(self, context, net_id, ip_address,
+                                  segment_id, versions):
+        """Picks a subnet for each of versions with one capacity query.
+
+        Returns a dict of IP version to the subnet select_subnet would have
+        chosen for that version, versions without room are left out.
+        """
+        filters = {}
+        if len(versions) == 1:
+            filters["ip_version"] = versions[0]
+        subnets = db_api.subnet_find_allocation_counts(
+            context, net_id, lock_mode=self.lock_subnets,
+            containing=ip_address, segment_id=segment_id, scope=db_api.ALL,
+            **filters)
+        chosen = {}
+        for subnet, ips_in_subnet in subnets:
+            ver = subnet["ip_version"]
+            if ver not in versions or ver in chosen:
+                continue
+            if self._subnet_has_room(subnet, ips_in_subnet, ip_address):
+                chosen[ver] = subnet
+        return chosen
+
+    def _subnet_has_room(self, subnet, ips_in_subnet, ip_address):
+        ipnet = netaddr.IPNetwork(subnet["cidr"])
+        if ip_address and ip_address not in ipnet:
+            return False
+        policy_size = 0
+        if not ip_address:
+            policy_size = models.IPPolicy.get_ip_policy_intervals(subnet).size
+        return ipnet.size > (ips_in_subnet + policy_size)
+
 
 class QuarkIpamANY(QuarkIpam):
     @classmethod
@@ -328,35 +827,61 @@ class QuarkIpamBOTH(QuarkIpam):
             return True
         return False
 
+    def _bulk_versions(self, version):
+        return [4, 6]
+
     def attempt_to_reallocate_ip(self, context, net_id, port_id,
                                  reuse_after, version=None,
                                  ip_address=None, segment_id=None,
                                  subnets=None):
+        """Reallocates up to one address of each IP version.
+
+        Both versions are looked up by a single query per attempt.
+        """
+        elevated = context.elevated()
+        sub_ids = self._reallocation_subnet_ids(elevated, net_id, segment_id,
+                                                subnets)
+        ip_kwargs = {
+            "network_id": net_id, "reuse_after": reuse_after,
+            "scope": db_api.ALL, "ip_address": ip_address,
+            "lock_mode": True}
+        if sub_ids:
+            ip_kwargs["subnet_id"] = sub_ids
+
         both_versions = []
-        with context.session.begin(subtransactions=True):
-            for ver in (4, 6):
-                address = super(QuarkIpamBOTH, self).attempt_to_reallocate_ip(
-                    context, net_id, port_id, reuse_after, ver, ip_address,
-                    segment_id, subnets=subnets)
-                both_versions.extend(address)
+        for times in xrange(3):
+            with context.session.begin(subtransactions=True):
+                ip_kwargs["version"] = [ver for ver in (4, 6)
+                                        if ver not in [ip["version"] for ip
+                                                       in both_versions]]
+                addresses = db_api.ip_address_find_reusable(
+                    elevated, **ip_kwargs) or []
+                retry = False
+                for address in addresses:
+                    if not address.get("subnet"):
+                        continue
+                    updated_address = self._reallocate_ip(elevated, address)
+                    if updated_address:
+                        both_versions.append(updated_address)
+                    else:
+                        retry = True
+                if not retry:
+                    break
         return both_versions
 
     def _choose_available_subnet(self, context, net_id, version=None,
                                  segment_id=None, ip_address=None,
                                  reallocated_ips=None):
-        both_subnet_versions = []
         need_versions = [4, 6]
         for i in reallocated_ips:
             if i["version"] in need_versions:
                 need_versions.remove(i["version"])
-        filters = {}
-        for ver in need_versions:
-            filters["ip_version"] = ver
-            sub = self.select_subnet(context, net_id, ip_address, segment_id,
-                                     **filters)
-
-            if sub:
-                both_subnet_versions.append(sub)
+        both_subnet_versions = []
+        if need_versions:
+            subnets = self.select_subnets_by_version(
+                context, net_id, ip_address, segment_id, need_versions)
+            both_subnet_versions = [subnets[ver] for ver in need_versions
+                                    if ver in subnets]
         if not reallocated_ips and not both_subnet_versions:
             raise exceptions.IpAddressGenerationFailure(net_id=net_id)
 
@@ -378,13 +903,299 @@ class QuarkIpamBOTHREQ(QuarkIpamBOTH):
             raise exceptions.IpAddressGenerationFailure(net_id=net_id)
         return subnets
 
+    def _bulk_satisfied(self, ip_addresses):
+        return len(ip_addresses) == 2
+
+
+class QuarkIpamOptimistic(QuarkIpam):
+    """Allocates new addresses without locking the subnets they come from.
+
+    Subnets and their free ranges are read without SELECT ... FOR UPDATE. An
+    address is claimed inside a savepoint by a conditional UPDATE of the free
+    range it was read from and the INSERT of the address itself, which the
+    unique (network_id, address) constraint rejects if another allocator got
+    there first. A lost race rolls back the savepoint and tries again with a
+    fresh read, up to CONF.QUARK.ipam_optimistic_retries times per address.
+    The subnet row isn't written either, the counter shift of each claim is
+    recorded as a delta row that quark-ipam-compact folds in later.
+
+    Explicitly requested addresses and subnets without a free range index
+    are still allocated under locks.
+    """
+    lock_subnets = False
+
+    def _scan_starts(self, subnet):
+        """Where to look for a free address in subnet, in order."""
+        return [netaddr.IPNetwork(subnet["cidr"]).first]
+
+    def _first_free_ip(self, context, subnet, ip_policy):
+        for start in self._scan_starts(subnet):
+            for free_range in self._free_ranges_in_order(
+                    context, subnet, lock_mode=False, start=start):
+                first = int(free_range["first_ip"])
+                last = int(free_range["last_ip"])
+                next_ip = ip_policy.first_permitted(max(first, start), last)
+                if next_ip is not None:
+                    return free_range["id"], first, last, next_ip
+
+    def _create_claimed_ip(self, context, subnet, net_id, next_ip):
+        address = dict(
+            address=netaddr.IPAddress(next_ip, version=subnet["ip_version"]),
+            subnet_id=subnet["id"], version=subnet["ip_version"],
+            network_id=net_id)
+        if (subnet.get("generated_count") is None or
+                subnet.get("allocated_count") is None):
+            # Seeds the counters, after that claims only record deltas
+            return db_api.ip_address_create(context, **address)
+        return db_api.ip_address_claim(context, **address)
+
+    def _claim_next_ip(self, context, subnet, net_id, ip_policy):
+        """Claims the lowest free address of subnet, None if it is full."""
+        for attempt in xrange(CONF.QUARK.ipam_optimistic_retries):
+            candidate = self._first_free_ip(context, subnet, ip_policy)
+            if candidate is None:
+                return None
+            range_id, first, last, next_ip = candidate
+            try:
+                with context.session.begin_nested():
+                    if not db_api.subnet_free_range_take(
+                            context, subnet["id"], range_id, first, last,
+                            next_ip):
+                        continue
+                    return self._create_claimed_ip(context, subnet, net_id,
+                                                   next_ip)
+            except db_exc.DBDuplicateEntry:
+                # The index still listed an address somebody holds, drop it
+                # so the next attempt doesn't trip over it again
+                LOG.debug("Address %s of subnet %s is taken, retrying" %
+                          (next_ip, subnet["id"]))
+                db_api.subnet_free_range_take(context, subnet["id"],
+                                              range_id, first, last, next_ip)
+        raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+
+    def _create_new_ips(self, context, subnet, net_id, count, ip_policy):
+        if not subnet.get("free_ranges_indexed"):
+            return super(QuarkIpamOptimistic, self)._create_new_ips(
+                context, subnet, net_id, count, ip_policy)
+        addresses = []
+        while len(addresses) < count:
+            address = self._claim_next_ip(context, subnet, net_id, ip_policy)
+            if address is None:
+                break
+            addresses.append(address)
+        return addresses
+
+    def _allocate_ips_from_subnets(self, context, net_id, subnets,
+                                   ip_address=None, port_id=None,
+                                   mac_address=None):
+        if ip_address:
+            return super(QuarkIpamOptimistic,
+                         self)._allocate_ips_from_subnets(
+                context, net_id, subnets, ip_address)
+        new_addresses = []
+        for subnet in subnets:
+            ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+            addresses = self._create_new_ips(context, subnet, net_id, 1,
+                                             ip_policy)
+            if not addresses:
+                raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+            addresses[0]["deallocated"] = 0
+            new_addresses.extend(addresses)
+        return new_addresses
+
+
+class QuarkIpamSharded(QuarkIpamOptimistic):
+    """Spreads concurrent optimistic allocations over the subnet.
+
+    The CIDR is split into CONF.QUARK.ipam_cursor_shards equal shards and
+    every claim starts looking at the beginning of a random one, so parallel
+    allocators mostly take from different free ranges instead of racing for
+    the head of the first. Shards still fill front to back, which keeps the
+    free range index small. The subnet is scanned from its start only when
+    nothing is left past the chosen shard.
+    """
+    def _scan_starts(self, subnet):
+        cidr = netaddr.IPNetwork(subnet["cidr"])
+        shards = max(1, min(CONF.QUARK.ipam_cursor_shards, cidr.size))
+        shard_start = cidr.first + cidr.size * random.randrange(shards) // \
+            shards
+        return [shard_start, cidr.first]
+
+
+class QuarkIpamEUI64(QuarkIpam):
+    """Derives new IPv6 addresses from the port instead of probing for them.
+
+    The interface identifier is the modified EUI-64 of the port's MAC
+    address, or a hash of the port id when no MAC is given, placed in the
+    host bits of the subnet. Taking it costs a single existence check and
+    leaves next_auto_assign_ip of the subnet alone. When the derived address
+    is taken or excluded by the subnet's policy, and for explicitly
+    requested and IPv4 addresses, allocation falls back to the usual path.
+    """
+    def _interface_id(self, port_id, mac_address):
+        if mac_address is not None:
+            return int(netaddr.EUI(mac_address).ipv6(0))
+        if port_id:
+            return int(hashlib.sha1(port_id).hexdigest()[:16], 16)
+
+    def _allocate_derived_ip(self, context, subnet, net_id, port_id,
+                             mac_address):
+        """Creates the derived address of subnet, None if it's unusable."""
+        interface_id = self._interface_id(port_id, mac_address)
+        if interface_id is None:
+            return None
+        cidr = netaddr.IPNetwork(subnet["cidr"])
+        next_ip_int = cidr.first + interface_id % cidr.size
+        ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+        if ip_policy and next_ip_int in ip_policy:
+            return None
+        next_ip = netaddr.IPAddress(next_ip_int, version=6)
+        # Addresses are unique per network whoever holds them
+        if db_api.ip_address_find(context, network_id=net_id,
+                                  ip_address=next_ip, scope=db_api.ONE):
+            LOG.debug("Derived address %s of subnet %s is taken, probing" %
+                      (next_ip, subnet["id"]))
+            return None
+        if subnet.get("free_ranges_indexed"):
+            self._claim_free_ip(context, subnet, next_ip)
+        address = db_api.ip_address_create(
+            context, address=next_ip, subnet_id=subnet["id"], version=6,
+            network_id=net_id)
+        address["deallocated"] = 0
+        return address
+
+    def _allocate_ips_from_subnets(self, context, net_id, subnets,
+                                   ip_address=None, port_id=None,
+                                   mac_address=None):
+        new_addresses = []
+        for subnet in subnets:
+            address = None
+            if not ip_address and subnet["ip_version"] == 6:
+                address = self._allocate_derived_ip(context, subnet, net_id,
+                                                    port_id, mac_address)
+            if address is not None:
+                new_addresses.append(address)
+                continue
+            new_addresses.extend(super(
+                QuarkIpamEUI64, self)._allocate_ips_from_subnets(
+                    context, net_id, [subnet], ip_address, port_id=port_id,
+                    mac_address=mac_address))
+        return new_addresses
+
+    def _allocate_new_ips_bulk(self, context, net_id, count, version,
+                               segment_id, subnet_ids, port_ids=None,
+                               mac_addresses=None):
+        """Derives the addresses of the ports when filling an IPv6 subnet.
+
+        Only when that is the subnet the usual path would fill first. Ports
+        whose derived address is unusable get probed ones, in port order.
+        """
+        filters = {}
+        if version:
+            filters["ip_version"] = version
+        subnets = db_api.subnet_find_allocation_counts(
+            context, net_id, lock_mode=self.lock_subnets,
+            segment_id=segment_id, scope=db_api.ALL, subnet_id=subnet_ids,
+            **filters)
+        subnet = None
+        for candidate, ips_in_subnet in subnets:
+            if self._subnet_has_room(candidate, ips_in_subnet, None):
+                subnet = candidate
+                break
+        if subnet is None or subnet["ip_version"] != 6:
+            return super(QuarkIpamEUI64, self)._allocate_new_ips_bulk(
+                context, net_id, count, version, segment_id, subnet_ids)
+
+        port_ids = port_ids or [None] * count
+        mac_addresses = mac_addresses or [None] * count
+        addresses = [self._allocate_derived_ip(context, subnet, net_id,
+                                               port_id, mac_address)
+                     for port_id, mac_address in zip(port_ids, mac_addresses)]
+        probed = []
+        if None in addresses:
+            probed = super(QuarkIpamEUI64, self)._allocate_new_ips_bulk(
+                context, net_id, addresses.count(None), version, segment_id,
+                subnet_ids)
+            probed.reverse()
+        for i, address in enumerate(addresses):
+            if address is None:
+                if not probed:
+                    # Ports past a shortfall get nothing, as in the usual path
+                    return addresses[:i]
+                addresses[i] = probed.pop()
+        return addresses
+
+
+class QuarkIpamANYOptimistic(QuarkIpamOptimistic, QuarkIpamANY):
+    @classmethod
+    def get_name(self):
+        return "ANY_OPTIMISTIC"
+
+
+class QuarkIpamBOTHOptimistic(QuarkIpamOptimistic, QuarkIpamBOTH):
+    @classmethod
+    def get_name(self):
+        return "BOTH_OPTIMISTIC"
+
+
+class QuarkIpamBOTHREQOptimistic(QuarkIpamOptimistic, QuarkIpamBOTHREQ):
+    @classmethod
+    def get_name(self):
+        return "BOTH_REQUIRED_OPTIMISTIC"
+
+
+class QuarkIpamANYSharded(QuarkIpamSharded, QuarkIpamANY):
+    @classmethod
+    def get_name(self):
+        return "ANY_SHARDED"
+
+
+class QuarkIpamBOTHSharded(QuarkIpamSharded, QuarkIpamBOTH):
+    @classmethod
+    def get_name(self):
+        return "BOTH_SHARDED"
+
+
+class QuarkIpamBOTHREQSharded(QuarkIpamSharded, QuarkIpamBOTHREQ):
+    @classmethod
+    def get_name(self):
+        return "BOTH_REQUIRED_SHARDED"
+
+
+class QuarkIpamANYEUI64(QuarkIpamEUI64, QuarkIpamANY):
+    @classmethod
+    def get_name(self):
+        return "ANY_EUI64"
+
+
+class QuarkIpamBOTHEUI64(QuarkIpamEUI64, QuarkIpamBOTH):
+    @classmethod
+    def get_name(self):
+        return "BOTH_EUI64"
+
+
+class QuarkIpamBOTHREQEUI64(QuarkIpamEUI64, QuarkIpamBOTHREQ):
+    @classmethod
+    def get_name(self):
+        return "BOTH_REQUIRED_EUI64"
+
 
 class IpamRegistry(object):
     def __init__(self):
         self.strategies = {
             QuarkIpamANY.get_name(): QuarkIpamANY(),
             QuarkIpamBOTH.get_name(): QuarkIpamBOTH(),
-            QuarkIpamBOTHREQ.get_name(): QuarkIpamBOTHREQ()}
+            QuarkIpamBOTHREQ.get_name(): QuarkIpamBOTHREQ(),
+            QuarkIpamANYOptimistic.get_name(): QuarkIpamANYOptimistic(),
+            QuarkIpamBOTHOptimistic.get_name(): QuarkIpamBOTHOptimistic(),
+            QuarkIpamBOTHREQOptimistic.get_name():
+            QuarkIpamBOTHREQOptimistic(),
+            QuarkIpamANYSharded.get_name(): QuarkIpamANYSharded(),
+            QuarkIpamBOTHSharded.get_name(): QuarkIpamBOTHSharded(),
+            QuarkIpamBOTHREQSharded.get_name(): QuarkIpamBOTHREQSharded(),
+            QuarkIpamANYEUI64.get_name(): QuarkIpamANYEUI64(),
+            QuarkIpamBOTHEUI64.get_name(): QuarkIpamBOTHEUI64(),
+            QuarkIpamBOTHREQEUI64.get_name(): QuarkIpamBOTHREQEUI64()}
 
     def is_valid_strategy(self, strategy_name):
         if strategy_name in self.strategies:
@@ -0,0 +1,202 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Delivery of IPAM notifications once the transaction they describe commits.
+
+Events sent while a transaction is open are held on its session and dropped
+if it rolls back. With notification_batching enabled, committed events are
+handed to a bounded queue and a worker thread sends them grouped by event
+type, so a slow notifier no longer sits on request latency.
+"""
+
+import Queue
+import threading
+import time
+
+from neutron import context as neutron_context
+from neutron.openstack.common import log as logging
+from neutron.openstack.common.notifier import api as notifier_api
+from oslo.config import cfg
+from sqlalchemy import event
+from sqlalchemy import orm
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_PENDING_ATTR = "_quark_pending_notifications"
+
+
+def _send(context, event_type, payload):
+    notifier_api.notify(context,
+                        notifier_api.publisher_id("network"),
+                        event_type,
+                        notifier_api.CONF.default_notification_level,
+                        payload)
+
+
+class NotificationQueue(object):
+    """Bounded queue of committed events, drained by a worker thread.
+
+    The worker waits up to batch_interval seconds for batch_size events and
+    sends each event type in the batch as a single notification whose
+    payload holds the individual payloads under "events". When the queue is
+    full, put either drops the event or blocks the caller until there's
+    room, depending on overflow.
+    """
+    def __init__(self, max_size, batch_size, batch_interval,
+                 overflow="drop"):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = Queue.Queue(max_size)
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def put(self, event_type, payload):
+        self._ensure_worker()
+        if self.overflow == "block":
+            self._queue.put((event_type, payload))
+            return
+        try:
+            self._queue.put_nowait((event_type, payload))
+        except Queue.Full:
+            self.dropped += 1
+            LOG.warn("Notification queue full, dropped %s event, %d dropped "
+                     "so far" % (event_type, self.dropped))
+
+    def _ensure_worker(self):
+        # Started lazily so a forking server gets a worker per process
+        if self._worker and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run)
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self.send_batch(self._next_batch())
+
+    def send_batch(self, batch):
+        event_types = []
+        grouped = {}
+        for event_type, payload in batch:
+            if event_type not in grouped:
+                event_types.append(event_type)
+                grouped[event_type] = []
+            grouped[event_type].append(payload)
+
+        context = neutron_context.get_admin_context()
+        for event_type in event_types:
+            try:
+                _send(context, event_type,
+                      dict(events=grouped[event_type]))
+            except Exception:
+                LOG.exception("Failed to send %d %s events" %
+                              (len(grouped[event_type]), event_type))
+
+    def flush(self):
+        """Sends everything queued so far from the calling thread."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        if batch:
+            self.send_batch(batch)
+
+
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_queue():
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is None:
+            _QUEUE = NotificationQueue(CONF.QUARK.notification_queue_size,
+                                       CONF.QUARK.notification_batch_size,
+                                       CONF.QUARK.notification_batch_interval,
+                                       CONF.QUARK.notification_overflow)
+        return _QUEUE
+
+
+def _deliver(events):
+    for context, event_type, payload in events:
+        try:
+            if CONF.QUARK.notification_batching:
+                get_queue().put(event_type, payload)
+            else:
+                _send(context, event_type, payload)
+        except Exception:
+            LOG.exception("Failed to send %s event" % event_type)
+
+
+def notify(context, event_type, payload):
+    """Sends an event once the transaction of context.session commits.
+
+    Sent right away when no transaction is open.
+    """
+    session = context.session
+    if session.transaction is None:
+        _deliver([(context, event_type, payload)])
+        return
+    pending = getattr(session, _PENDING_ATTR, None)
+    if pending is None:
+        pending = []
+        setattr(session, _PENDING_ATTR, pending)
+    pending.append((context, event_type, payload))
+
+
+def _after_commit(session):
+    # Released savepoints fire after_commit too, the events wait for the
+    # root transaction which may still roll back
+    transaction = session.transaction
+    if transaction is not None and (transaction.nested or
+                                    transaction._parent is not None):
+        return
+    pending = getattr(session, _PENDING_ATTR, None)
+    if pending:
+        setattr(session, _PENDING_ATTR, None)
+        _deliver(pending)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # Savepoints and subtransactions rolling back leave the events of the
+    # enclosing transaction alone, it may still commit
+    if previous_transaction._parent is None:
+        setattr(session, _PENDING_ATTR, None)
+
+
+event.listen(orm.Session, "after_commit", _after_commit)
+event.listen(orm.Session, "after_soft_rollback", _after_soft_rollback)
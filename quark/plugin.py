@@ -21,11 +21,14 @@ from oslo.config import cfg
 from neutron.db import api as neutron_db_api
 from neutron.extensions import securitygroup as sg_ext
 from neutron import neutron_plugin_base_v2
+from neutron.openstack.common import excutils
 from neutron.openstack.common import log as logging
 from neutron import quota
+from sqlalchemy import exc as sa_exc
 
 from quark.api import extensions
 from quark.db import models
+from quark.db import replicas
 from quark.plugin_modules import ip_addresses
 from quark.plugin_modules import ip_policies
 from quark.plugin_modules import mac_address_ranges
@@ -70,14 +73,54 @@ CONF.register_opts(quark_quota_opts, "QUOTAS")
 quota.QUOTAS.register_resources(quark_resources)
 
 
+def _read_only(name):
+    return (name.startswith("get_") or name.startswith("diagnose_") or
+            name.endswith("_count"))
+
+
+def _in_transaction(context):
+    session = context._session
+    return session is not None and session.transaction is not None
+
+
+def _close_session(context):
+    context.session.close()
+
+    #NOTE(mdietz): Forces neutron to get a fresh session
+    #              if it needs it after our call
+    context._session = None
+
+
 def sessioned(func):
+    """Hands the call a session of its own, closed afterwards.
+
+    Read-only calls, get_*, *_count and diagnose_*, run on a read replica
+    when some are configured, unless they're called with read_primary=True
+    to read their own writes or a transaction is open. Replica errors fail
+    them over to the primary.
+    """
+    read_only = _read_only(func.__name__)
+
     def _wrapped(self, context, *args, **kwargs):
-        res = func(self, context, *args, **kwargs)
-        context.session.close()
+        read_primary = kwargs.pop("read_primary", False)
+        replica = None
+        if (read_only and not read_primary and
+                CONF.QUARK.replica_connections and
+                not _in_transaction(context)):
+            replica = replicas.get_replicas().session()
+        if replica is not None:
+            if context._session is not None:
+                context._session.close()
+            context._session = replica
+            try:
+                return func(self, context, *args, **kwargs)
+            except sa_exc.DBAPIError:
+                replicas.get_replicas().failed(replica)
+            finally:
+                _close_session(context)
 
-        #NOTE(mdietz): Forces neutron to get a fresh session
-        #              if it needs it after our call
-        context._session = None
+        res = func(self, context, *args, **kwargs)
+        _close_session(context)
         return res
     return _wrapped
 
@@ -89,7 +132,17 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                    "security-group", "diagnostics",
                                    "subnets_quark", "provider",
                                    "ip_policies", "quotas",
-                                   "networks_quark"]
+                                   "networks_quark", "instance_network_info",
+                                   "device_ports"]
+
+    # Makes neutron hand us whole bulk requests. Only ports are created
+    # natively in bulk, networks and subnets go through _create_bulk.
+    __native_bulk_support = True
+
+    # Listings are sorted and paginated in the finders on (created_at, id)
+    # keysets rather than by neutron in memory.
+    __native_pagination_support = True
+    __native_sorting_support = True
 
     def __init__(self):
         LOG.info("Starting quark plugin")
@@ -105,6 +158,26 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         if context.tenant_id is None:
             context.tenant_id = resource["tenant_id"]
 
+    def _create_bulk(self, context, resource, bulk, create, delete):
+        """Creates the items one at a time, deleting them all if one fails.
+
+        This is what neutron does for plugins without native bulk support.
+        """
+        objects = []
+        try:
+            for item in bulk["%ss" % resource]:
+                objects.append(create(context, item))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for obj in objects:
+                    try:
+                        delete(context, obj["id"])
+                    except Exception:
+                        LOG.exception("Unable to delete %s %s after a "
+                                      "failed bulk create" %
+                                      (resource, obj["id"]))
+        return objects
+
     @sessioned
     def get_mac_address_range(self, context, id, fields=None):
         return mac_address_ranges.get_mac_address_range(context, id, fields)
@@ -206,8 +279,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ip_policies.delete_ip_policy(context, id)
 
     @sessioned
-    def get_ip_addresses(self, context, **filters):
-        return ip_addresses.get_ip_addresses(context, **filters)
+    def get_ip_addresses(self, context, limit=None, sorts=None, marker=None,
+                         page_reverse=False, **filters):
+        return ip_addresses.get_ip_addresses(context, limit, sorts, marker,
+                                             page_reverse, **filters)
 
     @sessioned
     def get_ip_address(self, context, id):
@@ -227,6 +302,12 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, port["port"])
         return ports.create_port(context, port)
 
+    @sessioned
+    def create_port_bulk(self, context, port):
+        for item in port["ports"]:
+            self._fix_missing_tenant_id(context, item["port"])
+        return ports.create_port_bulk(context, port)
+
     @sessioned
     def post_update_port(self, context, id, port):
         return ports.post_update_port(context, id, port)
@@ -240,8 +321,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ports.update_port(context, id, port)
 
     @sessioned
-    def get_ports(self, context, filters=None, fields=None):
-        return ports.get_ports(context, filters, fields)
+    def get_ports(self, context, filters=None, fields=None, sorts=None,
+                  limit=None, marker=None, page_reverse=False):
+        return ports.get_ports(context, filters, fields, sorts, limit, marker,
+                               page_reverse)
 
     @sessioned
     def get_ports_count(self, context, filters=None):
@@ -251,6 +334,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_port(self, context, id):
         return ports.delete_port(context, id)
 
+    @sessioned
+    def delete_ports_by_device(self, context, device_ids):
+        return ports.delete_ports_by_device(context, device_ids)
+
     @sessioned
     def disassociate_port(self, context, id, ip_address_id):
         return ports.disassociate_port(context, id, ip_address_id)
@@ -259,6 +346,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def diagnose_port(self, context, id, fields):
         return ports.diagnose_port(context, id, fields)
 
+    @sessioned
+    def get_instance_network_info(self, context, device_ids):
+        return ports.get_instance_network_info(context, device_ids)
+
     @sessioned
     def get_route(self, context, id):
         return routes.get_route(context, id)
@@ -281,6 +372,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, subnet["subnet"])
         return subnets.create_subnet(context, subnet)
 
+    def create_subnet_bulk(self, context, subnet):
+        return self._create_bulk(context, "subnet", subnet,
+                                 self.create_subnet, self.delete_subnet)
+
     @sessioned
     def update_subnet(self, context, id, subnet):
         return subnets.update_subnet(context, id, subnet)
@@ -290,8 +385,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return subnets.get_subnet(context, id, fields)
 
     @sessioned
-    def get_subnets(self, context, filters=None, fields=None):
-        return subnets.get_subnets(context, filters, fields)
+    def get_subnets(self, context, filters=None, fields=None, sorts=None,
+                    limit=None, marker=None, page_reverse=False):
+        return subnets.get_subnets(context, filters, fields, sorts, limit,
+                                   marker, page_reverse)
 
     @sessioned
     def get_subnets_count(self, context, filters=None):
@@ -310,6 +407,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, network["network"])
         return networks.create_network(context, network)
 
+    def create_network_bulk(self, context, network):
+        return self._create_bulk(context, "network", network,
+                                 self.create_network, self.delete_network)
+
     @sessioned
     def update_network(self, context, id, network):
         return networks.update_network(context, id, network)
@@ -319,8 +420,10 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return networks.get_network(context, id, fields)
 
     @sessioned
-    def get_networks(self, context, filters=None, fields=None):
-        return networks.get_networks(context, filters, fields)
+    def get_networks(self, context, filters=None, fields=None, sorts=None,
+                     limit=None, marker=None, page_reverse=False):
+        return networks.get_networks(context, filters, fields, sorts, limit,
+                                     marker, page_reverse)
 
     @sessioned
     def get_networks_count(self, context, filters=None):
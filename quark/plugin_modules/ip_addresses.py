@@ -28,17 +28,25 @@ LOG = logging.getLogger(__name__)
 ipam_driver = (importutils.import_class(CONF.QUARK.ipam_driver))()
 
 
-def get_ip_addresses(context, **filters):
+def get_ip_addresses(context, limit=None, sorts=None, marker=None,
+                     page_reverse=False, **filters):
     LOG.info("get_ip_addresses for tenant %s" % context.tenant_id)
     filters["_deallocated"] = False
-    addrs = db_api.ip_address_find(context, scope=db_api.ALL, **filters)
-    return [v._make_ip_dict(ip) for ip in addrs]
+    filters["reserved"] = False
+    addrs = db_api.ip_address_find(context, limit=limit, sorts=sorts,
+                                   marker=marker, page_reverse=page_reverse,
+                                   scope=db_api.ALL, **filters) or []
+    addrs = [v._make_ip_dict(ip) for ip in addrs]
+    if page_reverse:
+        addrs.reverse()
+    return addrs
 
 
 def get_ip_address(context, id):
     LOG.info("get_ip_address %s for tenant %s" %
             (id, context.tenant_id))
-    addr = db_api.ip_address_find(context, id=id, scope=db_api.ONE)
+    addr = db_api.ip_address_find(context, id=id, reserved=False,
+                                  scope=db_api.ONE)
     if not addr:
         raise quark_exceptions.IpAddressNotFound(addr_id=id)
     return v._make_ip_dict(addr)
@@ -125,6 +133,6 @@ def update_ip_address(context, id, ip_address):
             for port in ports:
                 port['ip_addresses'].extend([address])
         else:
-            address["deallocated"] = 1
+            db_api.ip_address_set_deallocated(context, address, 1)
 
     return v._make_ip_dict(address)
@@ -155,14 +155,16 @@ def get_network(context, id, fields=None):
     LOG.info("get_network %s for tenant %s fields %s" %
             (id, context.tenant_id, fields))
 
-    network = db_api.network_find(context, id=id, scope=db_api.ONE)
+    network = db_api.network_find(context, id=id, fields=fields,
+                                  scope=db_api.ONE)
 
     if not network:
         raise exceptions.NetworkNotFound(net_id=id)
-    return v._make_network_dict(network)
+    return v._make_network_dict(network, fields)
 
 
-def get_networks(context, filters=None, fields=None):
+def get_networks(context, filters=None, fields=None, sorts=None, limit=None,
+                 marker=None, page_reverse=False):
     """Retrieve a list of networks.
 
     The contents of the list depends on the identity of the user
@@ -183,8 +185,12 @@ def get_networks(context, filters=None, fields=None):
     """
     LOG.info("get_networks for tenant %s with filters %s, fields %s" %
             (context.tenant_id, filters, fields))
-    nets = db_api.network_find(context, **filters) or []
-    nets = [v._make_network_dict(net) for net in nets]
+    nets = db_api.network_find(context, fields=fields, sorts=sorts,
+                               limit=limit, marker=marker,
+                               page_reverse=page_reverse, **filters) or []
+    nets = [v._make_network_dict(net, fields) for net in nets]
+    if page_reverse:
+        nets.reverse()
     return nets
 
 
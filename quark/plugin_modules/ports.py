@@ -26,6 +26,7 @@ from quark.drivers import registry
 from quark import exceptions as q_exc
 from quark import ipam
 from quark import network_strategy
+from quark.plugin_modules import routes
 from quark import plugin_views as v
 from quark import utils
 
@@ -65,12 +66,17 @@ def create_port(context, port):
             segment_id = None
             quota.QUOTAS.limit_check(
                 context, context.tenant_id,
-                ports_per_network=len(net.get('ports', [])) + 1)
+                ports_per_network=db_api.network_port_count(
+                    context, net["id"]) + 1)
         else:
             if not segment_id:
                 raise q_exc.AmbiguousNetworkId(net_id=net_id)
 
         ipam_driver = ipam.IPAM_REGISTRY.get_strategy(net["ipam_strategy"])
+        # The MAC comes first, strategies may derive addresses from it
+        mac = ipam_driver.allocate_mac_address(context, net["id"], port_id,
+                                               CONF.QUARK.ipam_reuse_after,
+                                               mac_address=mac_address)
         if fixed_ips:
             for fixed_ip in fixed_ips:
                 subnet_id = fixed_ip.get("subnet_id")
@@ -81,17 +87,15 @@ def create_port(context, port):
                         msg="subnet_id and ip_address required")
                 addresses.extend(ipam_driver.allocate_ip_address(
                     context, net["id"], port_id, CONF.QUARK.ipam_reuse_after,
-                    segment_id=segment_id, ip_address=ip_address))
+                    segment_id=segment_id, ip_address=ip_address,
+                    mac_address=mac["address"]))
         else:
             addresses.extend(ipam_driver.allocate_ip_address(
                 context, net["id"], port_id, CONF.QUARK.ipam_reuse_after,
-                segment_id=segment_id))
+                segment_id=segment_id, mac_address=mac["address"]))
 
         group_ids, security_groups = v.make_security_group_list(
             context, port["port"].pop("security_groups", None))
-        mac = ipam_driver.allocate_mac_address(context, net["id"], port_id,
-                                               CONF.QUARK.ipam_reuse_after,
-                                               mac_address=mac_address)
         mac_address_string = str(netaddr.EUI(mac['address'],
                                              dialect=netaddr.mac_unix))
         address_pairs = [{'mac_address': mac_address_string,
@@ -117,6 +121,150 @@ def create_port(context, port):
     return v._make_port_dict(new_port)
 
 
+def create_port_bulk(context, ports):
+    """Create several ports at once.
+
+    Behaves like create_port called for every port, but the networks and
+    security groups are loaded once, IPs and MACs are allocated in batches
+    per network, the backend gets one create_ports call per network and all
+    ports are inserted in a single flush.
+    : param context: neutron api request context
+    : param ports: dictionary with a "ports" list of port dictionaries, as
+        create_port takes them.
+    """
+    LOG.info("create_port_bulk for tenant %s" % context.tenant_id)
+
+    port_attrs_list = [p["port"] for p in ports["ports"]]
+    reuse_after = CONF.QUARK.ipam_reuse_after
+    new_ports = []
+
+    with context.session.begin():
+        nets = {}
+        requests = []
+        for port_attrs in port_attrs_list:
+            net_id = port_attrs["network_id"]
+            if net_id not in nets:
+                net = db_api.network_find(context, id=net_id,
+                                          scope=db_api.ONE)
+                if not net:
+                    raise exceptions.NetworkNotFound(net_id=net_id)
+                nets[net_id] = net
+            net = nets[net_id]
+
+            segment_id = utils.pop_param(port_attrs, "segment_id")
+            if not STRATEGY.is_parent_network(net_id):
+                # We don't honor segmented networks when they aren't "shared"
+                segment_id = None
+            elif not segment_id:
+                raise q_exc.AmbiguousNetworkId(net_id=net_id)
+
+            fixed_ips = utils.pop_param(port_attrs, "fixed_ips")
+            for fixed_ip in fixed_ips or []:
+                if not (fixed_ip.get("subnet_id") and
+                        fixed_ip.get("ip_address")):
+                    raise exceptions.BadRequest(
+                        resource="fixed_ips",
+                        msg="subnet_id and ip_address required")
+
+            requests.append(dict(
+                net=net, attrs=port_attrs, port_id=uuidutils.generate_uuid(),
+                segment_id=segment_id, fixed_ips=fixed_ips, addresses=[],
+                mac_address=utils.pop_param(port_attrs, "mac_address", None)))
+
+        for net_id, net in nets.items():
+            if STRATEGY.is_parent_network(net_id):
+                continue
+            new_count = len([r for r in requests if r["net"] is net])
+            quota.QUOTAS.limit_check(
+                context, context.tenant_id,
+                ports_per_network=db_api.network_port_count(
+                    context, net["id"]) + new_count)
+
+        # MACs first, strategies may derive addresses from them
+        batches = {}
+        for req in requests:
+            ipam_driver = ipam.IPAM_REGISTRY.get_strategy(
+                req["net"]["ipam_strategy"])
+            if req["mac_address"]:
+                req["mac"] = ipam_driver.allocate_mac_address(
+                    context, req["net"]["id"], req["port_id"], reuse_after,
+                    mac_address=req["mac_address"])
+            else:
+                batches.setdefault(req["net"]["id"],
+                                   (ipam_driver, []))[1].append(req)
+        for net_id, (ipam_driver, batch) in batches.items():
+            macs = ipam_driver.allocate_mac_addresses_bulk(
+                context, net_id, len(batch), reuse_after)
+            for req, mac in zip(batch, macs):
+                req["mac"] = mac
+
+        # IPs, batched per network and segment for ports that didn't ask for
+        # specific addresses
+        batches = {}
+        for req in requests:
+            ipam_driver = ipam.IPAM_REGISTRY.get_strategy(
+                req["net"]["ipam_strategy"])
+            if req["fixed_ips"]:
+                for fixed_ip in req["fixed_ips"]:
+                    req["addresses"].extend(ipam_driver.allocate_ip_address(
+                        context, req["net"]["id"], req["port_id"],
+                        reuse_after, segment_id=req["segment_id"],
+                        ip_address=fixed_ip["ip_address"],
+                        mac_address=req["mac"]["address"]))
+            else:
+                key = (req["net"]["id"], req["segment_id"])
+                batches.setdefault(key, (ipam_driver, []))[1].append(req)
+        for (net_id, segment_id), (ipam_driver, batch) in batches.items():
+            allocated = ipam_driver.allocate_ip_addresses_bulk(
+                context, net_id, len(batch), reuse_after,
+                segment_id=segment_id,
+                port_ids=[req["port_id"] for req in batch],
+                mac_addresses=[req["mac"]["address"] for req in batch])
+            for req, addresses in zip(batch, allocated):
+                req["addresses"].extend(addresses)
+
+        security_groups = v.make_security_group_lists(
+            context, [req["attrs"].pop("security_groups", None)
+                      for req in requests])
+
+        backend_requests = {}
+        for req, (group_ids, groups) in zip(requests, security_groups):
+            req["security_groups"] = groups
+            mac_address_string = str(netaddr.EUI(req["mac"]["address"],
+                                                 dialect=netaddr.mac_unix))
+            address_pairs = [{'mac_address': mac_address_string,
+                              'ip_address': address.get('address_readable',
+                                                        '')}
+                             for address in req["addresses"]]
+            backend_requests.setdefault(req["net"]["id"],
+                                        (req["net"], []))[1].append(
+                (req, dict(port_id=req["port_id"],
+                           security_groups=group_ids,
+                           allowed_pairs=address_pairs)))
+        for net_id, (net, batch) in backend_requests.items():
+            net_driver = registry.DRIVER_REGISTRY.get_driver(
+                net["network_plugin"])
+            backend_ports = net_driver.create_ports(
+                context, net_id, [kwargs for req, kwargs in batch])
+            for (req, kwargs), backend_port in zip(batch, backend_ports):
+                req["backend_port"] = backend_port
+
+        # Port ids are generated up front, so the flush at commit turns
+        # these into executemany INSERTs
+        for req in requests:
+            port_attrs = req["attrs"]
+            port_attrs["network_id"] = req["net"]["id"]
+            port_attrs["id"] = req["port_id"]
+            port_attrs["security_groups"] = req["security_groups"]
+            port_attrs.update(req["backend_port"])
+            new_ports.append(db_api.port_create(
+                context, addresses=req["addresses"],
+                mac_address=req["mac"]["address"],
+                backend_key=req["backend_port"]["uuid"], **port_attrs))
+
+    return [v._make_port_dict(new_port) for new_port in new_ports]
+
+
 def update_port(context, id, port):
     """Update values of a port.
 
@@ -187,7 +335,7 @@ def update_port(context, id, port):
                 addresses.extend(ipam_driver.allocate_ip_address(
                     context, port_db["network_id"], port_db["id"],
                     reuse_after=CONF.QUARK.ipam_reuse_after,
-                    subnets=[subnet_id]))
+                    subnets=[subnet_id], mac_address=port_db["mac_address"]))
 
             # Need to return all existing addresses and the new ones
             if addresses:
@@ -254,7 +402,7 @@ def post_update_port(context, id, port):
                         context, port_db["network_id"], id,
                         CONF.QUARK.ipam_reuse_after)
 
-            address["deallocated"] = 0
+            db_api.ip_address_set_deallocated(context, address, 0)
 
             already_contained = False
             for port_address in port_db["ip_addresses"]:
@@ -285,10 +433,11 @@ def get_port(context, id, fields=None):
     if not results:
         raise exceptions.PortNotFound(port_id=id, net_id='')
 
-    return v._make_port_dict(results)
+    return v._make_port_dict(results, fields)
 
 
-def get_ports(context, filters=None, fields=None):
+def get_ports(context, filters=None, fields=None, sorts=None, limit=None,
+              marker=None, page_reverse=False):
     """Retrieve a list of ports.
 
     The contents of the list depends on the identity of the user
@@ -311,8 +460,13 @@ def get_ports(context, filters=None, fields=None):
             (context.tenant_id, filters, fields))
     if filters is None:
         filters = {}
-    query = db_api.port_find(context, fields=fields, **filters)
-    return v._make_ports_list(query, fields)
+    query = db_api.port_find(context, fields=fields, sorts=sorts,
+                             limit=limit, marker=marker,
+                             page_reverse=page_reverse, **filters)
+    ports = v._make_ports_list(query, fields)
+    if page_reverse:
+        ports.reverse()
+    return ports
 
 
 def get_ports_count(context, filters=None):
@@ -364,6 +518,45 @@ def delete_port(context, id):
         net_driver.delete_port(context, backend_key)
 
 
+def delete_ports_by_device(context, device_ids):
+    """Delete every port of several devices at once.
+
+    Behaves like delete_port called for each of the ports, but IPs and MACs
+    are deallocated with one UPDATE per network and the backend gets one
+    delete_ports call per driver.
+    : param context: neutron api request context
+    : param device_ids: list of device ids, usually instance UUIDs
+    """
+    LOG.info("delete_ports_by_device for tenant %s with device_ids %s" %
+             (context.tenant_id, device_ids))
+    filters = dict(device_id=device_ids)
+    if not context.is_admin:
+        filters["tenant_id"] = context.tenant_id
+
+    with context.session.begin():
+        ports = db_api.port_find(context, scope=db_api.ALL, **filters)
+        per_network = {}
+        for port in ports:
+            per_network.setdefault(port["network_id"], []).append(port)
+
+        backend_keys = {}
+        for net_ports in per_network.values():
+            network = net_ports[0]["network"]
+            ipam_driver = ipam.IPAM_REGISTRY.get_strategy(
+                network["ipam_strategy"])
+            ipam_driver.deallocate_mac_addresses_bulk(
+                context, [netaddr.EUI(port["mac_address"]).value
+                          for port in net_ports])
+            ipam_driver.deallocate_ip_addresses_bulk(context, net_ports)
+            backend_keys.setdefault(network["network_plugin"], []).extend(
+                [port["backend_key"] for port in net_ports])
+
+        db_api.port_delete_bulk(context, ports)
+        for network_plugin, keys in backend_keys.items():
+            net_driver = registry.DRIVER_REGISTRY.get_driver(network_plugin)
+            net_driver.delete_ports(context, keys)
+
+
 def disassociate_port(context, id, ip_address_id):
     """Disassociates a port from an IP address.
 
@@ -387,7 +580,7 @@ def disassociate_port(context, id, ip_address_id):
                                 if address.id != ip_address_id]
 
         if len(the_address["ports"]) == 0:
-            the_address["deallocated"] = 1
+            db_api.ip_address_set_deallocated(context, the_address, 1)
     return v._make_port_dict(port)
 
 
@@ -410,3 +603,22 @@ def diagnose_port(context, id, fields):
         raise exceptions.PortNotFound(port_id=id, net_id='')
     port = _diag_port(context, db_port, fields)
     return {'ports': port}
+
+
+def get_instance_network_info(context, device_ids):
+    """Retrieve the network info of instances in one call.
+
+    : param context: neutron api request context
+    : param device_ids: list of device ids, usually instance UUIDs
+    : returns: one dictionary per device id, in the order given, with the
+        device's ports, including fixed IPs, and the subnets of those IPs,
+        including host routes, DNS nameservers and gateway.
+    """
+    LOG.info("get_instance_network_info for tenant %s with device_ids %s" %
+             (context.tenant_id, device_ids))
+    device_ids = list(device_ids)
+    ports = []
+    if device_ids:
+        ports = db_api.port_find_network_info(context, device_ids)
+    return v._make_instance_network_info(device_ids, ports,
+                                         routes.DEFAULT_ROUTE)
@@ -136,7 +136,8 @@ def create_security_group_rule(context, security_group_rule, net_driver):
 
         quota.QUOTAS.limit_check(
             context, context.tenant_id,
-            security_rules_per_group=len(group.get("rules", [])) + 1)
+            security_rules_per_group=db_api.security_group_rule_count(
+                context, group_id) + 1)
 
         net_driver.create_security_group_rule(context, group_id, rule)
 
@@ -186,7 +187,8 @@ def delete_security_group_rule(context, id, net_driver):
 def get_security_group(context, id, fields=None):
     LOG.info("get_security_group %s for tenant %s" %
             (id, context.tenant_id))
-    group = db_api.security_group_find(context, id=id, scope=db_api.ONE)
+    group = db_api.security_group_find(context, id=id, fields=fields,
+                                       scope=db_api.ONE)
     if not group:
         raise sg_ext.SecurityGroupNotFound(group_id=id)
     return v._make_security_group_dict(group, fields)
@@ -207,8 +209,13 @@ def get_security_groups(context, filters=None, fields=None,
                         page_reverse=False):
     LOG.info("get_security_groups for tenant %s" %
             (context.tenant_id))
-    groups = db_api.security_group_find(context, **filters)
-    return [v._make_security_group_dict(group) for group in groups]
+    groups = db_api.security_group_find(context, fields=fields, sorts=sorts,
+                                        limit=limit, marker=marker,
+                                        page_reverse=page_reverse, **filters)
+    groups = [v._make_security_group_dict(group, fields) for group in groups]
+    if page_reverse:
+        groups.reverse()
+    return groups
 
 
 def get_security_group_rules(context, filters=None, fields=None,
@@ -216,8 +223,14 @@ def get_security_group_rules(context, filters=None, fields=None,
                              page_reverse=False):
     LOG.info("get_security_group_rules for tenant %s" %
             (context.tenant_id))
-    rules = db_api.security_group_rule_find(context, **filters)
-    return [v._make_security_group_rule_dict(rule) for rule in rules]
+    rules = db_api.security_group_rule_find(context, sorts=sorts, limit=limit,
+                                            marker=marker,
+                                            page_reverse=page_reverse,
+                                            **filters)
+    rules = [v._make_security_group_rule_dict(rule) for rule in rules]
+    if page_reverse:
+        rules.reverse()
+    return rules
 
 
 def update_security_group(context, id, security_group, net_driver):
@@ -19,13 +19,13 @@ from neutron.common import config as neutron_cfg
 from neutron.common import exceptions
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
-from neutron.openstack.common.notifier import api as notifier_api
 from neutron.openstack.common import timeutils
 
 from oslo.config import cfg
 
 from quark.db import api as db_api
 from quark import network_strategy
+from quark import notifications
 from quark.plugin_modules import routes
 from quark import plugin_views as v
 from quark import utils
@@ -136,13 +136,10 @@ def create_subnet(context, subnet):
                                       default_route=routes.DEFAULT_ROUTE)
     subnet_dict["gateway_ip"] = gateway_ip
 
-    notifier_api.notify(context,
-                        notifier_api.publisher_id("network"),
-                        "ip_block.create",
-                        notifier_api.CONF.default_notification_level,
-                        dict(tenant_id=subnet_dict["tenant_id"],
-                             ip_block_id=subnet_dict["id"],
-                             created_at=new_subnet["created_at"]))
+    notifications.notify(context, "ip_block.create",
+                         dict(tenant_id=subnet_dict["tenant_id"],
+                              ip_block_id=subnet_dict["id"],
+                              created_at=new_subnet["created_at"]))
 
     return subnet_dict
 
@@ -219,7 +216,8 @@ def get_subnet(context, id, fields=None):
     """
     LOG.info("get_subnet %s for tenant %s with fields %s" %
             (id, context.tenant_id, fields))
-    subnet = db_api.subnet_find(context, id=id, scope=db_api.ONE)
+    subnet = db_api.subnet_find(context, id=id, fields=fields,
+                                scope=db_api.ONE)
     if not subnet:
         raise exceptions.SubnetNotFound(subnet_id=id)
 
@@ -228,10 +226,12 @@ def get_subnet(context, id, fields=None):
     net_id = STRATEGY.get_parent_network(net_id)
     subnet["network_id"] = net_id
 
-    return v._make_subnet_dict(subnet, default_route=routes.DEFAULT_ROUTE)
+    return v._make_subnet_dict(subnet, default_route=routes.DEFAULT_ROUTE,
+                               fields=fields)
 
 
-def get_subnets(context, filters=None, fields=None):
+def get_subnets(context, filters=None, fields=None, sorts=None, limit=None,
+                marker=None, page_reverse=False):
     """Retrieve a list of subnets.
 
     The contents of the list depends on the identity of the user
@@ -252,9 +252,14 @@ def get_subnets(context, filters=None, fields=None):
     """
     LOG.info("get_subnets for tenant %s with filters %s fields %s" %
             (context.tenant_id, filters, fields))
-    subnets = db_api.subnet_find(context, **filters)
-    return v._make_subnets_list(subnets, fields=fields,
-                                default_route=routes.DEFAULT_ROUTE)
+    subnets = db_api.subnet_find(context, fields=fields, sorts=sorts,
+                                 limit=limit, marker=marker,
+                                 page_reverse=page_reverse, **filters)
+    subnets = v._make_subnets_list(subnets, fields=fields,
+                                   default_route=routes.DEFAULT_ROUTE)
+    if page_reverse:
+        subnets.reverse()
+    return subnets
 
 
 def get_subnets_count(context, filters=None):
@@ -304,11 +309,7 @@ def delete_subnet(context, id):
 
         _delete_subnet(context, subnet)
 
-        notifier_api.notify(context,
-                            notifier_api.publisher_id("network"),
-                            "ip_block.delete",
-                            notifier_api.CONF.default_notification_level,
-                            payload)
+        notifications.notify(context, "ip_block.delete", payload)
 
 
 def diagnose_subnet(context, id, fields):
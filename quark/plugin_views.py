@@ -31,90 +31,100 @@ LOG = logging.getLogger(__name__)
 STRATEGY = network_strategy.STRATEGY
 
 
+def _fields(getters, model, fields, *args):
+    """Builds a view from the getters of the requested fields alone.
+
+    Finders given the same fields may not have loaded what the other fields
+    need, so their getters must never run.
+    """
+    keys = fields or getters.keys()
+    return dict((key, getters[key](model, *args))
+                for key in keys if key in getters)
+
+
+_NETWORK_FIELDS = {
+    "id": lambda network: network["id"],
+    "name": lambda network: network.get("name"),
+    "tenant_id": lambda network: network.get("tenant_id"),
+    "admin_state_up": lambda network: None,
+    "ipam_strategy": lambda network: network.get("ipam_strategy"),
+    "status": lambda network: "ACTIVE",
+    "shared": lambda network: STRATEGY.is_parent_network(network["id"]),
+    #TODO(mdietz): this is the expected return. Then the client
+    #              foolishly turns around and asks for the entire
+    #              subnet list anyway! Plz2fix
+    "subnets": lambda network: [s["id"]
+                                for s in network.get("subnets", [])]}
+
+
 def _make_network_dict(network, fields=None):
-    shared_net = STRATEGY.is_parent_network(network["id"])
-    res = {"id": network["id"],
-           "name": network.get("name"),
-           "tenant_id": network.get("tenant_id"),
-           "admin_state_up": None,
-           "ipam_strategy": network.get("ipam_strategy"),
-           "status": "ACTIVE",
-           "shared": shared_net,
-           #TODO(mdietz): this is the expected return. Then the client
-           #              foolishly turns around and asks for the entire
-           #              subnet list anyway! Plz2fix
-           "subnets": [s["id"] for s in network.get("subnets", [])]}
-    return res
+    return _fields(_NETWORK_FIELDS, network, fields)
 
 
-def _pools_from_cidr(cidr):
-    cidrs = cidr.iter_cidrs()
-    if len(cidrs) == 0:
-        return []
-    if len(cidrs) == 1:
-        return [dict(start=str(cidrs[0][0]),
-                     end=str(cidrs[0][-1]))]
-
-    pool_start = cidrs[0][0]
-    prev_cidr_end = cidrs[0][-1]
-    pools = []
-    for cidr in cidrs[1:]:
-        cidr_start = cidr[0]
-        if prev_cidr_end + 1 != cidr_start:
-            pools.append(dict(start=str(pool_start),
-                              end=str(prev_cidr_end)))
-            pool_start = cidr_start
-        prev_cidr_end = cidr[-1]
-    pools.append(dict(start=str(pool_start), end=str(prev_cidr_end)))
-    return pools
+def _subnet_network_id(subnet, default_route):
+    return STRATEGY.get_parent_network(subnet["network_id"])
 
 
-def _make_subnet_dict(subnet, default_route=None, fields=None):
-    dns_nameservers = [str(netaddr.IPAddress(dns["ip"]))
-                       for dns in subnet.get("dns_nameservers")]
-    net_id = STRATEGY.get_parent_network(subnet["network_id"])
-
-    def _allocation_pools(subnet):
-        ip_policy_cidrs = models.IPPolicy.get_ip_policy_cidrs(subnet)
-        cidr = netaddr.IPSet([netaddr.IPNetwork(subnet["cidr"])])
-        allocatable = cidr - ip_policy_cidrs
-        return _pools_from_cidr(allocatable)
-
-    res = {"id": subnet.get("id"),
-           "name": subnet.get("name"),
-           "tenant_id": subnet.get("tenant_id"),
-           "network_id": net_id,
-           "ip_version": subnet.get("ip_version"),
-           "allocation_pools": _allocation_pools(subnet),
-           "dns_nameservers": dns_nameservers or [],
-           "cidr": subnet.get("cidr"),
-           "shared": STRATEGY.is_parent_network(net_id),
-           "enable_dhcp": None}
-
-    def _host_route(route):
-        return {"destination": route["cidr"],
-                "nexthop": route["gateway"]}
-
-    res["host_routes"] = [_host_route(r) for r in subnet["routes"]]
+def _subnet_shared(subnet, default_route):
+    return STRATEGY.is_parent_network(_subnet_network_id(subnet,
+                                                         default_route))
+
+
+def _subnet_dns_nameservers(subnet, default_route):
+    return [str(netaddr.IPAddress(dns["ip"]))
+            for dns in subnet.get("dns_nameservers")]
+
+
+def _subnet_allocation_pools(subnet, default_route):
+    ip_policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+    return [dict(start=str(netaddr.IPAddress(first, ip_policy.version)),
+                 end=str(netaddr.IPAddress(last, ip_policy.version)))
+            for first, last in ip_policy.permitted()]
+
+
+def _subnet_host_routes(subnet, default_route):
+    return [{"destination": route["cidr"], "nexthop": route["gateway"]}
+            for route in subnet["routes"]]
+
 
+def _subnet_gateway_ip(subnet, default_route):
     #TODO(mdietz): really inefficient, should go away
-    res["gateway_ip"] = None
     for route in subnet["routes"]:
         netroute = netaddr.IPNetwork(route["cidr"])
         if netroute.value == default_route.value:
-            res["gateway_ip"] = route["gateway"]
-            break
-    return res
+            return route["gateway"]
+    return None
+
+
+_SUBNET_FIELDS = {
+    "id": lambda subnet, default_route: subnet.get("id"),
+    "name": lambda subnet, default_route: subnet.get("name"),
+    "tenant_id": lambda subnet, default_route: subnet.get("tenant_id"),
+    "network_id": _subnet_network_id,
+    "ip_version": lambda subnet, default_route: subnet.get("ip_version"),
+    "allocation_pools": _subnet_allocation_pools,
+    "dns_nameservers": _subnet_dns_nameservers,
+    "cidr": lambda subnet, default_route: subnet.get("cidr"),
+    "shared": _subnet_shared,
+    "enable_dhcp": lambda subnet, default_route: None,
+    "host_routes": _subnet_host_routes,
+    "gateway_ip": _subnet_gateway_ip}
+
+
+def _make_subnet_dict(subnet, default_route=None, fields=None):
+    return _fields(_SUBNET_FIELDS, subnet, fields, default_route)
+
+
+_SECURITY_GROUP_FIELDS = {
+    "id": lambda group: group.get("id"),
+    "description": lambda group: group.get("description"),
+    "name": lambda group: group.get("name"),
+    "tenant_id": lambda group: group.get("tenant_id"),
+    "security_group_rules": lambda group: [r.id for r in group["rules"]]}
 
 
 def _make_security_group_dict(security_group, fields=None):
-    res = {"id": security_group.get("id"),
-           "description": security_group.get("description"),
-           "name": security_group.get("name"),
-           "tenant_id": security_group.get("tenant_id")}
-    res["security_group_rules"] = [
-        r.id for r in security_group["rules"]]
-    return res
+    return _fields(_SECURITY_GROUP_FIELDS, security_group, fields)
 
 
 def _make_security_group_rule_dict(security_rule, fields=None):
@@ -131,49 +141,84 @@ def _make_security_group_rule_dict(security_rule, fields=None):
     return res
 
 
-def _port_dict(port, fields=None):
-    res = {"id": port.get("id"),
-           "name": port.get("name"),
-           "network_id": STRATEGY.get_parent_network(port["network_id"]),
-           "tenant_id": port.get("tenant_id"),
-           "mac_address": port.get("mac_address"),
-           "admin_state_up": port.get("admin_state_up"),
-           "status": "ACTIVE",
-           "security_groups": [group.get("id", None) for group in
-                               port.get("security_groups", None)],
-           "device_id": port.get("device_id"),
-           "device_owner": port.get("device_owner")}
+def _make_port_address_dict(ip):
+    return {"subnet_id": ip.get("subnet_id"),
+            "ip_address": ip.formatted()}
 
-    if "mac_address" in res and res["mac_address"]:
-        mac = str(netaddr.EUI(res["mac_address"])).replace('-', ':')
-        res["mac_address"] = mac
 
-    #NOTE(mdietz): more pythonic key in dict check fails here. Leave as get
-    if port.get("bridge"):
-        res["bridge"] = port["bridge"]
-    return res
+def _port_network_id(port):
+    return STRATEGY.get_parent_network(port["network_id"])
 
 
-def _make_port_address_dict(ip):
-    return {"subnet_id": ip.get("subnet_id"),
-            "ip_address": ip.formatted()}
+def _port_mac_address(port):
+    mac = port.get("mac_address")
+    if mac:
+        mac = str(netaddr.EUI(mac)).replace('-', ':')
+    return mac
+
+
+_PORT_FIELDS = {
+    "id": lambda port: port.get("id"),
+    "name": lambda port: port.get("name"),
+    "network_id": _port_network_id,
+    "tenant_id": lambda port: port.get("tenant_id"),
+    "mac_address": _port_mac_address,
+    "admin_state_up": lambda port: port.get("admin_state_up"),
+    "status": lambda port: "ACTIVE",
+    "security_groups": lambda port: [group.get("id", None) for group in
+                                     port.get("security_groups", None)],
+    "device_id": lambda port: port.get("device_id"),
+    "device_owner": lambda port: port.get("device_owner"),
+    "bridge": lambda port: port.get("bridge"),
+    "fixed_ips": lambda port: [_make_port_address_dict(ip)
+                               for ip in port.ip_addresses]}
 
 
 def _make_port_dict(port, fields=None):
-    res = _port_dict(port)
-    res["fixed_ips"] = [_make_port_address_dict(ip)
-                        for ip in port.ip_addresses]
+    res = _fields(_PORT_FIELDS, port, fields)
+    #NOTE(mdietz): more pythonic key in dict check fails here. Leave as get
+    if not res.get("bridge"):
+        res.pop("bridge", None)
     return res
 
 
 def _make_ports_list(query, fields=None):
-    ports = []
-    for port in query:
-        port_dict = _port_dict(port, fields)
-        port_dict["fixed_ips"] = [_make_port_address_dict(addr)
-                                  for addr in port.ip_addresses]
-        ports.append(port_dict)
-    return ports
+    return [_make_port_dict(port, fields) for port in query]
+
+
+def _make_network_info_subnet_dict(subnet, default_route):
+    res = {"id": subnet["id"],
+           "network_id": STRATEGY.get_parent_network(subnet["network_id"]),
+           "cidr": subnet["cidr"],
+           "ip_version": subnet["ip_version"],
+           "dns_nameservers": [str(netaddr.IPAddress(dns["ip"]))
+                               for dns in subnet["dns_nameservers"]],
+           "host_routes": [], "gateway_ip": None}
+    for route in subnet["routes"]:
+        res["host_routes"].append({"destination": route["cidr"],
+                                   "nexthop": route["gateway"]})
+        if netaddr.IPNetwork(route["cidr"]).value == default_route.value:
+            res["gateway_ip"] = route["gateway"]
+    return res
+
+
+def _make_instance_network_info(device_ids, ports, default_route):
+    infos = dict((device_id, {"device_id": device_id, "ports": [],
+                              "subnets": []})
+                 for device_id in device_ids)
+    seen_subnets = set()
+    for port in ports:
+        info = infos[port["device_id"]]
+        info["ports"].append(_make_port_dict(port))
+        for ip in port["ip_addresses"]:
+            subnet = ip["subnet"]
+            if not subnet or (port["device_id"], subnet["id"]) in \
+                    seen_subnets:
+                continue
+            seen_subnets.add((port["device_id"], subnet["id"]))
+            info["subnets"].append(_make_network_info_subnet_dict(
+                subnet, default_route))
+    return [infos[device_id] for device_id in device_ids]
 
 
 def _make_subnets_list(query, default_route=None, fields=None):
@@ -220,6 +265,25 @@ def _make_ip_policy_dict(ipp):
             "exclude": ipp["exclude"]}
 
 
+def make_security_group_lists(context, group_id_lists):
+    """Like make_security_group_list for several ports, in a single query."""
+    group_id_lists = [list(set(group_ids))
+                      if group_ids and utils.attr_specified(group_ids)
+                      else [] for group_ids in group_id_lists]
+    all_ids = list(set([gid for group_ids in group_id_lists
+                        for gid in group_ids]))
+    groups = {}
+    if all_ids:
+        found = db_api.security_group_find(context, id=all_ids,
+                                           scope=db_api.ALL) or []
+        groups = dict((group["id"], group) for group in found)
+    for gid in all_ids:
+        if gid not in groups:
+            raise sg_ext.SecurityGroupNotFound(id=gid)
+    return [(group_ids, [groups[gid] for gid in group_ids])
+            for group_ids in group_id_lists]
+
+
 def make_security_group_list(context, group_ids):
     if not group_ids or not utils.attr_specified(group_ids):
         return ([], [])
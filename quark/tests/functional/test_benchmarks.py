@@ -0,0 +1,101 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import netaddr
+from neutron import context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from oslo.config import cfg
+import unittest2
+
+from quark.benchmarks import datacenter
+from quark.benchmarks import ipam_throughput
+from quark.benchmarks import query_cache
+from quark.db import api as db_api
+from quark.db import models
+import quark.ipam
+
+
+class QuarkBenchmarkDatacenter(unittest2.TestCase):
+    def setUp(self):
+        super(QuarkBenchmarkDatacenter, self).setUp()
+        self.context = context.get_admin_context()
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+        self.net_ids = datacenter.seed(
+            self.context, networks=2, v4_subnets=1, v6_subnets=1,
+            v4_prefix=24, policy_excludes=1, mac_ranges=1, allocated=3,
+            history=2, history_age=0)
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+
+    def test_seed_builds_consistent_ipam_state(self):
+        subnets = db_api.subnet_find(self.context, network_id=self.net_ids,
+                                     scope=db_api.ALL)
+        self.assertEqual(sorted([s["cidr"] for s in subnets]),
+                         ["10.0.0.0/24", "10.0.1.0/24", "fd00::/64",
+                          "fd00:0:0:1::/64"])
+        for subnet in subnets:
+            self.assertEqual(subnet["generated_count"], 5)
+            self.assertEqual(subnet["allocated_count"], 3)
+            # Seeded past the four addresses the policy excludes
+            first = netaddr.IPNetwork(subnet["cidr"]).first
+            addresses = db_api.ip_address_find(
+                self.context, subnet_id=subnet["id"], scope=db_api.ALL)
+            self.assertEqual(sorted([int(a["address"]) for a in addresses]),
+                             range(first + 4, first + 9))
+        queued = self.context.session.query(models.IPAddressReuse).count()
+        self.assertEqual(queued, 8)
+
+    def test_allocate_deallocate_cycle(self):
+        counter = ipam_throughput.StatementCounter(neutron_session._ENGINE)
+        measurement = ipam_throughput.Measurement(counter)
+        strategy = quark.ipam.QuarkIpamBOTH()
+        port = measurement.run(ipam_throughput._allocate, self.context,
+                               strategy, self.net_ids[0], 0)
+        self.assertEqual(sorted([a["version"]
+                                 for a in port["ip_addresses"]]), [4, 6])
+        measurement.run(ipam_throughput._deallocate, self.context,
+                        strategy, port)
+        results = measurement.results()
+        self.assertEqual(results["count"], 2)
+        self.assertEqual(results["failures"], 0)
+        self.assertTrue(results["statements"] > 0)
+
+
+class QuarkBenchmarkQueryCache(unittest2.TestCase):
+    def setUp(self):
+        super(QuarkBenchmarkQueryCache, self).setUp()
+        self.context = context.get_admin_context()
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+        self.ids = query_cache.seed(self.context)
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+        db_api._CRITERIA_CACHE.clear()
+
+    def test_lookups_find_the_seeded_rows(self):
+        for name, func, args, kwargs in query_cache.lookups(self.ids):
+            self.assertTrue(func(self.context, *args, **kwargs), name)
+
+    def test_run_times_every_lookup(self):
+        results = query_cache.run(self.context, self.ids, 2)
+        self.assertEqual([r["lookup"] for r in results],
+                         [l[0] for l in query_cache.lookups(self.ids)])
+        self.assertTrue(db_api._CRITERIA_CACHE)
@@ -14,16 +14,25 @@
 # limitations under the License.
 
 import contextlib
+import datetime
+import os
+import threading
 
+import mock
+import netaddr
 from neutron import context
 from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from neutron.openstack.common import timeutils
 from oslo.config import cfg
 import unittest2
 
 from quark.db import api as db_api
 from quark.db import models
 import quark.ipam
+from quark.tests import test_base
+from quark.tools import ipam_warm_pool
 
 
 class QuarkIpamBaseFunctionalTest(unittest2.TestCase):
@@ -62,3 +71,532 @@ class QuarkIPAddressAllocate(QuarkIpamBaseFunctionalTest):
                                                       0, 0)
             self.assertIsNotNone(ipaddress[0]['id'])
             self.assertEqual(ipaddress[0]['address'], 1)
+
+    def _free_spans(self, subnet_id):
+        ranges = db_api.subnet_free_range_find(self.context,
+                                               subnet_id=subnet_id,
+                                               scope=db_api.ALL)
+        return sorted([(int(r["first_ip"]), int(r["last_ip"]))
+                       for r in ranges])
+
+    def test_allocate_claims_from_free_range_index(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            first = self.ipam.allocate_ip_address(self.context, net["id"],
+                                                  0, 0)
+            second = self.ipam.allocate_ip_address(self.context, net["id"],
+                                                   0, 0)
+            self.assertEqual(first[0]["address"], 1)
+            self.assertEqual(second[0]["address"], 2)
+            self.assertEqual(self._free_spans("1"), [(0, 0), (3, 255)])
+
+    def test_rebuild_free_ranges_matches_allocations(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0,
+                                          ip_address="0.0.0.10")
+            expected = self._free_spans("1")
+            sub = db_api.subnet_find(self.context, id="1", scope=db_api.ONE)
+            db_api.subnet_free_ranges_rebuild(self.context, sub)
+            self.assertEqual(self._free_spans("1"), expected)
+            self.assertEqual(expected, [(0, 0), (2, 9), (11, 255)])
+
+    def _counts(self, subnet_id):
+        sub = db_api.subnet_find(self.context, id=subnet_id, scope=db_api.ONE)
+        self.context.session.refresh(sub)
+        return sub["generated_count"], sub["allocated_count"]
+
+    def test_allocate_deallocate_maintains_counters(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            first = self.ipam.allocate_ip_address(self.context, net["id"],
+                                                  0, 0)
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            self.assertEqual(self._counts("1"), (2, 2))
+            self.ipam._deallocate_ip_address(self.context, first[0])
+            self.assertEqual(self._counts("1"), (2, 1))
+
+    def test_rebuild_counters_matches_addresses(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            first = self.ipam.allocate_ip_address(self.context, net["id"],
+                                                  0, 0)
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            self.ipam._deallocate_ip_address(self.context, first[0])
+            sub = db_api.subnet_find(self.context, id="1", scope=db_api.ONE)
+            sub["generated_count"] = sub["allocated_count"] = 0
+            db_api.subnet_ip_counts_rebuild(self.context, sub)
+            self.assertEqual(self._counts("1"), (2, 1))
+
+    def test_uninitialized_counters_are_seeded_with_counts(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            # Subnets that predate the counters have them NULL
+            query = self.context.session.query(models.Subnet)
+            query.update(dict(generated_count=None, allocated_count=None),
+                         synchronize_session=False)
+            counts = db_api.subnet_find_allocation_counts(
+                self.context, net["id"], lock_mode=False).all()
+            self.assertEqual([count for _subnet, count in counts], [2])
+
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            self.assertEqual(self._counts("1"), (3, 3))
+
+    def test_archive_returns_addresses_to_free_ranges(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      ip_policy=None, tenant_id="fake")
+        with self._stubs(network, subnet) as net:
+            first = self.ipam.allocate_ip_address(self.context, net["id"],
+                                                  0, 0)
+            second = self.ipam.allocate_ip_address(self.context, net["id"],
+                                                   0, 0)
+            self.ipam.allocate_ip_address(self.context, net["id"], 0, 0)
+            self.ipam._deallocate_ip_address(self.context, first[0])
+            self.ipam._deallocate_ip_address(self.context, second[0])
+
+            horizon = timeutils.utcnow() + datetime.timedelta(seconds=1)
+            self.assertEqual(
+                db_api.ip_address_archive(self.context, horizon, 1), 1)
+            self.assertEqual(
+                db_api.ip_address_archive(self.context, horizon, 10), 1)
+            self.assertEqual(self._free_spans("1"), [(0, 2), (4, 255)])
+            self.assertEqual(self._counts("1"), (1, 1))
+            archived = db_api.ip_address_archive_find(
+                self.context, subnet_id="1", scope=db_api.ALL)
+            self.assertEqual(sorted(a["address_readable"] for a in archived),
+                             ["0.0.0.1", "0.0.0.2"])
+
+
+class QuarkOptimisticClaims(QuarkIpamBaseFunctionalTest):
+    def setUp(self):
+        super(QuarkOptimisticClaims, self).setUp()
+        with self.context.session.begin():
+            self.net = db_api.network_create(self.context, name="public",
+                                             tenant_id="fake")
+            self.subnet = db_api.subnet_create(
+                self.context, network=self.net, cidr="0.0.0.0/24",
+                ip_version=4, tenant_id="fake")
+
+    def _free_ranges(self):
+        ranges = db_api.subnet_free_range_find(
+            self.context, subnet_id=self.subnet["id"]).populate_existing()
+        return sorted([(r["id"], int(r["first_ip"]), int(r["last_ip"]))
+                       for r in ranges])
+
+    def test_take_splits_range_seen_by_caller(self):
+        [(range_id, first, last)] = self._free_ranges()
+        with self.context.session.begin():
+            self.assertTrue(db_api.subnet_free_range_take(
+                self.context, self.subnet["id"], range_id, first, last, 5))
+        self.assertEqual([r[1:] for r in self._free_ranges()],
+                         [(0, 4), (6, 255)])
+
+    def test_take_from_changed_range_fails(self):
+        [(range_id, first, last)] = self._free_ranges()
+        with self.context.session.begin():
+            db_api.subnet_free_range_take(self.context, self.subnet["id"],
+                                          range_id, first, last, 0)
+            self.assertFalse(db_api.subnet_free_range_take(
+                self.context, self.subnet["id"], range_id, first, last, 1))
+        self.assertEqual([r[1:] for r in self._free_ranges()], [(1, 255)])
+
+    def test_duplicate_address_is_rejected(self):
+        with self.context.session.begin():
+            db_api.ip_address_create(
+                self.context, address=netaddr.IPAddress("0.0.0.1"),
+                subnet_id=self.subnet["id"], network_id=self.net["id"],
+                version=4)
+        with self.assertRaises(db_exc.DBDuplicateEntry):
+            with self.context.session.begin():
+                db_api.ip_address_create(
+                    self.context, address=netaddr.IPAddress("0.0.0.1"),
+                    subnet_id=self.subnet["id"], network_id=self.net["id"],
+                    version=4)
+
+
+    def test_claims_record_deltas_instead_of_updating_subnet(self):
+        strategy = quark.ipam.QuarkIpamANYOptimistic()
+        with test_base.QueryCounter(neutron_session._ENGINE) as queries:
+            with self.context.session.begin():
+                for i in xrange(2):
+                    strategy.allocate_ip_address(self.context,
+                                                 self.net["id"], 0, 0)
+        self.assertFalse([s for s in queries.statements
+                          if s.startswith("UPDATE quark_subnets")])
+        counts = db_api.subnet_find_allocation_counts(
+            self.context, self.net["id"], lock_mode=False).all()
+        self.assertEqual([count for _subnet, count in counts], [2])
+
+        with self.context.session.begin():
+            self.assertEqual(db_api.subnet_ip_count_deltas_fold(
+                self.context, self.subnet["id"]), 2)
+        self.context.session.refresh(self.subnet)
+        self.assertEqual((self.subnet["generated_count"],
+                          self.subnet["allocated_count"]), (2, 2))
+        self.assertEqual(db_api.subnet_ip_count_deltas_subnet_ids(
+            self.context), [])
+
+
+# Set to a MySQL URL to run the tests that need real row locks
+DATABASE_URL = os.environ.get("QUARK_FUNCTIONAL_DATABASE_URL")
+
+
+@unittest2.skipUnless(DATABASE_URL, "sqlite locks the whole database, two "
+                      "writers can't be open at the same time")
+class QuarkOptimisticContention(unittest2.TestCase):
+    def setUp(self):
+        super(QuarkOptimisticContention, self).setUp()
+        cfg.CONF.set_override("connection", DATABASE_URL, "database")
+        neutron_db_api.configure_db()
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+        cfg.CONF.set_override("ipam_cursor_shards", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "ipam_cursor_shards",
+                        "QUARK")
+        self.context = context.Context("fake", "fake", is_admin=False)
+        with self.context.session.begin():
+            self.net = db_api.network_create(self.context, name="public",
+                                             tenant_id="fake")
+            self.subnet = db_api.subnet_create(
+                self.context, network=self.net, cidr="0.0.0.0/24",
+                ip_version=4, tenant_id="fake")
+        # One free range per shard, as a busy subnet soon has
+        [free_range] = db_api.subnet_free_range_find(
+            self.context, subnet_id=self.subnet["id"], scope=db_api.ALL)
+        with self.context.session.begin():
+            db_api.subnet_free_range_take(self.context, self.subnet["id"],
+                                          free_range["id"], 0, 255, 128)
+
+    def tearDown(self):
+        models.BASEV2.metadata.drop_all(neutron_session._ENGINE)
+        neutron_db_api.clear_db()
+
+    def _allocate(self, strategy, allocated):
+        other = context.Context("fake", "fake", is_admin=False)
+        with other.session.begin():
+            allocated.extend(strategy.allocate_ip_address(
+                other, self.net["id"], 0, 0))
+
+    def test_claims_in_other_shards_do_not_wait(self):
+        strategy = quark.ipam.QuarkIpamANYSharded()
+        first, second = [], []
+        worker = threading.Thread(target=self._allocate,
+                                  args=(strategy, second))
+        with mock.patch("quark.ipam.random.randrange", side_effect=[0, 1]):
+            transaction = self.context.session.begin()
+            try:
+                first.extend(strategy.allocate_ip_address(
+                    self.context, self.net["id"], 0, 0))
+                # The first claim is still uncommitted while this one runs
+                worker.start()
+                worker.join(10)
+                waited = worker.is_alive()
+            finally:
+                transaction.commit()
+            worker.join()
+        self.assertFalse(waited)
+        self.assertEqual([a["address_readable"] for a in first + second],
+                         ["0.0.0.1", "0.0.0.129"])
+        counts = db_api.subnet_find_allocation_counts(
+            self.context, self.net["id"], lock_mode=False).all()
+        self.assertEqual([count for _subnet, count in counts], [2])
+
+
+class QuarkReusableAddresses(QuarkIpamBaseFunctionalTest):
+    def setUp(self):
+        super(QuarkReusableAddresses, self).setUp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _network(self):
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake")
+            subnet4 = db_api.subnet_create(
+                self.context, network=net, cidr="0.0.0.0/24", ip_version=4,
+                tenant_id="fake")
+            subnet6 = db_api.subnet_create(
+                self.context, network=net, cidr="feed::/64", ip_version=6,
+                tenant_id="fake")
+        return net, subnet4, subnet6
+
+    def _create_addresses(self, net, subnet, addresses, deallocated=True):
+        created = []
+        with self.context.session.begin():
+            for address in addresses:
+                address = netaddr.IPAddress(address)
+                ip = db_api.ip_address_create(
+                    self.context, address=address, subnet_id=subnet["id"],
+                    network_id=net["id"], version=address.version)
+                timeutils.advance_time_seconds(1)
+                db_api.ip_address_update(self.context, ip,
+                                         deallocated=deallocated)
+                created.append(ip)
+        return created
+
+    def _queued(self):
+        queue = self.context.session.query(models.IPAddressReuse)
+        return sorted(entry["address_id"] for entry in queue)
+
+    def test_finds_first_queued_address_of_each_version(self):
+        net, subnet4, subnet6 = self._network()
+        self._create_addresses(net, subnet4, ["0.0.0.7", "0.0.0.5"])
+        self._create_addresses(net, subnet4, ["0.0.0.3"], deallocated=False)
+        self._create_addresses(net, subnet6, ["feed::9", "feed::8"])
+
+        addresses = db_api.ip_address_find_reusable(
+            self.context, network_id=net["id"], version=[4, 6],
+            scope=db_api.ALL)
+        self.assertEqual([a["address_readable"] for a in addresses],
+                         ["0.0.0.7", "feed::9"])
+
+        addresses = db_api.ip_address_find_reusable(
+            self.context, network_id=net["id"], version=[6],
+            scope=db_api.ALL)
+        self.assertEqual([a["address_readable"] for a in addresses],
+                         ["feed::9"])
+
+    def test_reuse_find_honors_reuse_after(self):
+        net, subnet4, subnet6 = self._network()
+        self._create_addresses(net, subnet4, ["0.0.0.7", "0.0.0.5"])
+        address = db_api.ip_address_reuse_find(
+            self.context, network_id=net["id"], reuse_after=1,
+            scope=db_api.ONE)
+        self.assertEqual(address["address_readable"], "0.0.0.7")
+
+        address = db_api.ip_address_reuse_find(
+            self.context, network_id=net["id"], reuse_after=2,
+            scope=db_api.ONE)
+        self.assertIsNone(address)
+
+    def test_reallocation_leaves_the_queue(self):
+        net, subnet4, subnet6 = self._network()
+        old, new = self._create_addresses(net, subnet4,
+                                          ["0.0.0.7", "0.0.0.5"])
+        self.assertEqual(self._queued(), sorted([old["id"], new["id"]]))
+
+        ipam = quark.ipam.QuarkIpamANY()
+        with self.context.session.begin():
+            reallocated = ipam.attempt_to_reallocate_ip(
+                self.context, net["id"], None, 0)
+        self.assertEqual(reallocated, [old])
+        self.assertFalse(old["deallocated"])
+        self.assertEqual(self._queued(), [new["id"]])
+
+    def test_rebuild_queues_legacy_addresses(self):
+        net, subnet4, subnet6 = self._network()
+        ip, = self._create_addresses(net, subnet4, ["0.0.0.7"],
+                                     deallocated=False)
+        with self.context.session.begin():
+            # Deallocated before the queue existed, bypasses the setter
+            ip["_deallocated"] = 1
+            ip["deallocated_at"] = timeutils.utcnow()
+        self.assertEqual(self._queued(), [])
+
+        with self.context.session.begin():
+            db_api.ip_address_reuse_queue_rebuild(self.context, subnet4)
+            db_api.ip_address_reuse_queue_rebuild(self.context, subnet4)
+        self.assertEqual(self._queued(), [ip["id"]])
+
+
+class QuarkWarmPools(QuarkIpamBaseFunctionalTest):
+    def setUp(self):
+        super(QuarkWarmPools, self).setUp()
+        with self.context.session.begin():
+            self.net = db_api.network_create(self.context, name="public",
+                                             tenant_id="fake",
+                                             ipam_strategy="ANY")
+            self.subnet = db_api.subnet_create(
+                self.context, network=self.net, cidr="0.0.0.0/24",
+                ip_version=4, tenant_id="fake")
+        cfg.CONF.set_override("ipam_warm_pool_sizes",
+                              {self.net["id"]: "2"}, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "ipam_warm_pool_sizes",
+                        "QUARK")
+        self.filler = ipam_warm_pool.PoolFiller(
+            self.context, ipam_warm_pool.pool_sizes())
+        self.ipam = quark.ipam.QuarkIpamANY()
+
+    def _pool(self):
+        return db_api.ip_address_pool_counts(self.context, self.net["id"])
+
+    def _allocated_count(self):
+        subnet = db_api.subnet_find(self.context, id=self.subnet["id"],
+                                    scope=db_api.ONE)
+        self.context.session.refresh(subnet)
+        return subnet["allocated_count"]
+
+    def _allocate(self):
+        with self.context.session.begin():
+            return self.ipam.allocate_ip_address(self.context,
+                                                 self.net["id"], None, 0)
+
+    def test_filler_tops_up_to_pool_size(self):
+        self.assertEqual(self.filler.fill(), 2)
+        self.assertEqual(self.filler.fill(), 0)
+        self.assertEqual(self._pool(), {self.subnet["id"]: 2})
+        self.assertEqual(self.filler.short_since, {})
+
+    def test_allocation_claims_reserved_address(self):
+        self.filler.fill()
+        reserved = db_api.ip_address_pool_find(
+            self.context, network_id=self.net["id"], scope=db_api.ALL)
+        allocated_count = self._allocated_count()
+        hits = quark.ipam.WARM_POOL_STATS.hits
+
+        address, = self._allocate()
+        self.assertIn(address["id"], [a["id"] for a in reserved])
+        self.assertIsNone(address["reserved_at"])
+        self.assertEqual(address["tenant_id"], "fake")
+        self.assertEqual(self._pool(), {self.subnet["id"]: 1})
+        self.assertEqual(self._allocated_count(), allocated_count)
+        self.assertEqual(quark.ipam.WARM_POOL_STATS.hits, hits + 1)
+
+    def test_allocation_falls_back_when_pool_is_empty(self):
+        misses = quark.ipam.WARM_POOL_STATS.misses
+        address, = self._allocate()
+        self.assertEqual(address["address_readable"], "0.0.0.1")
+        self.assertEqual(quark.ipam.WARM_POOL_STATS.misses, misses + 1)
+
+    def test_reserved_addresses_left_out_of_listings(self):
+        self.filler.fill()
+        address, = self._allocate()
+        listed = db_api.ip_address_find(
+            self.context.elevated(), network_id=self.net["id"],
+            _deallocated=False, reserved=False, scope=db_api.ALL)
+        self.assertEqual([a["id"] for a in listed], [address["id"]])
+
+    def test_reclaim_releases_reservations_beyond_pool_size(self):
+        self.filler.fill()
+        allocated_count = self._allocated_count()
+        self.assertEqual(
+            ipam_warm_pool.reclaim(self.context, {self.net["id"]: 1}), 1)
+        self.assertEqual(self._pool(), {self.subnet["id"]: 1})
+        self.assertEqual(self._allocated_count(), allocated_count - 1)
+        queued = self.context.session.query(models.IPAddressReuse).all()
+        self.assertEqual(len(queued), 1)
+
+        self.assertEqual(ipam_warm_pool.reclaim(self.context, {}), 1)
+        self.assertEqual(self._pool(), {})
+
+
+class QuarkAddressRanges(QuarkIpamBaseFunctionalTest):
+    def setUp(self):
+        super(QuarkAddressRanges, self).setUp()
+        with self.context.session.begin():
+            self.net = db_api.network_create(self.context, name="public")
+            self.v4 = db_api.subnet_create(self.context, network=self.net,
+                                           cidr="10.0.0.0/24", ip_version=4)
+            self.v6 = db_api.subnet_create(self.context, network=self.net,
+                                           cidr="fd00::/64", ip_version=6)
+            for address in ["10.0.0.100", "10.0.0.9", "10.0.0.10"]:
+                db_api.ip_address_create(
+                    self.context, address=netaddr.IPAddress(address),
+                    subnet_id=self.v4["id"], network_id=self.net["id"],
+                    version=4)
+
+    def _containing(self, address):
+        subnets = db_api.subnet_find_allocation_counts(
+            self.context, self.net["id"], lock_mode=False,
+            containing=address).all()
+        return [s["id"] for s, count in subnets]
+
+    def test_subnet_containing(self):
+        self.assertEqual(self._containing("10.0.0.77"), [self.v4["id"]])
+        self.assertEqual(self._containing("fd00::5"), [self.v6["id"]])
+        self.assertEqual(self._containing("10.0.1.1"), [])
+
+    def test_free_range_containing(self):
+        ranges = db_api.subnet_free_range_find(
+            self.context, subnet_id=self.v4["id"],
+            containing=int(netaddr.IPAddress("10.0.0.200")),
+            scope=db_api.ALL)
+        self.assertEqual(len(ranges), 1)
+
+
+class QuarkMacAddressAllocate(QuarkIpamBaseFunctionalTest):
+    @contextlib.contextmanager
+    def _stubs(self):
+        self.ipam = quark.ipam.QuarkIpamANY()
+        with self.context.session.begin():
+            rng = db_api.mac_address_range_create(
+                self.context, cidr="AA:BB:CC/40", first_address=0,
+                last_address=256, next_auto_assign_mac=0)
+        yield rng
+
+    def _free_blocks(self, range_id):
+        blocks = db_api.mac_address_free_block_find(
+            self.context, mac_address_range_id=range_id, scope=db_api.ALL)
+        return [(b["first_address"], b["last_address"]) for b in blocks]
+
+    def test_allocate_claims_from_free_blocks_and_counts(self):
+        with self._stubs() as rng:
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0,
+                                           mac_address=10)
+            self.assertEqual(self._free_blocks(rng["id"]),
+                             [(1, 9), (11, 255)])
+            self.context.session.refresh(rng)
+            self.assertEqual(rng["generated_count"], 2)
+            self.assertEqual(rng["allocated_count"], 2)
+
+    def test_rebuild_matches_allocations(self):
+        with self._stubs() as rng:
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            mac = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.ipam.deallocate_mac_address(self.context, mac["address"])
+            expected = self._free_blocks(rng["id"])
+            db_api.mac_address_range_rebuild(self.context, rng)
+            self.assertEqual(self._free_blocks(rng["id"]), expected)
+            self.assertEqual(expected, [(2, 255)])
+            self.assertEqual(rng["generated_count"], 2)
+            self.assertEqual(rng["allocated_count"], 1)
+
+    def test_uninitialized_counters_are_seeded_with_counts(self):
+        with self._stubs() as rng:
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            # Ranges that predate the counters have them NULL
+            query = self.context.session.query(models.MacAddressRange)
+            query.update(dict(generated_count=None, allocated_count=None),
+                         synchronize_session=False)
+            counts = db_api.mac_address_range_find_allocation_counts(
+                self.context).all()
+            self.assertEqual([count for mar, count in counts], [2])
+
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.context.session.refresh(rng)
+            self.assertEqual(rng["generated_count"], 3)
+            self.assertEqual(rng["allocated_count"], 3)
+
+    def test_archive_returns_macs_to_free_blocks(self):
+        with self._stubs() as rng:
+            mac = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.ipam.deallocate_mac_address(self.context, mac["address"])
+
+            horizon = timeutils.utcnow() + datetime.timedelta(seconds=1)
+            self.assertEqual(
+                db_api.mac_address_archive(self.context, horizon, 10), 1)
+            self.assertEqual(self._free_blocks(rng["id"]),
+                             [(0, 0), (2, 255)])
+            self.context.session.refresh(rng)
+            self.assertEqual(rng["generated_count"], 1)
+            self.assertEqual(rng["allocated_count"], 1)
+            archived = db_api.mac_address_archive_find(
+                self.context, mac_address_range_id=rng["id"],
+                scope=db_api.ALL)
+            self.assertEqual([m["address"] for m in archived], [0])
@@ -0,0 +1,171 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for# the specific language governing permissions and limitations
+#  under the License.
+
+import netaddr
+from neutron import context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from oslo.config import cfg
+import unittest2
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.plugin_modules import ip_addresses
+from quark.plugin_modules import networks
+from quark.plugin_modules import ports
+from quark.plugin_modules import security_groups
+from quark.plugin_modules import subnets
+from quark.tests import test_base
+
+
+class QuarkListQueryCounts(unittest2.TestCase):
+    """Listing N rows must cost the same number of queries as listing one."""
+    def setUp(self):
+        self.context = context.Context('fake', 'fake', is_admin=False)
+        super(QuarkListQueryCounts, self).setUp()
+
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+        self.addresses = netaddr.IPNetwork("10.0.0.0/16").iter_hosts()
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+
+    def _create_network(self):
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+            subnet = db_api.subnet_create(self.context, network=net,
+                                          cidr="10.0.0.0/16")
+            group = db_api.security_group_create(self.context, name="sg")
+            db_api.security_group_rule_create(
+                self.context, security_group_id=group["id"], tenant_id="fake",
+                ethertype="IPv4", direction="ingress")
+        return net, subnet, group
+
+    def _create_ports(self, net, subnet, group, count):
+        with self.context.session.begin():
+            for i in xrange(count):
+                ip = db_api.ip_address_create(
+                    self.context, address=next(self.addresses),
+                    subnet_id=subnet["id"], network_id=net["id"], version=4)
+                port = db_api.port_create(self.context, network_id=net["id"],
+                                          backend_key="1", device_id="dev",
+                                          addresses=[ip])
+                port["security_groups"].append(group)
+
+    def _create_subnets(self, net, count):
+        with self.context.session.begin():
+            for i in xrange(count):
+                subnet = db_api.subnet_create(self.context, network=net,
+                                              cidr="192.168.%d.0/24" % i)
+                subnet["routes"].append(db_api.route_create(
+                    self.context, cidr="0.0.0.0/0",
+                    gateway="192.168.%d.1" % i))
+                subnet["dns_nameservers"].append(db_api.dns_create(
+                    self.context, ip=netaddr.IPAddress("8.8.8.8")))
+
+    def _count_list_queries(self, list_fn, *args, **kwargs):
+        self.context.session.expunge_all()
+        with test_base.QueryCounter(neutron_session._ENGINE) as queries:
+            results = list_fn(self.context, *args, **kwargs)
+        return queries.count, len(results)
+
+    def test_get_ports(self):
+        net, subnet, group = self._create_network()
+        self._create_ports(net, subnet, group, 1)
+        single, rows = self._count_list_queries(ports.get_ports, filters={})
+        self.assertEqual(rows, 1)
+
+        self._create_ports(net, subnet, group, 999)
+        many, rows = self._count_list_queries(ports.get_ports, filters={})
+        self.assertEqual(rows, 1000)
+        self.assertEqual(many, single)
+
+    def test_get_ip_addresses(self):
+        net, subnet, group = self._create_network()
+        self._create_ports(net, subnet, group, 1)
+        single, rows = self._count_list_queries(
+            ip_addresses.get_ip_addresses)
+        self.assertEqual(rows, 1)
+
+        self._create_ports(net, subnet, group, 99)
+        many, rows = self._count_list_queries(
+            ip_addresses.get_ip_addresses)
+        self.assertEqual(rows, 100)
+        self.assertEqual(many, single)
+
+    def test_get_networks(self):
+        self._create_network()
+        single, rows = self._count_list_queries(networks.get_networks,
+                                                filters={})
+        self.assertEqual(rows, 1)
+
+        for i in xrange(49):
+            self._create_network()
+        many, rows = self._count_list_queries(networks.get_networks,
+                                              filters={})
+        self.assertEqual(rows, 50)
+        self.assertEqual(many, single)
+
+    def test_get_subnets(self):
+        net, subnet, group = self._create_network()
+        single, rows = self._count_list_queries(subnets.get_subnets,
+                                                filters={})
+        self.assertEqual(rows, 1)
+
+        self._create_subnets(net, 49)
+        many, rows = self._count_list_queries(subnets.get_subnets,
+                                              filters={})
+        self.assertEqual(rows, 50)
+        self.assertEqual(many, single)
+
+    def test_get_security_groups(self):
+        self._create_network()
+        single, rows = self._count_list_queries(
+            security_groups.get_security_groups, filters={})
+        self.assertEqual(rows, 1)
+
+        for i in xrange(49):
+            self._create_network()
+        many, rows = self._count_list_queries(
+            security_groups.get_security_groups, filters={})
+        self.assertEqual(rows, 50)
+        self.assertEqual(many, single)
+
+    def test_get_ports_with_fields(self):
+        net, subnet, group = self._create_network()
+        self._create_ports(net, subnet, group, 10)
+        count, rows = self._count_list_queries(
+            ports.get_ports, filters={}, fields=["id", "device_id"])
+        self.assertEqual(rows, 10)
+        # Neither fixed_ips nor security_groups were asked for, so only the
+        # ports themselves are queried
+        self.assertEqual(count, 1)
+
+        port = ports.get_ports(self.context, filters={},
+                               fields=["id", "device_id"])[0]
+        self.assertEqual(sorted(port.keys()), ["device_id", "id"])
+
+    def test_port_find_defers_unrequested_columns(self):
+        net, subnet, group = self._create_network()
+        self._create_ports(net, subnet, group, 1)
+        self.context.session.expunge_all()
+        port = db_api.port_find(self.context, fields=["device_id"],
+                                scope=db_api.ONE)
+        self.assertIn("device_id", port.__dict__)
+        self.assertNotIn("name", port.__dict__)
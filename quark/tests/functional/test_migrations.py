@@ -0,0 +1,126 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from alembic import command
+from alembic import config
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+import unittest2
+
+from quark.db import models
+# Registers the driver's tables with models.BASEV2.metadata
+from quark.drivers import optimized_nvp_driver  # noqa
+
+ALEMBIC_DIR = os.path.join(os.path.dirname(models.__file__), "alembic")
+
+
+class QuarkMigrations(unittest2.TestCase):
+    def setUp(self):
+        super(QuarkMigrations, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        url = "sqlite:///%s" % os.path.join(self.tmpdir, "quark.db")
+        self.config = config.Config()
+        self.config.set_main_option("script_location", ALEMBIC_DIR)
+        self.config.set_main_option("sqlalchemy.url", url)
+        self.engine = sa.create_engine(url)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def _indexes(self, inspector, table):
+        # Unique constraints come back as indexes, checked on their own
+        return sorted([index["name"]
+                       for index in inspector.get_indexes(table)
+                       if not index["unique"]])
+
+    def test_upgrade_matches_models(self):
+        command.upgrade(self.config, "head")
+        inspector = reflection.Inspector.from_engine(self.engine)
+        tables = models.BASEV2.metadata.tables
+        self.assertEqual(sorted(inspector.get_table_names()),
+                         sorted(tables.keys() + ["alembic_version"]))
+        for name, table in tables.items():
+            columns = [c["name"] for c in inspector.get_columns(name)]
+            self.assertEqual(sorted(columns), sorted(table.columns.keys()),
+                             name)
+            self.assertEqual(self._indexes(inspector, name),
+                             sorted([index.name for index in table.indexes]),
+                             name)
+
+    def test_hot_path_indexes(self):
+        command.upgrade(self.config, "head")
+        inspector = reflection.Inspector.from_engine(self.engine)
+        columns = dict([(index["name"], index["column_names"])
+                        for index in
+                        inspector.get_indexes("quark_ip_addresses")])
+        self.assertEqual(columns["idx_quark_ip_addresses_reallocate"],
+                         ["network_id", "_deallocated", "deallocated_at",
+                          "version"])
+        self.assertEqual(columns["idx_quark_ip_addresses_network_address"],
+                         ["network_id", "address"])
+
+    def test_unique_addresses_per_network(self):
+        command.upgrade(self.config, "head")
+        inspector = reflection.Inspector.from_engine(self.engine)
+        unique = [index["column_names"]
+                  for index in inspector.get_indexes("quark_ip_addresses")
+                  if index["unique"]]
+        self.assertEqual(unique, [["network_id", "address_readable"]])
+
+    def test_upgrade_from_create_all_baseline(self):
+        # Deployments built by create_all are stamped at the first revision
+        command.upgrade(self.config, "1284c81cf727")
+        inspector = reflection.Inspector.from_engine(self.engine)
+        self.assertNotIn("quark_subnet_free_ranges",
+                         inspector.get_table_names())
+        self.assertNotIn("generated_count",
+                         [c["name"] for c in
+                          inspector.get_columns("quark_subnets")])
+        self.engine.execute(
+            "INSERT INTO quark_subnets (id, _cidr, first_ip, last_ip) "
+            "VALUES ('s', '0.0.0.0/24', '281470681743360', "
+            "'281470681743615')")
+
+        command.upgrade(self.config, "head")
+        row = self.engine.execute(
+            "SELECT first_ip, generated_count, free_ranges_indexed "
+            "FROM quark_subnets").first()
+        self.assertEqual(tuple(row), ("%039d" % 281470681743360, None, None))
+
+    def test_downgrade_to_base(self):
+        command.upgrade(self.config, "head")
+        command.downgrade(self.config, "base")
+        inspector = reflection.Inspector.from_engine(self.engine)
+        self.assertEqual(inspector.get_table_names(), ["alembic_version"])
+
+    def test_inet_rewritten_fixed_width(self):
+        command.upgrade(self.config, "3a47813ce501")
+        self.engine.execute(
+            "INSERT INTO quark_subnet_free_ranges (id, subnet_id, first_ip, "
+            "last_ip) VALUES ('1', 's', '9', '281470681743615')")
+        command.upgrade(self.config, "head")
+        row = self.engine.execute(
+            "SELECT first_ip, last_ip FROM quark_subnet_free_ranges").first()
+        self.assertEqual(tuple(row), ("%039d" % 9, "%039d" % 281470681743615))
+
+        command.downgrade(self.config, "3a47813ce501")
+        row = self.engine.execute(
+            "SELECT first_ip, last_ip FROM quark_subnet_free_ranges").first()
+        self.assertEqual(tuple(row), ("9", "281470681743615"))
@@ -0,0 +1,109 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for# the specific language governing permissions and limitations
+#  under the License.
+
+import datetime
+
+from neutron.common import exceptions
+from neutron import context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db.sqlalchemy import session as neutron_session
+from oslo.config import cfg
+import unittest2
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.plugin_modules import ports
+from quark.plugin_modules import security_groups
+
+
+class QuarkPaginationFunctionalTest(unittest2.TestCase):
+    def setUp(self):
+        self.context = context.Context('fake', 'fake', is_admin=False)
+        super(QuarkPaginationFunctionalTest, self).setUp()
+
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        models.BASEV2.metadata.create_all(neutron_session._ENGINE)
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+
+    def _create_ports(self, count):
+        start = datetime.datetime(2014, 1, 1)
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+            port_ids = []
+            for i in xrange(count):
+                # Pairs of ports share a timestamp, id breaks the tie
+                port = db_api.port_create(
+                    self.context, network_id=net["id"], backend_key="1",
+                    device_id="dev%d" % i,
+                    created_at=start + datetime.timedelta(seconds=i // 2))
+                port_ids.append(port["id"])
+        return [port_id for offset, port_id in sorted(
+            [(i // 2, port_id) for i, port_id in enumerate(port_ids)])]
+
+    def _pages(self, list_fn, limit, page_reverse=False, **kwargs):
+        marker = None
+        pages = []
+        while True:
+            page = list_fn(self.context, filters={}, limit=limit,
+                           marker=marker, page_reverse=page_reverse,
+                           **kwargs)
+            if not page:
+                return pages
+            pages.append([item["id"] for item in page])
+            marker = page[-1]["id"] if not page_reverse else page[0]["id"]
+
+    def test_ports_keyset_pages(self):
+        port_ids = self._create_ports(7)
+        pages = self._pages(ports.get_ports, 3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), port_ids)
+
+    def test_ports_keyset_pages_reversed(self):
+        port_ids = self._create_ports(7)
+        pages = self._pages(ports.get_ports, 3, page_reverse=True,
+                            sorts=[("created_at", False), ("id", False)])
+        # Reversed pages walk the descending order backwards, each page
+        # still reads in descending order
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(reversed(pages), []),
+                         list(reversed(port_ids)))
+
+    def test_ports_sorted_by_requested_key(self):
+        self._create_ports(4)
+        page = ports.get_ports(self.context, filters={},
+                               sorts=[("device_id", False)], limit=2)
+        self.assertEqual([port["device_id"] for port in page],
+                         ["dev3", "dev2"])
+
+    def test_unknown_marker_fails(self):
+        self._create_ports(2)
+        with self.assertRaises(exceptions.BadRequest):
+            ports.get_ports(self.context, filters={}, limit=1,
+                            marker="not-a-port")
+
+    def test_security_groups_keyset_pages(self):
+        with self.context.session.begin():
+            group_ids = [db_api.security_group_create(
+                self.context, name="sg%d" % i, description="")["id"]
+                for i in xrange(5)]
+        pages = self._pages(security_groups.get_security_groups, 2,
+                            sorts=[("name", True)])
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), group_ids)
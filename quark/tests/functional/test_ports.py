@@ -13,6 +13,7 @@
 # License for# the specific language governing permissions and limitations
 #  under the License.
 
+import netaddr
 from neutron import context
 from neutron.db import api as neutron_db_api
 from neutron.openstack.common.db.sqlalchemy import session as neutron_session
@@ -21,6 +22,9 @@ import unittest2
 
 from quark.db import api as db_api
 from quark.db import models
+from quark.plugin_modules import ip_addresses as quark_ip_addresses
+from quark.plugin_modules import ports as quark_ports
+from quark.tests import test_base
 
 
 class QuarkNetworkFunctionalTest(unittest2.TestCase):
@@ -55,3 +59,203 @@ class QuarkFindPortsSorted(QuarkNetworkFunctionalTest):
         db_api.port_delete(self.context, port_mod1)
         db_api.port_delete(self.context, port_mod2)
         db_api.port_delete(self.context, port_mod3)
+
+
+class QuarkInstanceNetworkInfo(QuarkNetworkFunctionalTest):
+    def _create_device(self, net, subnet, device_id, address):
+        ip = db_api.ip_address_create(
+            self.context, address=netaddr.IPAddress(address),
+            subnet_id=subnet["id"], network_id=net["id"], version=4)
+        return db_api.port_create(self.context, network_id=net["id"],
+                                  backend_key="1", device_id=device_id,
+                                  addresses=[ip])
+
+    def test_instance_network_info_fixed_queries(self):
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+            subnet = db_api.subnet_create(self.context, network=net,
+                                          cidr="192.168.0.0/24",
+                                          ip_version=4)
+            subnet["routes"].append(db_api.route_create(
+                self.context, cidr="0.0.0.0/0", gateway="192.168.0.1"))
+            subnet["dns_nameservers"].append(db_api.dns_create(
+                self.context, ip=netaddr.IPAddress("8.8.8.8")))
+            for i in xrange(5):
+                self._create_device(net, subnet, "dev%d" % i,
+                                    "192.168.0.%d" % (i + 10))
+        self.context.session.expunge_all()
+
+        with test_base.QueryCounter(neutron_session._ENGINE) as queries:
+            info = quark_ports.get_instance_network_info(
+                self.context, ["dev3", "dev1", "missing"])
+        self.assertEqual(queries.count, 6)
+
+        self.assertEqual([i["device_id"] for i in info],
+                         ["dev3", "dev1", "missing"])
+        self.assertEqual(info[2]["ports"], [])
+        self.assertEqual(info[0]["ports"][0]["fixed_ips"][0]["ip_address"],
+                         "192.168.0.13")
+        subnet_info = info[0]["subnets"][0]
+        self.assertEqual(subnet_info["gateway_ip"], "192.168.0.1")
+        self.assertEqual(subnet_info["dns_nameservers"], ["8.8.8.8"])
+        self.assertEqual(subnet_info["host_routes"],
+                         [{"destination": "0.0.0.0/0",
+                           "nexthop": "192.168.0.1"}])
+
+
+class QuarkNetworkPortCount(QuarkNetworkFunctionalTest):
+    def _create_port(self, net):
+        return db_api.port_create(self.context, network_id=net["id"],
+                                  backend_key="1", device_id="1")
+
+    def test_port_count_tracks_creates_and_deletes(self):
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+            ports = [self._create_port(net) for i in xrange(3)]
+        self.assertEqual(db_api.network_port_count(self.context, net["id"]),
+                         3)
+
+        with self.context.session.begin():
+            db_api.port_delete(self.context, ports[0])
+        self.assertEqual(db_api.network_port_count(self.context, net["id"]),
+                         2)
+
+    def test_port_creates_and_deletes_leave_network_row_alone(self):
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+        with test_base.QueryCounter(neutron_session._ENGINE) as queries:
+            with self.context.session.begin():
+                port = self._create_port(net)
+            with self.context.session.begin():
+                db_api.port_delete(self.context, port)
+        self.assertFalse([s for s in queries.statements
+                          if "UPDATE quark_networks" in s])
+        self.assertEqual(db_api.network_port_count(self.context, net["id"]),
+                         0)
+
+
+class QuarkDeletePortsByDevice(QuarkNetworkFunctionalTest):
+    def _create_port(self, net, rng, device_id, mac, addresses):
+        mac = db_api.mac_address_create(self.context, address=mac,
+                                        mac_address_range_id=rng["id"])
+        return db_api.port_create(self.context, network_id=net["id"],
+                                  backend_key="1", device_id=device_id,
+                                  mac_address=mac["address"],
+                                  addresses=addresses)
+
+    def test_deallocates_addresses_not_shared_outside_the_devices(self):
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE",
+                                        ipam_strategy="ANY")
+            subnet = db_api.subnet_create(self.context, network=net,
+                                          cidr="192.168.0.0/24",
+                                          ip_version=4)
+            rng = db_api.mac_address_range_create(
+                self.context, cidr="AA:BB:CC/40", first_address=0,
+                last_address=256, next_auto_assign_mac=0)
+            ips = [db_api.ip_address_create(
+                self.context, address=netaddr.IPAddress("192.168.0.%d" % i),
+                subnet_id=subnet["id"], network_id=net["id"], version=4)
+                for i in (1, 2, 3)]
+            self._create_port(net, rng, "dev1", 1, ips[:1])
+            self._create_port(net, rng, "dev1", 2, ips[1:2])
+            self._create_port(net, rng, "dev2", 3, ips[1:])
+
+        quark_ports.delete_ports_by_device(self.context, ["dev1", "none"])
+
+        ports = db_api.port_find(self.context, scope=db_api.ALL)
+        self.assertEqual([port["device_id"] for port in ports], ["dev2"])
+        self.assertEqual(db_api.network_port_count(self.context, net["id"]),
+                         1)
+        for ip in ips:
+            self.context.session.refresh(ip)
+        # The second address survives, the port of dev2 still has it
+        self.assertEqual([bool(ip["_deallocated"]) for ip in ips],
+                         [True, False, False])
+        self.assertEqual(ips[0]["reuse_entry"]["subnet_id"], subnet["id"])
+        self.context.session.refresh(subnet)
+        self.assertEqual(subnet["allocated_count"], 2)
+
+        macs = db_api.mac_address_find(self.context, deallocated=True,
+                                       scope=db_api.ALL)
+        self.assertEqual(sorted(mac["address"] for mac in macs), [1, 2])
+        self.context.session.refresh(rng)
+        self.assertEqual(rng["allocated_count"], 1)
+
+
+class QuarkDeallocatedAddressCounts(QuarkNetworkFunctionalTest):
+    def setUp(self):
+        super(QuarkDeallocatedAddressCounts, self).setUp()
+        with self.context.session.begin():
+            self.net = db_api.network_create(self.context, name="public",
+                                             tenant_id="fake",
+                                             network_plugin="BASE",
+                                             ipam_strategy="ANY")
+            self.subnet = db_api.subnet_create(self.context,
+                                               network=self.net,
+                                               cidr="192.168.0.0/24",
+                                               ip_version=4)
+            self.ip = db_api.ip_address_create(
+                self.context, address=netaddr.IPAddress("192.168.0.1"),
+                subnet_id=self.subnet["id"], network_id=self.net["id"],
+                version=4)
+            self.port = db_api.port_create(
+                self.context, network_id=self.net["id"], backend_key="1",
+                device_id="1", addresses=[self.ip])
+
+    def _assert_counter_matches(self, allocated):
+        self.context.session.refresh(self.subnet)
+        count = self.context.session.query(models.IPAddress).filter(
+            models.IPAddress.subnet_id == self.subnet["id"],
+            models.IPAddress._deallocated != 1).count()
+        self.assertEqual(count, allocated)
+        self.assertEqual(self.subnet["allocated_count"], count)
+
+    def test_update_ip_address_without_ports(self):
+        quark_ip_addresses.update_ip_address(
+            self.context, self.ip["id"], dict(ip_address=dict(port_ids=[])))
+        self._assert_counter_matches(0)
+
+    def test_disassociate_port(self):
+        quark_ports.disassociate_port(self.context, self.port["id"],
+                                      self.ip["id"])
+        self._assert_counter_matches(0)
+
+    def test_post_update_port_reallocates(self):
+        with self.context.session.begin():
+            self.port["ip_addresses"] = []
+            db_api.ip_address_deallocate_bulk(self.context, [self.ip])
+        self._assert_counter_matches(0)
+
+        quark_ports.post_update_port(
+            self.context, self.port["id"],
+            dict(port=dict(fixed_ips=[dict(ip_id=self.ip["id"])])))
+        self._assert_counter_matches(1)
+
+
+class QuarkSecurityGroupRuleCount(QuarkNetworkFunctionalTest):
+    def _create_rule(self, group):
+        return db_api.security_group_rule_create(
+            self.context, security_group_id=group["id"], tenant_id="fake",
+            ethertype="IPv4", direction="ingress")
+
+    def test_rule_count_tracks_creates_and_deletes(self):
+        with self.context.session.begin():
+            group = db_api.security_group_create(self.context, name="sg",
+                                                 description="")
+            rules = [self._create_rule(group) for i in xrange(2)]
+        self.assertEqual(
+            db_api.security_group_rule_count(self.context, group["id"]), 2)
+
+        with self.context.session.begin():
+            db_api.security_group_rule_delete(self.context, rules[0])
+        self.assertEqual(
+            db_api.security_group_rule_count(self.context, group["id"]), 1)
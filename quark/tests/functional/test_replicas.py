@@ -0,0 +1,94 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import mock
+from neutron import context
+from neutron.db import api as neutron_db_api
+from oslo.config import cfg
+import unittest2
+
+from quark.db import models
+from quark.db import replicas
+import quark.plugin
+
+
+class QuarkReadReplicas(unittest2.TestCase):
+    def setUp(self):
+        super(QuarkReadReplicas, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        cfg.CONF.set_override("connection", self._url("primary"),
+                              "database")
+        cfg.CONF.set_override("replica_connections", [self._url("replica")],
+                              "QUARK")
+        replicas.reset()
+        self.plugin = quark.plugin.Plugin()
+        self.context = context.get_admin_context()
+
+        # The same network under a different name in each database
+        self.primary_net = self.plugin.create_network(
+            self.context, dict(network=dict(name="primary")))
+        engine = replicas.get_replicas().replicas[0].engine
+        models.BASEV2.metadata.create_all(engine)
+        engine.execute(models.Network.__table__.insert(),
+                       id=self.primary_net["id"], name="replica")
+
+    def tearDown(self):
+        replicas.reset()
+        neutron_db_api.clear_db()
+        cfg.CONF.clear_override("replica_connections", "QUARK")
+        cfg.CONF.clear_override("connection", "database")
+        shutil.rmtree(self.tmpdir)
+
+    def _url(self, name):
+        return "sqlite:///%s" % os.path.join(self.tmpdir, "%s.db" % name)
+
+    def test_reads_go_to_the_replica(self):
+        net = self.plugin.get_network(self.context, self.primary_net["id"])
+        self.assertEqual(net["name"], "replica")
+        self.assertEqual(self.plugin.get_networks_count(self.context), 1)
+
+    def test_read_primary_opts_out(self):
+        net = self.plugin.get_network(self.context, self.primary_net["id"],
+                                      read_primary=True)
+        self.assertEqual(net["name"], "primary")
+
+    def test_writes_go_to_the_primary(self):
+        self.plugin.update_network(self.context, self.primary_net["id"],
+                                   dict(network=dict(name="updated")))
+        net = self.plugin.get_network(self.context, self.primary_net["id"],
+                                      read_primary=True)
+        self.assertEqual(net["name"], "updated")
+        net = self.plugin.get_network(self.context, self.primary_net["id"])
+        self.assertEqual(net["name"], "replica")
+
+    def test_replica_errors_fall_back_to_the_primary(self):
+        engine = replicas.get_replicas().replicas[0].engine
+        models.BASEV2.metadata.drop_all(engine)
+        net = self.plugin.get_network(self.context, self.primary_net["id"])
+        self.assertEqual(net["name"], "primary")
+        self.assertTrue(replicas.get_replicas().session() is None)
+        self.assertTrue(self.context._session is None)
+
+    def test_replica_engine_built_like_the_primary(self):
+        url = "mysql://quark@replica/neutron"
+        with mock.patch("neutron.openstack.common.db.sqlalchemy.session."
+                        "create_engine") as create_engine:
+            replica = replicas.Replica(url)
+        create_engine.assert_called_once_with(url, sqlite_fk=True)
+        self.assertEqual(replica.engine, create_engine.return_value)
@@ -20,7 +20,10 @@ import mock
 from neutron.api.v2 import attributes as neutron_attrs
 from neutron.common import exceptions
 from neutron.extensions import securitygroup as sg_ext
+from neutron import wsgi
+from oslo.config import cfg
 
+from quark.api.extensions import device_ports
 from quark.db import api as quark_db_api
 from quark.db import models
 from quark import exceptions as q_exc
@@ -95,6 +98,36 @@ class TestQuarkGetPorts(test_quark_plugin.TestQuarkPlugin):
             self.assertEqual(fixed_ips[0]["ip_address"],
                              ip["address_readable"])
 
+    def test_port_list_with_fields(self):
+        ip = dict(id=1, address=3232235876, address_readable="192.168.1.100",
+                  subnet_id=1, network_id=2, version=4)
+        port = dict(id=1, mac_address="AA:BB:CC:DD:EE:FF", network_id=1,
+                    tenant_id=self.context.tenant_id, device_id=2,
+                    bridge="xenbr0")
+        with self._stubs(ports=[port], addrs=[ip]):
+            ports = self.plugin.get_ports(self.context, filters=None,
+                                          fields=["id", "device_id"])
+            self.assertEqual(ports, [{"id": 1, "device_id": 2}])
+
+            ports = self.plugin.get_ports(self.context, filters=None,
+                                          fields=["id", "fixed_ips"])
+            self.assertEqual(ports, [{"id": 1, "fixed_ips": [
+                {"subnet_id": 1, "ip_address": "192.168.1.100"}]}])
+
+    def test_port_list_paginated(self):
+        ports = [models.Port(id=1, network_id=1, device_id=2),
+                 models.Port(id=2, network_id=1, device_id=2)]
+        with mock.patch("quark.db.api.port_find") as port_find:
+            port_find.return_value = ports
+            res = self.plugin.get_ports(self.context, filters={},
+                                        fields=["id"], sorts=[("id", True)],
+                                        limit=2, marker=3, page_reverse=True)
+            port_find.assert_called_once_with(
+                self.context, fields=["id"], sorts=[("id", True)], limit=2,
+                marker=3, page_reverse=True)
+        # Reverse pages are fetched in flipped order and put back
+        self.assertEqual(res, [{"id": 2}, {"id": 1}])
+
     def test_port_show(self):
         ip = dict(id=1, address=3232235876, address_readable="192.168.1.100",
                   subnet_id=1, network_id=2, version=4)
@@ -140,7 +173,8 @@ class TestQuarkGetPorts(test_quark_plugin.TestQuarkPlugin):
 
 class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
-    def _stubs(self, port=None, network=None, addr=None, mac=None):
+    def _stubs(self, port=None, network=None, addr=None, mac=None,
+               port_count=0):
         if network:
             network["network_plugin"] = "BASE"
             network["ipam_strategy"] = "ANY"
@@ -153,11 +187,13 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
         with contextlib.nested(
             mock.patch("%s.port_create" % db_mod),
             mock.patch("%s.network_find" % db_mod),
+            mock.patch("%s.network_port_count" % db_mod),
             mock.patch("%s.allocate_ip_address" % ipam),
             mock.patch("%s.allocate_mac_address" % ipam),
-        ) as (port_create, net_find, alloc_ip, alloc_mac):
+        ) as (port_create, net_find, net_port_count, alloc_ip, alloc_mac):
             port_create.return_value = port_models
             net_find.return_value = network
+            net_port_count.return_value = port_count
             alloc_ip.return_value = addr
             alloc_mac.return_value = mac
             yield port_create
@@ -280,14 +316,15 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
                 self.plugin.create_port(self.context, port)
 
     def test_create_port_net_at_max(self):
-        network = dict(id=1, ports=[models.Port()])
+        network = dict(id=1)
         mac = dict(address="AA:BB:CC:DD:EE:FF")
         port_name = "foobar"
         ip = dict()
         port = dict(port=dict(mac_address=mac["address"], network_id=1,
                               tenant_id=self.context.tenant_id, device_id=2,
                               name=port_name))
-        with self._stubs(port=port["port"], network=network, addr=ip, mac=mac):
+        with self._stubs(port=port["port"], network=network, addr=ip, mac=mac,
+                         port_count=1):
             with self.assertRaises(exceptions.OverQuota):
                 self.plugin.create_port(self.context, port)
 
@@ -327,6 +364,134 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
             self.test_create_port_security_groups([])
 
 
+class TestQuarkCreatePortBulk(test_quark_plugin.TestQuarkPlugin):
+    def setUp(self):
+        super(TestQuarkCreatePortBulk, self).setUp()
+        cfg.CONF.set_override('quota_ports_per_network', 5, 'QUOTAS')
+
+    @contextlib.contextmanager
+    def _stubs(self, network=None, addrs=None, mac=None, port_count=0):
+        if network:
+            network["network_plugin"] = "BASE"
+            network["ipam_strategy"] = "ANY"
+
+        def _port_create(context, addresses=None, **kwargs):
+            port = models.Port()
+            port.update(kwargs)
+            return port
+
+        def _create_ports(context, network_id, ports):
+            return [{"uuid": port["port_id"]} for port in ports]
+
+        def _alloc_ips(context, net_id, count, reuse_after, **kwargs):
+            return [[] for i in xrange(count)]
+
+        def _alloc_macs(context, net_id, count, reuse_after):
+            return [dict(address=0xAABBCCDDEE00 + i) for i in xrange(count)]
+
+        db_mod = "quark.db.api"
+        ipam = "quark.ipam.QuarkIpam"
+        with contextlib.nested(
+            mock.patch("%s.port_create" % db_mod),
+            mock.patch("%s.network_find" % db_mod),
+            mock.patch("%s.network_port_count" % db_mod),
+            mock.patch("%s.allocate_ip_address" % ipam),
+            mock.patch("%s.allocate_ip_addresses_bulk" % ipam),
+            mock.patch("%s.allocate_mac_address" % ipam),
+            mock.patch("%s.allocate_mac_addresses_bulk" % ipam),
+            mock.patch("quark.drivers.base.BaseDriver.create_ports")
+        ) as (port_create, net_find, net_port_count, alloc_ip, alloc_ips,
+              alloc_mac, alloc_macs, create_ports):
+            port_create.side_effect = _port_create
+            net_find.return_value = network
+            net_port_count.return_value = port_count
+            alloc_ip.return_value = addrs or []
+            alloc_ips.side_effect = _alloc_ips
+            alloc_mac.return_value = mac
+            alloc_macs.side_effect = _alloc_macs
+            create_ports.side_effect = _create_ports
+            yield (net_find, alloc_ip, alloc_ips, alloc_mac, alloc_macs,
+                   create_ports)
+
+    def _ports(self, count, **kwargs):
+        ports = []
+        for i in xrange(count):
+            port = dict(network_id=1, tenant_id=self.context.tenant_id,
+                        device_id=i)
+            port.update(kwargs)
+            ports.append(dict(port=port))
+        return dict(ports=ports)
+
+    def test_create_port_bulk(self):
+        with self._stubs(network=dict(id=1)) as (
+                net_find, alloc_ip, alloc_ips, alloc_mac, alloc_macs,
+                create_ports):
+            result = self.plugin.create_port_bulk(self.context,
+                                                  self._ports(3))
+            self.assertEqual(len(result), 3)
+            self.assertEqual(len(set([p["id"] for p in result])), 3)
+            self.assertEqual([p["device_id"] for p in result], [0, 1, 2])
+            self.assertEqual(result[2]["mac_address"], "AA:BB:CC:DD:EE:02")
+            self.assertEqual(net_find.call_count, 1)
+            self.assertEqual(alloc_ips.call_count, 1)
+            self.assertEqual(alloc_ips.call_args[0][2], 3)
+            self.assertEqual(alloc_macs.call_count, 1)
+            self.assertEqual(create_ports.call_count, 1)
+            self.assertEqual(len(create_ports.call_args[0][2]), 3)
+            self.assertFalse(alloc_ip.called)
+            self.assertFalse(alloc_mac.called)
+
+    def test_create_port_bulk_specific_mac_and_fixed_ips(self):
+        mac = dict(address=0xAABBCCDDEEFF)
+        fixed_ips = [dict(subnet_id=1, ip_address="192.168.10.45")]
+        ports = self._ports(2)
+        ports["ports"][0]["port"]["mac_address"] = "AA:BB:CC:DD:EE:FF"
+        ports["ports"][0]["port"]["fixed_ips"] = fixed_ips
+        with self._stubs(network=dict(id=1), mac=mac) as (
+                net_find, alloc_ip, alloc_ips, alloc_mac, alloc_macs,
+                create_ports):
+            result = self.plugin.create_port_bulk(self.context, ports)
+            self.assertEqual(result[0]["mac_address"], "AA:BB:CC:DD:EE:FF")
+            self.assertEqual(alloc_ip.call_count, 1)
+            self.assertEqual(alloc_ips.call_args[0][2], 1)
+            self.assertEqual(alloc_mac.call_count, 1)
+            self.assertEqual(alloc_macs.call_args[0][2], 1)
+
+    def test_create_port_bulk_passes_macs_to_ip_allocation(self):
+        mac = dict(address=0xAABBCCDDEEFF)
+        fixed_ips = [dict(subnet_id=1, ip_address="192.168.10.45")]
+        ports = self._ports(3)
+        ports["ports"][0]["port"]["mac_address"] = "AA:BB:CC:DD:EE:FF"
+        ports["ports"][0]["port"]["fixed_ips"] = fixed_ips
+        with self._stubs(network=dict(id=1), mac=mac) as (
+                net_find, alloc_ip, alloc_ips, alloc_mac, alloc_macs,
+                create_ports):
+            result = self.plugin.create_port_bulk(self.context, ports)
+            self.assertEqual(alloc_ip.call_args[1]["mac_address"],
+                             0xAABBCCDDEEFF)
+            kwargs = alloc_ips.call_args[1]
+            self.assertEqual(kwargs["mac_addresses"],
+                             [0xAABBCCDDEE00, 0xAABBCCDDEE01])
+            self.assertEqual(kwargs["port_ids"],
+                             [p["id"] for p in result[1:]])
+
+    def test_create_port_bulk_fixed_ips_require_subnet_and_address(self):
+        ports = self._ports(1, fixed_ips=[dict(subnet_id=1)])
+        with self._stubs(network=dict(id=1)):
+            with self.assertRaises(exceptions.BadRequest):
+                self.plugin.create_port_bulk(self.context, ports)
+
+    def test_create_port_bulk_net_not_found(self):
+        with self._stubs(network=None):
+            with self.assertRaises(exceptions.NetworkNotFound):
+                self.plugin.create_port_bulk(self.context, self._ports(2))
+
+    def test_create_port_bulk_net_at_max(self):
+        with self._stubs(network=dict(id=1), port_count=4):
+            with self.assertRaises(exceptions.OverQuota):
+                self.plugin.create_port_bulk(self.context, self._ports(2))
+
+
 class TestQuarkUpdatePort(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, port, new_ips=None):
@@ -624,6 +789,57 @@ class TestQuarkGetPortCount(test_quark_plugin.TestQuarkPlugin):
             self.plugin.get_ports_count(self.context, {})
 
 
+class TestQuarkGetInstanceNetworkInfo(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, ports=None):
+        port_models = []
+        for port in ports or []:
+            subnet = models.Subnet(id=1, network_id=2, cidr="192.168.0.0/24",
+                                   ip_version=4)
+            subnet["routes"] = [models.Route(cidr="0.0.0.0/0",
+                                             gateway="192.168.0.1")]
+            subnet["dns_nameservers"] = [models.DNSNameserver(ip=0x08080808)]
+            ip = models.IPAddress(address=0xC0A8000A, subnet_id=1, version=4,
+                                  address_readable="192.168.0.10")
+            ip["subnet"] = subnet
+            port_model = models.Port()
+            port_model.update(port)
+            port_model["ip_addresses"] = [ip]
+            port_models.append(port_model)
+
+        with mock.patch("quark.db.api.port_find_network_info") as port_find:
+            port_find.return_value = port_models
+            yield port_find
+
+    def test_get_instance_network_info(self):
+        port = dict(id=1, device_id="dev1", network_id=2,
+                    mac_address="AA:BB:CC:DD:EE:FF")
+        with self._stubs(ports=[port, dict(port, id=3)]) as port_find:
+            info = self.plugin.get_instance_network_info(
+                self.context, ["dev1", "dev2"])
+            port_find.assert_called_once_with(self.context, ["dev1", "dev2"])
+
+        self.assertEqual([i["device_id"] for i in info], ["dev1", "dev2"])
+        self.assertEqual([p["id"] for p in info[0]["ports"]], [1, 3])
+        self.assertEqual(info[0]["ports"][0]["fixed_ips"],
+                         [{"subnet_id": 1, "ip_address": "192.168.0.10"}])
+        self.assertEqual(len(info[0]["subnets"]), 1)
+        subnet = info[0]["subnets"][0]
+        self.assertEqual(subnet["gateway_ip"], "192.168.0.1")
+        self.assertEqual(subnet["dns_nameservers"], ["8.8.8.8"])
+        self.assertEqual(subnet["host_routes"],
+                         [{"destination": "0.0.0.0/0",
+                           "nexthop": "192.168.0.1"}])
+        self.assertEqual(info[1], {"device_id": "dev2", "ports": [],
+                                   "subnets": []})
+
+    def test_get_instance_network_info_no_devices(self):
+        with self._stubs() as port_find:
+            info = self.plugin.get_instance_network_info(self.context, [])
+            self.assertFalse(port_find.called)
+        self.assertEqual(info, [])
+
+
 class TestQuarkDeletePort(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, port=None, addr=None, mac=None):
@@ -667,6 +883,87 @@ class TestQuarkDeletePort(test_quark_plugin.TestQuarkPlugin):
                 self.plugin.delete_port(self.context, 1)
 
 
+class TestQuarkDeletePortsByDevice(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, ports):
+        port_models = []
+        networks = {}
+        for port in ports:
+            network_id = port["network_id"]
+            if network_id not in networks:
+                net_model = models.Network()
+                net_model["network_plugin"] = "BASE"
+                net_model["ipam_strategy"] = "ANY"
+                networks[network_id] = net_model
+            port_model = models.Port()
+            port_model.update(port)
+            port_model.network = networks[network_id]
+            port_models.append(port_model)
+
+        db_mod = "quark.db.api"
+        ipam = "quark.ipam.QuarkIpam"
+        with contextlib.nested(
+            mock.patch("%s.port_find" % db_mod),
+            mock.patch("%s.deallocate_ip_addresses_bulk" % ipam),
+            mock.patch("%s.deallocate_mac_addresses_bulk" % ipam),
+            mock.patch("%s.port_delete_bulk" % db_mod),
+            mock.patch("quark.drivers.base.BaseDriver.delete_ports")
+        ) as (port_find, dealloc_ips, dealloc_macs, db_ports_del,
+              driver_ports_del):
+            port_find.return_value = port_models
+            yield (port_find, dealloc_ips, dealloc_macs, db_ports_del,
+                   driver_ports_del)
+
+    def test_delete_ports_by_device(self):
+        ports = [dict(network_id=1, device_id="a", backend_key="foo",
+                      mac_address="AA:BB:CC:DD:EE:FF"),
+                 dict(network_id=1, device_id="b", backend_key="bar",
+                      mac_address="AA:BB:CC:DD:EE:00"),
+                 dict(network_id=2, device_id="a", backend_key="baz",
+                      mac_address="AA:BB:CC:DD:EE:01")]
+        with self._stubs(ports) as (port_find, dealloc_ips, dealloc_macs,
+                                    db_ports_del, driver_ports_del):
+            self.plugin.delete_ports_by_device(self.context, ["a", "b"])
+            self.assertEqual(port_find.call_args[1]["device_id"],
+                             ["a", "b"])
+            self.assertEqual(port_find.call_args[1]["tenant_id"],
+                             self.context.tenant_id)
+            self.assertEqual(dealloc_ips.call_count, 2)
+            self.assertEqual(
+                sorted(sum([c[0][1] for c in dealloc_macs.call_args_list],
+                           [])),
+                [0xAABBCCDDEE00, 0xAABBCCDDEE01, 0xAABBCCDDEEFF])
+            db_ports_del.assert_called_once_with(self.context,
+                                                 port_find.return_value)
+            driver_ports_del.assert_called_once_with(self.context, mock.ANY)
+            self.assertEqual(sorted(driver_ports_del.call_args[0][1]),
+                             ["bar", "baz", "foo"])
+
+    def test_delete_ports_by_device_no_ports(self):
+        with self._stubs([]) as (port_find, dealloc_ips, dealloc_macs,
+                                 db_ports_del, driver_ports_del):
+            self.plugin.delete_ports_by_device(self.context, ["a"])
+            self.assertFalse(dealloc_ips.called)
+            self.assertFalse(driver_ports_del.called)
+
+    def test_delete_device_ports_through_controller(self):
+        ports = [dict(network_id=1, device_id="a", backend_key="foo",
+                      mac_address="AA:BB:CC:DD:EE:FF")]
+        controller = device_ports.DevicePortsController(self.plugin)
+        request = wsgi.Request.blank("/device_ports/a", method="DELETE")
+        request.environ["neutron.context"] = self.context
+        request.environ["wsgiorg.routing_args"] = (
+            None, dict(controller=controller, action="delete", id="a"))
+        with self._stubs(ports) as (port_find, dealloc_ips, dealloc_macs,
+                                    db_ports_del, driver_ports_del):
+            response = request.get_response(controller)
+            self.assertEqual(response.status_int, 204)
+            self.assertEqual(port_find.call_args[1]["device_id"], ["a"])
+            db_ports_del.assert_called_once_with(self.context,
+                                                 port_find.return_value)
+            driver_ports_del.assert_called_once_with(self.context, ["foo"])
+
+
 class TestQuarkDisassociatePort(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, port=None):
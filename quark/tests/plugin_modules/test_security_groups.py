@@ -289,9 +289,12 @@ class TestQuarkCreateSecurityGroupRule(test_quark_plugin.TestQuarkPlugin):
         with contextlib.nested(
                 mock.patch("quark.db.api.security_group_find"),
                 mock.patch("quark.db.api.security_group_rule_find"),
-                mock.patch("quark.db.api.security_group_rule_create")
-        ) as (group_find, rule_find, rule_create):
+                mock.patch("quark.db.api.security_group_rule_create"),
+                mock.patch("quark.db.api.security_group_rule_count")
+        ) as (group_find, rule_find, rule_create, rule_count):
             group_find.return_value = dbgroup
+            rule_count.return_value = len(group.get(
+                'rules', [])) if group else 0
             rule_find.return_value.count.return_value = group.get(
                 'port_rules', None) if group else 0
             rule_create.return_value = dbrule
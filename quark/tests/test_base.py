@@ -16,6 +16,7 @@
 import unittest2
 
 from neutron import context
+from sqlalchemy import event
 
 
 class TestBase(unittest2.TestCase):
@@ -36,3 +37,27 @@ class TestBase(unittest2.TestCase):
                 pass
 
         self.context.session.begin = FakeContext
+
+
+class QueryCounter(object):
+    """Records the statements executed on an engine inside a with block."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _before_execute(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute",
+                     self._before_execute)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, "before_cursor_execute",
+                     self._before_execute)
@@ -37,6 +37,12 @@ class TestBaseDriver(test_base.TestBase):
     def test_create_port(self):
         self.driver.create_port(context=self.context, network_id=1, port_id=2)
 
+    def test_create_ports(self):
+        backend = self.driver.create_ports(
+            context=self.context, network_id=1,
+            ports=[dict(port_id=2), dict(port_id=3)])
+        self.assertEqual(backend, [{"uuid": 2}, {"uuid": 3}])
+
     def test_update_port(self):
         self.driver.update_port(context=self.context, network_id=1, port_id=2)
 
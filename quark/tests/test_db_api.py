@@ -14,10 +14,12 @@
 #  under the License.
 
 import mock
+import netaddr
 from neutron.db import api as neutron_db_api
 from oslo.config import cfg
 
 from quark.db import api as db_api
+from quark.db import models
 
 from quark.tests import test_base
 
@@ -45,3 +47,54 @@ class TestDBAPI(test_base.TestBase):
         query_obj = self.context.session.query.return_value
         filter_fn = query_obj.filter
         self.assertEqual(filter_fn.call_count, 1)
+
+
+class TestModelQueryCriteriaCache(test_base.TestBase):
+    def setUp(self):
+        super(TestModelQueryCriteriaCache, self).setUp()
+        configure_mappers()
+        db_api._CRITERIA_CACHE.clear()
+        self.addCleanup(db_api._CRITERIA_CACHE.clear)
+
+    def _params(self, criteria):
+        self.assertEqual(len(criteria), 1)
+        return criteria[0].compile().params
+
+    def test_same_shape_reuses_criteria(self):
+        first = db_api._model_query(self.context, models.Port,
+                                    {"id": ["a"], "network_id": ["n"]})
+        second = db_api._model_query(self.context, models.Port,
+                                     {"id": ["b"], "network_id": ["m"]})
+        self.assertEqual(len(db_api._CRITERIA_CACHE), 1)
+        self.assertEqual(self._params(first),
+                         {"filter_id_0": "a", "filter_network_id_0": "n"})
+        self.assertEqual(self._params(second),
+                         {"filter_id_0": "b", "filter_network_id_0": "m"})
+
+    def test_in_list_length_is_part_of_the_shape(self):
+        db_api._model_query(self.context, models.Port, {"id": ["a"]})
+        criteria = db_api._model_query(self.context, models.Port,
+                                       {"id": ["a", "b"]})
+        self.assertEqual(len(db_api._CRITERIA_CACHE), 2)
+        self.assertEqual(self._params(criteria),
+                         {"filter_id_0": "a", "filter_id_1": "b"})
+
+    def test_long_in_lists_are_not_cached(self):
+        ids = [str(i) for i in xrange(db_api.CRITERIA_CACHE_MAX_IN + 1)]
+        db_api._model_query(self.context, models.Port, {"id": ids})
+        self.assertEqual(db_api._CRITERIA_CACHE, {})
+
+    def test_flag_and_converted_filters(self):
+        criteria = db_api._model_query(
+            self.context, models.IPAddress,
+            {"_deallocated": False, "ip_address": netaddr.IPAddress("::1")})
+        self.assertEqual(self._params(criteria), {"filter_ip_address": 1})
+        self.assertIn("!=", str(criteria[0]))
+
+    def test_tenant_injected_without_filters(self):
+        criteria = db_api._model_query(self.context, models.Network, {})
+        self.assertEqual(self._params(criteria),
+                         {"filter_tenant_id_0": "fake"})
+        self.context.is_admin = True
+        self.assertEqual(
+            db_api._model_query(self.context, models.Network, {}), [])
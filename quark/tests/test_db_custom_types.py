@@ -13,11 +13,13 @@
 # License for the specific language governing permissions and limitations
 #  under the License.
 
+import netaddr
+
 from quark.db import custom_types
 
 from quark.tests import test_base
 
-from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 
 
 class TestDBCustomTypesINET(test_base.TestBase):
@@ -29,35 +31,57 @@ class TestDBCustomTypesINET(test_base.TestBase):
 
     def test_inet_load_dialect_impl(self):
         dialect = self.inet.load_dialect_impl(mysql.dialect())
-        self.assertEqual(type(dialect), type(custom_types.INET.impl()))
+        self.assertEqual(type(dialect), mysql.BINARY)
+        self.assertEqual(dialect.length, custom_types.INET_BYTES)
 
     def test_inet_load_dialect_impl_sqlite(self):
         dialect = self.inet.load_dialect_impl(sqlite.dialect())
         self.assertEqual(type(dialect), sqlite.CHAR)
 
+    def test_inet_load_dialect_impl_other(self):
+        dialect = self.inet.load_dialect_impl(postgresql.dialect())
+        self.assertEqual(type(dialect), type(custom_types.INET.impl()))
+
     def test_process_bind_param(self):
         bind = self.inet.process_bind_param(None, None)
         self.assertIsNone(bind)
 
     def test_process_bind_param_with_value(self):
-        bind = self.inet.process_bind_param("foo", sqlite.dialect())
-        self.assertEqual(bind, "foo")
+        bind = self.inet.process_bind_param(5, sqlite.dialect())
+        self.assertEqual(bind, "0" * 38 + "5")
 
     def test_process_bind_param_with_value_not_sqlite(self):
-        bind = self.inet.process_bind_param("foo", mysql.dialect())
-        self.assertEqual(bind, "foo")
+        bind = self.inet.process_bind_param(258, mysql.dialect())
+        self.assertEqual(bind, "\x00" * 14 + "\x01\x02")
+
+    def test_process_bind_param_with_ip_address(self):
+        bind = self.inet.process_bind_param(netaddr.IPAddress("::1"),
+                                            mysql.dialect())
+        self.assertEqual(bind, "\x00" * 15 + "\x01")
 
     def test_process_result_value(self):
         bind = self.inet.process_result_value(None, mysql.dialect())
         self.assertIsNone(bind)
 
     def test_process_result_value_with_value(self):
-        bind = self.inet.process_result_value(1.0, sqlite.dialect())
-        self.assertEqual(bind, 1.0)
+        bind = self.inet.process_result_value("0" * 38 + "5",
+                                              sqlite.dialect())
+        self.assertEqual(bind, 5)
 
     def test_process_result_value_with_value_not_sqlite(self):
-        bind = self.inet.process_result_value(1.0, mysql.dialect())
-        self.assertEqual(bind, 1.0)
+        bind = self.inet.process_result_value("\x00" * 14 + "\x01\x02",
+                                              mysql.dialect())
+        self.assertEqual(bind, 258)
+
+    def test_encoding_sorts_numerically(self):
+        values = [0, 9, 10, 100, 2 ** 32, 2 ** 64 + 1, 2 ** 128 - 1]
+        for dialect in (sqlite.dialect(), mysql.dialect()):
+            encoded = [self.inet.process_bind_param(v, dialect)
+                       for v in values]
+            self.assertEqual(sorted(encoded), encoded)
+            self.assertEqual(len(set([len(e) for e in encoded])), 1)
+            self.assertEqual([self.inet.process_result_value(e, dialect)
+                              for e in encoded], values)
 
 
 class TestDBCustomTypesMACAddress(test_base.TestBase):
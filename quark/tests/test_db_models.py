@@ -41,3 +41,14 @@ class TestDBModels(test_base.TestBase):
             ip_policy_rules,
             IPSet(["fc00::/128",
                    "fdff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128"]))
+
+    def test_deallocated_ip_address_is_queued_for_reuse(self):
+        address = models.IPAddress(network_id=1, subnet_id=2, version=4)
+        address["deallocated"] = 1
+        entry = address["reuse_entry"]
+        self.assertEqual((entry["network_id"], entry["subnet_id"],
+                          entry["version"]), (1, 2, 4))
+        self.assertEqual(entry["deallocated_at"], address["deallocated_at"])
+
+        address["deallocated"] = 0
+        self.assertIsNone(address["reuse_entry"])
@@ -0,0 +1,135 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import netaddr
+
+from quark.db import api as db_api
+from quark.db import models
+from quark import ip_policy_cache
+from quark.tests import test_base
+
+
+def _ip(address):
+    return int(netaddr.IPAddress(address))
+
+
+class TestIPPolicyIntervals(test_base.TestBase):
+    def setUp(self):
+        super(TestIPPolicyIntervals, self).setUp()
+        ip_policy_cache.clear()
+
+    def test_default_policy_excludes_network_and_broadcast(self):
+        policy = ip_policy_cache.compile_policy("192.168.1.0/24", [])
+        self.assertEqual(list(policy),
+                         [(_ip("192.168.1.0"), _ip("192.168.1.0")),
+                          (_ip("192.168.1.255"), _ip("192.168.1.255"))])
+        self.assertEqual(policy.size, 2)
+
+    def test_overlapping_and_adjacent_cidrs_are_merged(self):
+        policy = ip_policy_cache.compile_policy(
+            "192.168.1.0/24", ["192.168.1.0/28", "192.168.1.16/30",
+                               "192.168.1.8/29"])
+        self.assertEqual(list(policy)[0],
+                         (_ip("192.168.1.0"), _ip("192.168.1.19")))
+        self.assertEqual(policy.size, 21)
+
+    def test_cidrs_are_clipped_to_subnet_and_version(self):
+        policy = ip_policy_cache.compile_policy(
+            "192.168.1.0/24", ["192.168.0.0/16", "::/0"])
+        self.assertEqual(policy.size, 256)
+        self.assertEqual(list(policy.permitted()), [])
+
+    def test_membership(self):
+        policy = ip_policy_cache.compile_policy("192.168.1.0/24",
+                                                ["192.168.1.16/30"])
+        self.assertIn(_ip("192.168.1.0"), policy)
+        self.assertIn(_ip("192.168.1.17"), policy)
+        self.assertNotIn(_ip("192.168.1.20"), policy)
+        self.assertNotIn(_ip("192.168.1.15"), policy)
+
+    def test_first_permitted(self):
+        policy = ip_policy_cache.compile_policy("192.168.1.0/24",
+                                                ["192.168.1.0/28"])
+        self.assertEqual(policy.first_permitted(_ip("192.168.1.0"),
+                                                _ip("192.168.1.255")),
+                         _ip("192.168.1.16"))
+        self.assertEqual(policy.first_permitted(_ip("192.168.1.20"),
+                                                _ip("192.168.1.255")),
+                         _ip("192.168.1.20"))
+        self.assertIsNone(policy.first_permitted(_ip("192.168.1.255"),
+                                                 _ip("192.168.1.255")))
+
+    def test_permitted_v6(self):
+        policy = ip_policy_cache.compile_policy("fc00::/64", [])
+        self.assertEqual(list(policy.permitted()),
+                         [(_ip("fc00::1"),
+                           _ip("fc00::ffff:ffff:ffff:fffe"))])
+
+
+class TestIPPolicyCache(test_base.TestBase):
+    def setUp(self):
+        super(TestIPPolicyCache, self).setUp()
+        ip_policy_cache.clear()
+
+    def _policy(self, cidrs, revision=0):
+        policy = models.IPPolicy(id="policy", revision=revision)
+        policy["exclude"] = [models.IPPolicyCIDR(cidr=c) for c in cidrs]
+        return policy
+
+    def test_get_caches_by_policy_and_revision(self):
+        policy = self._policy(["192.168.1.0/28"])
+        first = ip_policy_cache.get(policy, "192.168.1.0/24")
+        self.assertIs(ip_policy_cache.get(policy, "192.168.1.0/24"), first)
+        policy["revision"] = 1
+        self.assertIsNot(ip_policy_cache.get(policy, "192.168.1.0/24"),
+                         first)
+
+    def test_get_without_policy_caches_by_cidr(self):
+        first = ip_policy_cache.get(None, "192.168.1.0/24")
+        self.assertIs(ip_policy_cache.get({}, "192.168.1.0/24"), first)
+
+    def test_get_dict_policy_is_not_cached(self):
+        policy = dict(exclude=[dict(cidr="192.168.1.0/28")])
+        first = ip_policy_cache.get(policy, "192.168.1.0/24")
+        self.assertIsNot(ip_policy_cache.get(policy, "192.168.1.0/24"),
+                         first)
+        self.assertEqual(first.size, 17)
+
+    def test_update_bumps_revision_and_invalidates(self):
+        policy = self._policy(["192.168.1.0/28"])
+        first = ip_policy_cache.get(policy, "192.168.1.0/24")
+        self.context.session.add = mock.Mock()
+        db_api.ip_policy_update(self.context, policy,
+                                exclude=["192.168.1.0/30"])
+        self.assertEqual(policy["revision"], 1)
+        second = ip_policy_cache.get(policy, "192.168.1.0/24")
+        self.assertIsNot(second, first)
+        self.assertEqual(second.size, 5)
+
+    def test_delete_invalidates(self):
+        policy = self._policy(["192.168.1.0/28"])
+        first = ip_policy_cache.get(policy, "192.168.1.0/24")
+        self.context.session.delete = mock.Mock()
+        db_api.ip_policy_delete(self.context, policy)
+        self.assertIsNot(ip_policy_cache.get(policy, "192.168.1.0/24"),
+                         first)
+
+    def test_subnet_policy_takes_precedence_over_network(self):
+        subnet = dict(cidr="192.168.1.0/24",
+                      ip_policy=self._policy(["192.168.1.0/28"]),
+                      network=dict(ip_policy=None))
+        policy = models.IPPolicy.get_ip_policy_intervals(subnet)
+        self.assertEqual(policy.size, 17)
@@ -19,6 +19,7 @@ import netaddr
 
 from neutron.common import exceptions
 from neutron.db import api as neutron_db_api
+from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common.db.sqlalchemy import session as neutron_session
 from neutron.openstack.common.notifier import api as notifier_api
 from oslo.config import cfg
@@ -150,6 +151,15 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
             with self.assertRaises(exceptions.MacAddressGenerationFailure):
                 self.ipam.allocate_mac_address(self.context, 0, 0, 0)
 
+    def test_allocate_mac_never_probes_past_range(self):
+        mar = dict(id=1, first_address=0, last_address=2,
+                   next_auto_assign_mac=0)
+        taken = dict(address=0)
+        # A full range whose counter says it's empty
+        with self._stubs(ranges=[(mar, 0)], addresses=[None, taken, taken]):
+            with self.assertRaises(exceptions.MacAddressGenerationFailure):
+                self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+
     def test_allocate_mac_two_open_ranges_chooses_first(self):
         mar1 = dict(id=1, first_address=0, last_address=255,
                     next_auto_assign_mac=0)
@@ -162,6 +172,133 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
             self.assertEqual(address["address"], 0)
 
 
+class QuarkMacAddressFreeBlockAllocation(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, ranges, free_block):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.mac_address_find" % db_mod),
+            mock.patch("%s.mac_address_range_find_allocation_counts" % db_mod),
+            mock.patch("%s.mac_address_free_block_find" % db_mod),
+            mock.patch("%s.mac_address_free_block_update" % db_mod),
+            mock.patch("%s.mac_address_free_block_delete" % db_mod),
+            mock.patch("%s.mac_address_free_block_create" % db_mod),
+            mock.patch("%s.mac_address_create" % db_mod)
+        ) as (mac_find, range_count, block_find, block_update, block_delete,
+              block_create, mac_create):
+            mac_find.return_value = None
+            range_count.return_value = ranges
+            block_find.return_value = free_block
+            mac_create.side_effect = lambda ctxt, **kw: kw
+            yield (mac_find, block_update, block_delete, block_create)
+
+    def _range(self, **kwargs):
+        mar = dict(id=1, first_address=0, last_address=256,
+                   next_auto_assign_mac=0, free_blocks_indexed=True)
+        mar.update(kwargs)
+        return mar
+
+    def test_allocate_takes_head_of_first_free_block(self):
+        block = dict(mac_address_range_id=1, first_address=7,
+                     last_address=255)
+        with self._stubs([(self._range(), 7)], block) as (
+                mac_find, block_update, block_delete, block_create):
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["address"], 7)
+            self.assertEqual(mac_find.call_count, 1)
+            block_update.assert_called_once_with(self.context, block,
+                                                 first_address=8)
+            self.assertFalse(block_delete.called)
+
+    def test_allocate_last_mac_in_block_deletes_block(self):
+        block = dict(mac_address_range_id=1, first_address=9,
+                     last_address=9)
+        with self._stubs([(self._range(), 255)], block) as (
+                mac_find, block_update, block_delete, block_create):
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["address"], 9)
+            block_delete.assert_called_once_with(self.context, block)
+            self.assertFalse(block_update.called)
+
+    def test_allocate_specific_mac_splits_block(self):
+        block = dict(mac_address_range_id=1, first_address=0,
+                     last_address=255)
+        with self._stubs([(self._range(), 0)], block) as (
+                mac_find, block_update, block_delete, block_create):
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0,
+                                                     mac_address=100)
+            self.assertEqual(address["address"], 100)
+            block_update.assert_called_once_with(self.context, block,
+                                                 last_address=99)
+            block_create.assert_called_once_with(
+                self.context, mac_address_range_id=1, first_address=101,
+                last_address=255)
+
+    def test_allocate_no_free_block_fails(self):
+        with self._stubs([(self._range(), 0)], None):
+            with self.assertRaises(exceptions.MacAddressGenerationFailure):
+                self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+
+
+class QuarkMacAddressBulkAllocation(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, ranges, free_blocks=None, deallocated=None):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.mac_address_find" % db_mod),
+            mock.patch("%s.mac_address_range_find_allocation_counts" % db_mod),
+            mock.patch("%s.mac_address_free_block_find" % db_mod),
+            mock.patch("%s.mac_address_free_block_update" % db_mod),
+            mock.patch("%s.mac_address_free_block_delete" % db_mod)
+        ) as (mac_find, range_count, block_find, block_update,
+              block_delete):
+            mac_find.return_value.limit.return_value.all.return_value = \
+                deallocated or []
+            range_count.return_value = ranges
+            block_find.return_value = free_blocks
+            yield block_update, block_delete
+
+    def _range(self, **kwargs):
+        mar = dict(id=1, first_address=0, last_address=256,
+                   next_auto_assign_mac=0, free_blocks_indexed=True)
+        mar.update(kwargs)
+        return mar
+
+    def test_bulk_takes_consecutive_macs_across_blocks(self):
+        blocks = [dict(mac_address_range_id=1, first_address=3,
+                       last_address=4),
+                  dict(mac_address_range_id=1, first_address=10,
+                       last_address=255)]
+        with self._stubs([(self._range(), 3)], free_blocks=blocks) as (
+                block_update, block_delete):
+            macs = self.ipam.allocate_mac_addresses_bulk(self.context, 0, 4,
+                                                         0)
+            self.assertEqual([m["address"] for m in macs], [3, 4, 10, 11])
+            block_delete.assert_called_once_with(self.context, blocks[0])
+            block_update.assert_called_once_with(self.context, blocks[1],
+                                                 first_address=12)
+
+    def test_bulk_reuses_deallocated_macs_first(self):
+        old = models.MacAddress(address=42, mac_address_range_id=1,
+                                deallocated=True)
+        blocks = [dict(mac_address_range_id=1, first_address=0,
+                       last_address=255)]
+        with self._stubs([(self._range(), 1)], free_blocks=blocks,
+                         deallocated=[old]):
+            macs = self.ipam.allocate_mac_addresses_bulk(self.context, 0, 2,
+                                                         0)
+            self.assertEqual([m["address"] for m in macs], [42, 0])
+            self.assertFalse(old["deallocated"])
+
+    def test_bulk_not_enough_macs_fails(self):
+        with self._stubs([(self._range(last_address=2), 0)],
+                         free_blocks=[dict(mac_address_range_id=1,
+                                           first_address=0,
+                                           last_address=1)]):
+            with self.assertRaises(exceptions.MacAddressGenerationFailure):
+                self.ipam.allocate_mac_addresses_bulk(self.context, 0, 3, 0)
+
+
 class QuarkMacAddressDeallocation(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, mac):
@@ -277,21 +414,23 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         self.v6_lip = 338854485284841385865528720941249462271L
 
     @contextlib.contextmanager
-    def _stubs(self, addresses=None, subnets=None):
+    def _stubs(self, addresses=None, subnets=None, reusable=None):
         if not addresses:
             addresses = [None, None]
         db_mod = "quark.db.api"
         self.context.session.add = mock.Mock()
         with contextlib.nested(
             mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.ip_address_find_reusable" % db_mod),
             mock.patch("%s.subnet_find_allocation_counts" % db_mod),
             mock.patch("%s.subnet_find" % db_mod)
-        ) as (addr_find, subnet_alloc_find, subnet_find):
+        ) as (addr_find, reusable_find, subnet_alloc_find, subnet_find):
             addr_find.side_effect = addresses
-            if subnets and len(subnets[0]):
-                subnet_find.return_value = [subnets[0][0][0]]
-            subnet_alloc_find.side_effect = subnets
-            yield
+            reusable_find.return_value = reusable or []
+            subnet_find.return_value = [subnet for subnet, count
+                                        in (subnets or [])[:1]]
+            subnet_alloc_find.return_value = subnets or []
+            yield reusable_find, subnet_alloc_find
 
     def test_allocate_new_ip_address_two_empty_subnets(self):
         subnet4 = dict(id=1, first_ip=0, last_ip=255,
@@ -302,19 +441,38 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
                        cidr="feed::/104", ip_version=6,
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
-        with self._stubs(subnets=[[(subnet4, 0)], [(subnet6, 0)]],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[(subnet4, 0), (subnet6, 0)],
+                         addresses=[None, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 1)
             self.assertEqual(address[1]["address"], 0)
 
+    def test_allocate_queries_both_versions_at_once(self):
+        subnet4 = dict(id=1, first_ip=0, last_ip=255,
+                       cidr="0.0.0.0/24", ip_version=4,
+                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       ip_policy=None)
+        subnet6 = dict(id=1, first_ip=self.v6_fip, last_ip=self.v6_lip,
+                       cidr="feed::/104", ip_version=6,
+                       next_auto_assign_ip=0, network=dict(ip_policy=None),
+                       ip_policy=None)
+        with self._stubs(subnets=[(subnet6, 0), (subnet4, 0)],
+                         addresses=[None, None]) as (reusable_find,
+                                                     subnet_alloc_find):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
+            self.assertEqual([a["version"] for a in address], [4, 6])
+            self.assertEqual(reusable_find.call_count, 1)
+            self.assertEqual(reusable_find.call_args[1]["version"], [4, 6])
+            self.assertEqual(subnet_alloc_find.call_count, 1)
+            self.assertNotIn("ip_version", subnet_alloc_find.call_args[1])
+
     def test_allocate_new_ip_address_one_v4_subnet_open(self):
         subnet4 = dict(id=1, first_ip=0, last_ip=255,
                        cidr="0.0.0.0/24", ip_version=4,
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
-        with self._stubs(subnets=[[(subnet4, 0)], []],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[(subnet4, 0)],
+                         addresses=[None, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 1)
             self.assertEqual(address[0]["version"], 4)
@@ -324,15 +482,15 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
                        cidr="feed::/104", ip_version=6,
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
-        with self._stubs(subnets=[[], [(subnet6, 0)]],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[(subnet6, 0)],
+                         addresses=[None, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 1)
             self.assertEqual(address[0]["version"], 6)
 
     def test_allocate_new_ip_address_no_avail_subnets(self):
-        with self._stubs(subnets=[[], []],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[],
+                         addresses=[None, None]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(self.context, 0, 0, 0)
 
@@ -345,8 +503,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 4
         address["subnet"] = models.Subnet(cidr="0.0.0.0/24")
-        with self._stubs(subnets=[[(subnet6, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet6, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
@@ -369,8 +527,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 4
         address["subnet"] = models.Subnet(cidr="0.0.0.0/24")
-        with self._stubs(subnets=[[(subnet6, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet6, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     subnets=[subnet4])
             self.assertEqual(len(address), 2)
@@ -388,8 +546,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 4
         address["subnet"] = models.Subnet(cidr="0.0.0.0/24")
-        with self._stubs(subnets=[[(subnet6, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet6, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     segment_id="cell01")
             self.assertEqual(len(address), 2)
@@ -410,8 +568,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 4
         address["subnet"] = models.Subnet(cidr="0.0.0.0/24")
-        with self._stubs(subnets=[[]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 1)
             self.assertEqual(address[0]["address"], 4)
@@ -426,8 +584,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 6
         address["subnet"] = models.Subnet(cidr="::/120")
-        with self._stubs(subnets=[[(subnet4, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet4, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
@@ -444,8 +602,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address["address"] = "4"
         address["version"] = 6
         address["subnet"] = models.Subnet(cidr="::/120")
-        with self._stubs(subnets=[[(subnet4, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet4, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], "4")
@@ -462,8 +620,8 @@ class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
         address2["address"] = 42
         address2["version"] = 6
         address2["subnet"] = models.Subnet(cidr="0::/120")
-        with self._stubs(subnets=[[]],
-                         addresses=[address1, address2]):
+        with self._stubs(subnets=[],
+                         reusable=[address1, address2]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
@@ -480,17 +638,19 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
         self.v6_lip = 338854485284841385865528720941249462271L
 
     @contextlib.contextmanager
-    def _stubs(self, addresses=None, subnets=None):
+    def _stubs(self, addresses=None, subnets=None, reusable=None):
         if not addresses:
             addresses = [None, None]
         db_mod = "quark.db.api"
         self.context.session.add = mock.Mock()
         with contextlib.nested(
             mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.ip_address_find_reusable" % db_mod),
             mock.patch("%s.subnet_find_allocation_counts" % db_mod)
-        ) as (addr_find, subnet_find):
+        ) as (addr_find, reusable_find, subnet_find):
             addr_find.side_effect = addresses
-            subnet_find.side_effect = subnets
+            reusable_find.return_value = reusable or []
+            subnet_find.return_value = subnets or []
             yield
 
     def test_allocate_new_ip_address_two_empty_subnets(self):
@@ -502,8 +662,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
                        cidr="feed::/104", ip_version=6,
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
-        with self._stubs(subnets=[[(subnet4, 0)], [(subnet6, 0)]],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[(subnet4, 0), (subnet6, 0)],
+                         addresses=[None, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 1)
             self.assertEqual(address[1]["address"], 0)
@@ -513,8 +673,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
                        cidr="0.0.0.0/24", ip_version=4,
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
-        with self._stubs(subnets=[[(subnet4, 0)], []],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[(subnet4, 0)],
+                         addresses=[None, None]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(self.context, 0, 0, 0)
 
@@ -523,14 +683,14 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
                        cidr="feed::/104", ip_version=6,
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
-        with self._stubs(subnets=[[], [(subnet6, 0)]],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[(subnet6, 0)],
+                         addresses=[None, None]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(self.context, 0, 0, 0)
 
     def test_allocate_new_ip_address_no_avail_subnets(self):
-        with self._stubs(subnets=[[], []],
-                         addresses=[None, None, None, None]):
+        with self._stubs(subnets=[],
+                         addresses=[None, None]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(self.context, 0, 0, 0)
 
@@ -543,8 +703,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 4
         address["subnet"] = models.Subnet(cidr="0.0.0.0/24")
-        with self._stubs(subnets=[[(subnet6, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet6, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
@@ -561,8 +721,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
         address["address"] = 4
         address["version"] = 6
         address["subnet"] = models.Subnet(cidr="::/120")
-        with self._stubs(subnets=[[(subnet4, 0)]],
-                         addresses=[address, None, None]):
+        with self._stubs(subnets=[(subnet4, 0)],
+                         reusable=[address]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
@@ -579,8 +739,8 @@ class QuarkIpamTestBothRequiredIpAllocation(QuarkIpamBaseTest):
         address2["address"] = 42
         address2["version"] = 6
         address2["subnet"] = models.Subnet(cidr="0::/120")
-        with self._stubs(subnets=[[]],
-                         addresses=[address1, address2]):
+        with self._stubs(subnets=[],
+                         reusable=[address1, address2]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(len(address), 2)
             self.assertEqual(address[0]["address"], 4)
@@ -641,9 +801,11 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
         db_mod = "quark.db.api"
         self.context.session.add = mock.Mock()
         with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
             mock.patch("%s.ip_address_find" % db_mod),
             mock.patch("%s.subnet_find_allocation_counts" % db_mod)
-        ) as (addr_find, subnet_find):
+        ) as (reuse_find, addr_find, subnet_find):
+            reuse_find.return_value = None
             addr_find.side_effect = addresses
             subnet_find.return_value = subnets
             yield
@@ -653,18 +815,31 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                       cidr="0.0.0.0/24", ip_version=4,
                       next_auto_assign_ip=0, network=dict(ip_policy=None),
                       ip_policy=None)
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     version=4)
             self.assertEqual(address[0]["address"], 1)  # 0 => 2
 
+    def test_allocate_never_probes_past_cidr(self):
+        addr = dict(id=1, address=3)
+        subnet = dict(id=1, first_ip=0, last_ip=3,
+                      cidr="0.0.0.0/30", ip_version=4,
+                      next_auto_assign_ip=1, network=dict(ip_policy=None),
+                      ip_policy=None)
+        # A full subnet whose counter says it's empty
+        with self._stubs(subnets=[(subnet, 0)],
+                         addresses=[addr, addr, addr]):
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                              version=4)
+
     def test_allocate_new_ip_in_partially_allocated_range(self):
         addr = dict(id=1, address=3)
         subnet = dict(id=1, first_ip=0, last_ip=255,
                       cidr="0.0.0.0/24", ip_version=4,
                       next_auto_assign_ip=2, network=dict(ip_policy=None),
                       ip_policy=None)
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, addr, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[addr, None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 3)
 
@@ -678,7 +853,7 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                        next_auto_assign_ip=256, network=dict(ip_policy=None),
                        ip_policy=None)
         subnets = [(subnet1, 1), (subnet2, 0)]
-        with self._stubs(subnets=subnets, addresses=[None, None]):
+        with self._stubs(subnets=subnets, addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 257)
             self.assertEqual(address[0]["subnet_id"], 2)
@@ -706,7 +881,7 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                        next_auto_assign_ip=0, network=dict(ip_policy=None),
                        ip_policy=None)
         subnets = [(subnet1, 1), (subnet2, 1)]
-        with self._stubs(subnets=subnets, addresses=[None, None]):
+        with self._stubs(subnets=subnets, addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertEqual(address[0]["address"], 1)  # 0 => 2
             self.assertEqual(address[0]["subnet_id"], 1)
@@ -717,7 +892,7 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                        network=dict(ip_policy=None),
                        ip_policy=None)
         subnets = [(subnet1, 1)]
-        with self._stubs(subnets=subnets, addresses=[None, None]):
+        with self._stubs(subnets=subnets, addresses=[None]):
             address = self.ipam.allocate_ip_address(
                 self.context, 0, 0, 0, ip_address="0.0.0.240")
             self.assertEqual(address[0]["address"], 240)
@@ -729,7 +904,7 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
                        network=dict(ip_policy=None),
                        ip_policy=None)
         subnets = [(subnet1, 1)]
-        with self._stubs(subnets=subnets, addresses=[None, True]):
+        with self._stubs(subnets=subnets, addresses=[True]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(
                     self.context, 0, 0, 0, ip_address="0.0.0.240")
@@ -738,26 +913,624 @@ class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
         subnet1 = dict(id=1, first_ip=0, last_ip=255,
                        cidr="0.0.1.0/24", ip_version=4)
         subnets = [(subnet1, 1)]
-        with self._stubs(subnets=subnets, addresses=[None, None]):
+        with self._stubs(subnets=subnets, addresses=[None]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(
                     self.context, 0, 0, 0, ip_address="0.0.0.240")
 
 
+def _fake_free_range_find(free_ranges):
+    """Mimics subnet_free_range_find over a list of free ranges."""
+    def _range_find(context, subnet_id=None, containing=None, after=None,
+                    scope=None, **kwargs):
+        found = sorted(free_ranges(subnet_id),
+                       key=lambda r: r["first_ip"])
+        if containing is not None:
+            found = [r for r in found
+                     if r["first_ip"] <= containing <= r["last_ip"]]
+        if after is not None:
+            found = [r for r in found if r["first_ip"] > after]
+        if scope == "one":
+            return found and found[0] or None
+        return found
+    return _range_find
+
+
+class QuarkIpamFreeRangeAllocation(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, subnets=None, free_ranges=None, addresses=None):
+        if not addresses:
+            addresses = [None]
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
+            mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("%s.subnet_free_range_find" % db_mod),
+            mock.patch("%s.subnet_free_range_update" % db_mod),
+            mock.patch("%s.subnet_free_range_create" % db_mod),
+            mock.patch("%s.subnet_free_range_delete" % db_mod)
+        ) as (reuse_find, addr_find, subnet_find, range_find, range_update,
+              range_create, range_delete):
+            reuse_find.return_value = None
+            addr_find.side_effect = addresses
+            subnet_find.return_value = subnets
+            range_find.side_effect = _fake_free_range_find(
+                lambda subnet_id: free_ranges or [])
+            yield addr_find, range_update, range_create, range_delete
+
+    def _subnet(self, **kwargs):
+        subnet = dict(id=1, first_ip=0, last_ip=255,
+                      cidr="0.0.0.0/24", ip_version=4,
+                      next_auto_assign_ip=0, network=dict(ip_policy=None),
+                      ip_policy=None, free_ranges_indexed=True)
+        subnet.update(kwargs)
+        return subnet
+
+    def test_allocate_splits_range_around_network_address(self):
+        free_range = dict(subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs(subnets=[(self._subnet(), 0)],
+                         free_ranges=[free_range]) as (addr_find, update,
+                                                      create, delete):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 1)
+            update.assert_called_once_with(self.context, free_range,
+                                           last_ip=0)
+            create.assert_called_once_with(self.context, subnet_id=1,
+                                           first_ip=2, last_ip=255)
+            self.assertFalse(delete.called)
+
+    def test_allocate_does_not_probe_addresses(self):
+        free_range = dict(subnet_id=1, first_ip=2, last_ip=255)
+        with self._stubs(subnets=[(self._subnet(), 2)],
+                         free_ranges=[free_range]) as (addr_find, update,
+                                                      create, delete):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 2)
+            # No per-candidate probing
+            self.assertFalse(addr_find.called)
+            update.assert_called_once_with(self.context, free_range,
+                                           first_ip=3)
+            self.assertFalse(create.called)
+
+    def test_allocate_skips_policy_excluded_range(self):
+        excluded = dict(subnet_id=1, first_ip=0, last_ip=0)
+        single = dict(subnet_id=1, first_ip=5, last_ip=5)
+        with self._stubs(subnets=[(self._subnet(), 0)],
+                         free_ranges=[single, excluded]) as (addr_find,
+                                                             update,
+                                                             create,
+                                                             delete):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 5)
+            delete.assert_called_once_with(self.context, single)
+            self.assertFalse(update.called)
+
+    def test_allocate_locks_one_range_at_a_time(self):
+        excluded = dict(subnet_id=1, first_ip=0, last_ip=0)
+        free_range = dict(subnet_id=1, first_ip=5, last_ip=255)
+        with self._stubs(subnets=[(self._subnet(), 0)],
+                         free_ranges=[free_range, excluded]):
+            self.ipam.allocate_ip_address(self.context, 0, 0, 0, version=4)
+            range_find = quark.ipam.db_api.subnet_free_range_find
+            self.assertEqual(
+                [(kwargs["after"], kwargs["scope"], kwargs["lock_mode"])
+                 for args, kwargs in range_find.call_args_list],
+                [(None, "one", True), (0, "one", True)])
+
+    def test_allocate_honors_ip_policy(self):
+        subnet = self._subnet(ip_policy=dict(exclude=[
+            models.IPPolicyCIDR(cidr="0.0.0.0/30")]))
+        free_range = dict(subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs(subnets=[(subnet, 0)],
+                         free_ranges=[free_range]):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 4)
+
+    def test_allocate_only_excluded_addresses_left_fails(self):
+        free_range = dict(subnet_id=1, first_ip=255, last_ip=255)
+        with self._stubs(subnets=[(self._subnet(), 0)],
+                         free_ranges=[free_range]):
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                              version=4)
+
+    def test_allocate_specific_ip_claims_from_range(self):
+        free_range = dict(subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs(subnets=[(self._subnet(), 0)],
+                         free_ranges=[free_range],
+                         addresses=[None]) as (addr_find, update,
+                                                     create, delete):
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, 0, 0, ip_address="0.0.0.240")
+            self.assertEqual(address[0]["address"], 240)
+            update.assert_called_once_with(self.context, free_range,
+                                           last_ip=239)
+            create.assert_called_once_with(self.context, subnet_id=1,
+                                           first_ip=241, last_ip=255)
+
+
+class QuarkIpamBulkAllocation(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, subnets, free_ranges=None, deallocated=None):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("%s.subnet_free_range_find" % db_mod),
+            mock.patch("%s.subnet_free_range_update" % db_mod),
+            mock.patch("%s.subnet_free_range_create" % db_mod),
+            mock.patch("%s.subnet_free_range_delete" % db_mod)
+        ) as (reuse_find, subnet_find, range_find, range_update,
+              range_create, range_delete):
+            deallocated = deallocated or {}
+
+            def _reuse_find(context, **kwargs):
+                query = mock.MagicMock()
+                found = deallocated.get(tuple(kwargs["version"]), [])
+                query.limit.return_value.all.return_value = found
+                return query
+
+            def _subnet_find(context, net_id, **kwargs):
+                return subnets.get(kwargs.get("ip_version"), [])
+
+            reuse_find.side_effect = _reuse_find
+            subnet_find.side_effect = _subnet_find
+            range_find.side_effect = _fake_free_range_find(
+                lambda subnet_id: (free_ranges or {}).get(subnet_id, []))
+            yield reuse_find, range_update, range_create, range_delete
+
+    def _subnet(self, **kwargs):
+        subnet = dict(id=1, cidr="0.0.0.0/24", ip_version=4,
+                      next_auto_assign_ip=0, network=dict(ip_policy=None),
+                      ip_policy=None, free_ranges_indexed=True)
+        subnet.update(kwargs)
+        return subnet
+
+    def _v6_subnet(self, **kwargs):
+        return self._subnet(id=2, cidr="feed::/64", ip_version=6, **kwargs)
+
+    def _deallocated(self, address, subnet_cidr="0.0.0.0/24", version=4):
+        ip_address = models.IPAddress(address=address, subnet_id=1,
+                                      version=version, _deallocated=1)
+        ip_address["subnet"] = models.Subnet(id=1, cidr=subnet_cidr)
+        return ip_address
+
+    def test_bulk_any_takes_consecutive_addresses_from_one_range(self):
+        free_range = dict(subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs({None: [(self._subnet(), 0)]},
+                         free_ranges={1: [free_range]}) as (
+                reuse_find, update, create, delete):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 3, 0)
+            self.assertEqual([[a["address"] for a in port]
+                              for port in allocated], [[1], [2], [3]])
+            update.assert_called_once_with(self.context, free_range,
+                                           first_ip=0, last_ip=0)
+            create.assert_called_once_with(self.context, subnet_id=1,
+                                           first_ip=4, last_ip=255)
+            self.assertEqual(reuse_find.call_count, 1)
+
+    def test_bulk_any_reallocates_before_generating(self):
+        free_range = dict(subnet_id=1, first_ip=1, last_ip=255)
+        old = self._deallocated(10)
+        with self._stubs({None: [(self._subnet(), 10)]},
+                         free_ranges={1: [free_range]},
+                         deallocated={(4, 6): [old]}):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 2, 0)
+            self.assertEqual(allocated[0], [old])
+            self.assertFalse(old["deallocated"])
+            self.assertEqual(allocated[1][0]["address"], 1)
+
+    def test_bulk_skips_reallocated_address_outside_cidr(self):
+        free_range = dict(subnet_id=1, first_ip=1, last_ip=255)
+        bad = self._deallocated(1024)
+        with self._stubs({None: [(self._subnet(), 0)]},
+                         free_ranges={1: [free_range]},
+                         deallocated={(4, 6): [bad]}):
+            self.context.session.delete = mock.Mock()
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 1, 0)
+            self.context.session.delete.assert_called_once_with(bad)
+            self.assertEqual(allocated[0][0]["address"], 1)
+
+    def test_bulk_spills_into_next_subnet(self):
+        subnet1 = self._subnet(cidr="0.0.0.0/30")
+        subnet2 = self._subnet(id=2, cidr="0.0.0.4/30")
+        with self._stubs({None: [(subnet1, 0), (subnet2, 0)]},
+                         free_ranges={
+                             1: [dict(subnet_id=1, first_ip=0, last_ip=3)],
+                             2: [dict(subnet_id=2, first_ip=4,
+                                      last_ip=7)]}):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 4, 0)
+            self.assertEqual([port[0]["address"] for port in allocated],
+                             [1, 2, 5, 6])
+
+    def test_bulk_any_not_enough_addresses_fails(self):
+        subnet = self._subnet(cidr="0.0.0.0/30")
+        with self._stubs({None: [(subnet, 0)]},
+                         free_ranges={1: [dict(subnet_id=1, first_ip=0,
+                                               last_ip=3)]}):
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_addresses_bulk(self.context, 0, 3, 0)
+
+    def test_bulk_both_returns_one_address_per_version(self):
+        self.ipam = quark.ipam.QuarkIpamBOTH()
+        v6_first = int(netaddr.IPAddress("feed::"))
+        with self._stubs({4: [(self._subnet(), 0)],
+                          6: [(self._v6_subnet(), 0)]},
+                         free_ranges={
+                             1: [dict(subnet_id=1, first_ip=0, last_ip=255)],
+                             2: [dict(subnet_id=2, first_ip=v6_first,
+                                      last_ip=v6_first + 255)]}):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 2, 0)
+            self.assertEqual([[a["version"] for a in port]
+                              for port in allocated], [[4, 6], [4, 6]])
+            self.assertEqual(allocated[1][1]["address"], v6_first + 2)
+
+    def test_bulk_both_tolerates_missing_version(self):
+        self.ipam = quark.ipam.QuarkIpamBOTH()
+        with self._stubs({4: [(self._subnet(), 0)]},
+                         free_ranges={1: [dict(subnet_id=1, first_ip=0,
+                                               last_ip=255)]}):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 2, 0)
+            self.assertEqual([len(port) for port in allocated], [1, 1])
+
+    def test_bulk_both_required_missing_version_fails(self):
+        self.ipam = quark.ipam.QuarkIpamBOTHREQ()
+        with self._stubs({4: [(self._subnet(), 0)]},
+                         free_ranges={1: [dict(subnet_id=1, first_ip=0,
+                                               last_ip=255)]}):
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_addresses_bulk(self.context, 0, 2, 0)
+
+    def test_bulk_honors_ip_policy(self):
+        subnet = self._subnet(ip_policy=dict(exclude=[
+            models.IPPolicyCIDR(cidr="0.0.0.0/30")]))
+        with self._stubs({None: [(subnet, 0)]},
+                         free_ranges={1: [dict(subnet_id=1, first_ip=0,
+                                               last_ip=255)]}):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 2, 0)
+            self.assertEqual([port[0]["address"] for port in allocated],
+                             [4, 5])
+
+    def test_bulk_segment_without_subnets_fails(self):
+        with mock.patch("quark.db.api.subnet_find") as subnet_find:
+            subnet_find.return_value = []
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_addresses_bulk(self.context, 0, 2, 0,
+                                                     segment_id="seg")
+
+
+class QuarkIpamOptimisticAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamOptimisticAllocation, self).setUp()
+        self.ipam = quark.ipam.QuarkIpamANYOptimistic()
+        self.context.session.begin_nested = self.context.session.begin
+
+    @contextlib.contextmanager
+    def _stubs(self, free_ranges, taken=None, created=None, counts=0):
+        subnet = dict(id=1, first_ip=0, last_ip=255, cidr="0.0.0.0/24",
+                      ip_version=4, network=dict(ip_policy=None),
+                      ip_policy=None, free_ranges_indexed=True,
+                      generated_count=counts, allocated_count=counts)
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
+            mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("%s.subnet_free_range_find" % db_mod),
+            mock.patch("%s.subnet_free_range_take" % db_mod),
+            mock.patch("%s.ip_address_claim" % db_mod),
+            mock.patch("%s.ip_address_create" % db_mod)
+        ) as (reuse_find, addr_find, subnet_find, range_find, range_take,
+              addr_claim, addr_create):
+            reuse_find.return_value = None
+            addr_find.return_value = None
+            subnet_find.return_value = [(subnet, 0)]
+            # Every attempt reads the next snapshot of the index
+            snapshots = list(free_ranges)
+            range_find.side_effect = _fake_free_range_find(
+                lambda subnet_id: snapshots[0])
+            taken = iter(taken or [True] * len(free_ranges))
+
+            def _take(*args):
+                if len(snapshots) > 1:
+                    snapshots.pop(0)
+                return next(taken)
+            range_take.side_effect = _take
+
+            def _create(context, **address_dict):
+                address = models.IPAddress()
+                address.update(address_dict)
+                address["address"] = int(address_dict["address"])
+                return address
+            addr_claim.side_effect = created or _create
+            addr_create.side_effect = _create
+            self.addr_create = addr_create
+            yield subnet_find, range_take, addr_claim
+
+    def test_allocate_does_not_lock_subnets(self):
+        free_range = dict(id="r", subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs([[free_range]]) as (subnet_find, take, create):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 1)
+            self.assertFalse(subnet_find.call_args[1]["lock_mode"])
+            take.assert_called_once_with(self.context, 1, "r", 0, 255, 1)
+
+    def test_allocate_leaves_subnet_row_alone(self):
+        free_range = dict(id="r", subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs([[free_range]]) as (subnet_find, take, claim):
+            self.ipam.allocate_ip_address(self.context, 0, 0, 0, version=4)
+            self.assertEqual(claim.call_count, 1)
+            self.assertFalse(self.addr_create.called)
+
+    def test_allocate_seeds_uninitialized_counters(self):
+        free_range = dict(id="r", subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs([[free_range]], counts=None) as (subnet_find, take,
+                                                          claim):
+            self.ipam.allocate_ip_address(self.context, 0, 0, 0, version=4)
+            self.assertFalse(claim.called)
+            self.assertEqual(self.addr_create.call_count, 1)
+
+    def test_allocate_retries_after_losing_range(self):
+        stale = dict(id="r", subnet_id=1, first_ip=2, last_ip=255)
+        fresh = dict(id="r", subnet_id=1, first_ip=3, last_ip=255)
+        with self._stubs([[stale], [fresh]],
+                         taken=[False, True]) as (subnet_find, take, create):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 3)
+            self.assertEqual(take.call_count, 2)
+            self.assertEqual(create.call_count, 1)
+
+    def test_allocate_drops_taken_address_from_index(self):
+        stale = dict(id="r", subnet_id=1, first_ip=2, last_ip=255)
+        fresh = dict(id="r", subnet_id=1, first_ip=3, last_ip=255)
+        created = [db_exc.DBDuplicateEntry(), models.IPAddress(address=3)]
+        with self._stubs([[stale], [fresh]], taken=[True, True, True],
+                         created=created) as (subnet_find, take, create):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 3)
+            self.assertEqual(take.call_args_list[1],
+                             mock.call(self.context, 1, "r", 2, 255, 2))
+
+    def test_allocate_gives_up_after_retries(self):
+        free_range = dict(id="r", subnet_id=1, first_ip=2, last_ip=255)
+        retries = cfg.CONF.QUARK.ipam_optimistic_retries
+        with self._stubs([[free_range]] * retries,
+                         taken=[False] * retries) as (subnet_find, take,
+                                                      create):
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                              version=4)
+            self.assertEqual(take.call_count, retries)
+            self.assertFalse(create.called)
+
+    def test_strategies_are_registered(self):
+        for name in ("ANY_OPTIMISTIC", "BOTH_OPTIMISTIC",
+                     "BOTH_REQUIRED_OPTIMISTIC", "ANY_SHARDED",
+                     "BOTH_SHARDED", "BOTH_REQUIRED_SHARDED"):
+            strategy = quark.ipam.IPAM_REGISTRY.get_strategy(name)
+            self.assertFalse(strategy.lock_subnets)
+            self.assertEqual(strategy.get_name(), name)
+
+
+class QuarkIpamShardedAllocation(QuarkIpamOptimisticAllocation):
+    """Runs the optimistic tests again with every claim in the first shard."""
+    def setUp(self):
+        super(QuarkIpamShardedAllocation, self).setUp()
+        self.ipam = quark.ipam.QuarkIpamANYSharded()
+        patcher = mock.patch("quark.ipam.random.randrange", return_value=0)
+        self.randrange = patcher.start()
+        self.addCleanup(patcher.stop)
+        cfg.CONF.set_override("ipam_cursor_shards", 4, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "ipam_cursor_shards",
+                        "QUARK")
+
+    def test_allocate_starts_at_random_shard(self):
+        self.randrange.return_value = 2
+        free_range = dict(id="r", subnet_id=1, first_ip=0, last_ip=255)
+        with self._stubs([[free_range]]) as (subnet_find, take, create):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 128)
+            self.randrange.assert_called_once_with(4)
+            take.assert_called_once_with(self.context, 1, "r", 0, 255, 128)
+
+    def test_allocate_takes_next_free_range_past_shard(self):
+        self.randrange.return_value = 1
+        ranges = [dict(id="low", subnet_id=1, first_ip=0, last_ip=10),
+                  dict(id="high", subnet_id=1, first_ip=200, last_ip=255)]
+        with self._stubs([ranges]) as (subnet_find, take, create):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 200)
+
+    def test_allocate_scans_whole_subnet_once_shard_is_exhausted(self):
+        self.randrange.return_value = 3
+        free_range = dict(id="r", subnet_id=1, first_ip=0, last_ip=10)
+        with self._stubs([[free_range]]) as (subnet_find, take, create):
+            address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
+                                                    version=4)
+            self.assertEqual(address[0]["address"], 1)
+
+
+class QuarkIpamEUI64Allocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamEUI64Allocation, self).setUp()
+        self.ipam = quark.ipam.QuarkIpamANYEUI64()
+        self.cidr = netaddr.IPNetwork("2001:db8::/64")
+
+    @contextlib.contextmanager
+    def _stubs(self, addresses=None):
+        subnet = dict(id=1, cidr=str(self.cidr), ip_version=6,
+                      next_auto_assign_ip=self.cidr.first + 1,
+                      network=dict(ip_policy=None), ip_policy=None)
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
+            mock.patch("%s.ip_address_find" % db_mod),
+            mock.patch("%s.subnet_find_allocation_counts" % db_mod),
+            mock.patch("%s.ip_address_create" % db_mod),
+            mock.patch("%s.ip_address_create_bulk" % db_mod)
+        ) as (reuse_find, addr_find, subnet_find, addr_create,
+              addr_create_bulk):
+            reuse_find.return_value = None
+            addr_find.side_effect = addresses or [None]
+            subnet_find.return_value = [(subnet, 0)]
+
+            def _create(context, **address_dict):
+                address = models.IPAddress()
+                address.update(address_dict)
+                address["address"] = int(address_dict["address"])
+                return address
+            addr_create.side_effect = _create
+            addr_create_bulk.side_effect = lambda context, dicts: [
+                _create(context, **address_dict) for address_dict in dicts]
+            yield subnet, addr_find
+
+    def test_allocate_derives_address_from_mac(self):
+        with self._stubs() as (subnet, addr_find):
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, "port", 0, mac_address=0x00163e334455)
+            self.assertEqual(
+                address[0]["address"],
+                int(netaddr.IPAddress("2001:db8::216:3eff:fe33:4455")))
+            self.assertEqual(addr_find.call_count, 1)
+            self.assertEqual(subnet["next_auto_assign_ip"],
+                             self.cidr.first + 1)
+
+    def test_allocate_derives_address_from_port_id_without_mac(self):
+        with self._stubs() as (subnet, addr_find):
+            first = self.ipam.allocate_ip_address(self.context, 0, "port",
+                                                  0)
+            second = self.ipam.allocate_ip_address(self.context, 0, "port",
+                                                   0)
+            self.assertEqual(first[0]["address"], second[0]["address"])
+            self.assertNotEqual(first[0]["address"], self.cidr.first + 1)
+            self.assertIn(netaddr.IPAddress(first[0]["address"]), self.cidr)
+
+    def test_allocate_probes_when_derived_address_is_taken(self):
+        with self._stubs(addresses=[dict(id=1), None]) as (subnet,
+                                                           addr_find):
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, "port", 0, mac_address=0x00163e334455)
+            self.assertEqual(address[0]["address"], self.cidr.first + 1)
+            self.assertEqual(subnet["next_auto_assign_ip"],
+                             self.cidr.first + 2)
+
+    def test_allocate_bulk_derives_addresses_from_macs(self):
+        with self._stubs(addresses=[None, dict(id=1), None]) as (subnet,
+                                                                 addr_find):
+            allocated = self.ipam.allocate_ip_addresses_bulk(
+                self.context, 0, 2, 0, port_ids=["port1", "port2"],
+                mac_addresses=[0x00163e334455, 0x00163e334466])
+            self.assertEqual(
+                allocated[0][0]["address"],
+                int(netaddr.IPAddress("2001:db8::216:3eff:fe33:4455")))
+            # The second port's derived address is taken, it gets a probe
+            self.assertEqual(allocated[1][0]["address"], self.cidr.first + 1)
+
+    def test_explicit_address_is_not_derived(self):
+        requested = netaddr.IPAddress("2001:db8::5")
+        with self._stubs() as (subnet, addr_find):
+            address = self.ipam.allocate_ip_address(
+                self.context, 0, "port", 0, ip_address=requested,
+                mac_address=0x00163e334455)
+            self.assertEqual(address[0]["address"], int(requested))
+
+    def test_strategies_are_registered(self):
+        for name in ("ANY_EUI64", "BOTH_EUI64", "BOTH_REQUIRED_EUI64"):
+            strategy = quark.ipam.IPAM_REGISTRY.get_strategy(name)
+            self.assertIsInstance(strategy, quark.ipam.QuarkIpamEUI64)
+            self.assertEqual(strategy.get_name(), name)
+
+
+class QuarkIpamWarmPoolAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamWarmPoolAllocation, self).setUp()
+        self.ipam = quark.ipam.QuarkIpamBOTH()
+        cfg.CONF.set_override("ipam_warm_pool_sizes", {"net": "2"}, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "ipam_warm_pool_sizes",
+                        "QUARK")
+
+    @contextlib.contextmanager
+    def _stubs(self, reusable, pooled):
+        db_mod = "quark.db.api"
+        with contextlib.nested(
+            mock.patch("%s.ip_address_find_reusable" % db_mod),
+            mock.patch("%s.ip_address_pool_claim" % db_mod),
+            mock.patch("quark.ipam.QuarkIpamBOTH._choose_available_subnet")
+        ) as (find_reusable, pool_claim, choose_subnet):
+            find_reusable.return_value = reusable
+            pool_claim.side_effect = pooled
+            choose_subnet.return_value = []
+            yield pool_claim, choose_subnet
+
+    def _address(self, version):
+        cidr = netaddr.IPNetwork(version == 4 and "0.0.0.0/24" or "feed::/64")
+        return dict(id=version, version=version, address=cidr.first + 1,
+                    address_readable=str(cidr[1]), subnet_id=version,
+                    subnet=dict(id=version, cidr=str(cidr)),
+                    _deallocated=True, used_by_tenant_id=None, ports=[],
+                    created_at=None)
+
+    def test_claims_only_missing_versions(self):
+        v4, v6 = self._address(4), self._address(6)
+        with self._stubs([v4], [v6]) as (pool_claim, choose_subnet):
+            addresses = self.ipam.allocate_ip_address(self.context, "net",
+                                                      0, 0)
+            self.assertEqual(addresses, [v4, v6])
+            pool_claim.assert_called_once_with(
+                self.context, "net", cfg.CONF.QUARK.ipam_optimistic_retries,
+                version=6, segment_id=None)
+            self.assertFalse(choose_subnet.called)
+
+    def test_pool_miss_falls_back_to_subnets(self):
+        v6 = self._address(6)
+        with self._stubs([], [None, v6]) as (pool_claim, choose_subnet):
+            addresses = self.ipam.allocate_ip_address(self.context, "net",
+                                                      0, 0)
+            self.assertEqual(addresses, [v6])
+            self.assertEqual(pool_claim.call_count, 2)
+            self.assertEqual(choose_subnet.call_args[1]["reallocated_ips"],
+                             [v6])
+
+    def test_unpooled_network_skips_pool(self):
+        with self._stubs([], []) as (pool_claim, choose_subnet):
+            self.ipam.allocate_ip_address(self.context, "other", 0, 0)
+            self.assertFalse(pool_claim.called)
+            self.assertTrue(choose_subnet.called)
+
+
 class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, ip_find, subnet, address, addresses_found,
-               sub_found=True):
+               sub_found=True, reused=None):
         db_mod = "quark.db.api"
         with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
             mock.patch("%s.ip_address_find" % db_mod),
             mock.patch("%s.ip_address_update" % db_mod),
             mock.patch("quark.ipam.QuarkIpamANY._choose_available_subnet")
-        ) as (addr_find, addr_update, choose_subnet):
+        ) as (reuse_find, addr_find, addr_update, choose_subnet):
             if ip_find:
-                addr_find.return_value = address
+                reuse_find.return_value = address
             else:
                 address["id"] = None
+                reuse_find.side_effect = reused or [None]
                 addr_find.side_effect = addresses_found
                 addr_update.return_value = address
             choose_subnet.return_value = [subnet]
@@ -782,10 +1555,9 @@ class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
                       cidr="0.0.0.0/29")
         address = dict(id=1, address=254)
         address["subnet"] = subnet
-        addresses_found = [address, None]
         self.context.session.delete = mock.Mock()
-        with self._stubs(False, subnet, address, addresses_found,
-                         sub_found=False):
+        with self._stubs(False, subnet, address, [], sub_found=False,
+                         reused=[address, None]):
             addr = self.ipam.allocate_ip_address(self.context, 0, 0, 0)
             self.assertTrue(self.context.session.delete.called)
             self.assertEqual(len(addr), 0)
@@ -796,7 +1568,7 @@ class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
                       cidr="0.0.0.0/24", first_ip=0, last_ip=255,
                       ip_policy=None, network=dict(ip_policy=None))
         address = dict(id=1, address=0)
-        addresses_found = [None, address, None]
+        addresses_found = [address, None]
         with self._stubs(
             False, subnet, address, addresses_found
         ) as (choose_subnet):
@@ -811,7 +1583,7 @@ class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
                       cidr="0.0.0.0/24", first_ip=0, last_ip=255,
                       network=network_mod, ip_policy=None)
         address0 = dict(id=1, address=0)
-        addresses_found = [None, None]
+        addresses_found = [None]
         subnet_mod = models.Subnet()
         subnet_mod.update(subnet)
         with self._stubs(
@@ -831,9 +1603,11 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
         db_mod = "quark.db.api"
         self.context.session.add = mock.Mock()
         with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
             mock.patch("%s.ip_address_find" % db_mod),
             mock.patch("%s.subnet_find_allocation_counts" % db_mod)
-        ) as (addr_find, subnet_find):
+        ) as (reuse_find, addr_find, subnet_find):
+            reuse_find.return_value = None
             addr_find.side_effect = addresses
             subnet_find.return_value = subnets
             yield
@@ -844,7 +1618,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                       next_auto_assign_ip=3232235520,
                       network=dict(ip_policy=None),
                       ip_policy=None)
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     version=4)
             self.assertEqual(address[0]["address"], 3232235521)
@@ -855,7 +1629,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                       next_auto_assign_ip=0, network=dict(ip_policy=None),
                       ip_policy=dict(exclude=[
                           models.IPPolicyCIDR(cidr="0.0.0.0/24")]))
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam.allocate_ip_address(self.context, 0, 0, 0, version=4)
 
@@ -865,7 +1639,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                       next_auto_assign_ip=0, network=dict(ip_policy=None),
                       ip_policy=dict(exclude=[
                           models.IPPolicyCIDR(cidr="0.0.0.0/31")]))
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     version=4)
             self.assertEqual(address[0]["address"], 2)
@@ -877,7 +1651,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                       cidr="0.0.0.0/24", ip_version=4,
                       next_auto_assign_ip=0, network=net,
                       ip_policy=None)
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     version=4)
             self.assertEqual(address[0]["address"], 2)
@@ -890,7 +1664,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                       cidr="0.0.0.0/24", ip_version=4,
                       next_auto_assign_ip=0, network=net,
                       ip_policy=None)
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     version=4)
             self.assertEqual(address[0]["address"], 2)
@@ -903,7 +1677,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                       next_auto_assign_ip=0, network=net,
                       ip_policy=dict(exclude=[
                           models.IPPolicyCIDR(cidr="0.0.0.254/31")]))
-        with self._stubs(subnets=[(subnet, 0)], addresses=[None, None]):
+        with self._stubs(subnets=[(subnet, 0)], addresses=[None]):
             address = self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                                     version=4)
             self.assertEqual(address[0]["address"], 1)
@@ -915,7 +1689,7 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                        ip_policy=dict(exclude=[
                            models.IPPolicyCIDR(cidr="0.0.0.240/32")]))
         subnets = [(subnet1, 1)]
-        with self._stubs(subnets=subnets, addresses=[None, None]):
+        with self._stubs(subnets=subnets, addresses=[None]):
             address = self.ipam.allocate_ip_address(
                 self.context, 0, 0, 0, ip_address="0.0.0.240")
             self.assertEqual(address[0]["address"], 240)
@@ -932,12 +1706,15 @@ class QuarkIPAddressAllocationNotifications(QuarkIpamBaseTest):
         api_mod = "neutron.openstack.common.notifier.api"
         time_mod = "neutron.openstack.common.timeutils"
         with contextlib.nested(
+            mock.patch("%s.ip_address_reuse_find" % db_mod),
             mock.patch("%s.ip_address_find" % db_mod),
             mock.patch("%s.ip_address_create" % db_mod),
             mock.patch("%s.subnet_find_allocation_counts" % db_mod),
             mock.patch("%s.notify" % api_mod),
             mock.patch("%s.utcnow" % time_mod),
-        ) as (addr_find, addr_create, subnet_find, notify, time):
+        ) as (reuse_find, addr_find, addr_create, subnet_find, notify,
+              time):
+            reuse_find.return_value = None
             addr_find.side_effect = addresses
             addr_create.return_value = address
             subnet_find.return_value = subnets
@@ -954,7 +1731,7 @@ class QuarkIPAddressAllocationNotifications(QuarkIpamBaseTest):
         with self._stubs(
             address,
             subnets=[(subnet, 1)],
-            addresses=[None, None]
+            addresses=[None]
         ) as notify:
             self.ipam.allocate_ip_address(self.context, 0, 0, 0,
                                           version=4)
@@ -0,0 +1,134 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from neutron import context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common.notifier import api as notifier_api
+from oslo.config import cfg
+import unittest2
+
+from quark import notifications
+
+
+class TestNotify(unittest2.TestCase):
+    def setUp(self):
+        super(TestNotify, self).setUp()
+        cfg.CONF.set_override('connection', 'sqlite://', 'database')
+        neutron_db_api.configure_db()
+        self.context = context.Context('fake', 'fake', is_admin=False)
+        patcher = mock.patch("neutron.openstack.common.notifier.api.notify")
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        neutron_db_api.clear_db()
+        cfg.CONF.clear_override("notification_batching", "QUARK")
+
+    def test_notify_outside_transaction_sends_right_away(self):
+        notifications.notify(self.context, "ip_block.create", dict(a=1))
+        self.notify.assert_called_once_with(
+            self.context, notifier_api.publisher_id("network"),
+            "ip_block.create", notifier_api.CONF.default_notification_level,
+            dict(a=1))
+
+    def test_notify_waits_for_commit(self):
+        with self.context.session.begin():
+            with self.context.session.begin(subtransactions=True):
+                notifications.notify(self.context, "ip_block.create",
+                                     dict(a=1))
+            self.assertFalse(self.notify.called)
+        self.assertEqual(self.notify.call_count, 1)
+
+    def test_notify_dropped_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.context.session.begin():
+                notifications.notify(self.context, "ip_block.create",
+                                     dict(a=1))
+                raise ValueError()
+        with self.context.session.begin():
+            pass
+        self.assertFalse(self.notify.called)
+
+    def test_notify_waits_for_root_commit_past_savepoints(self):
+        with self.assertRaises(ValueError):
+            with self.context.session.begin():
+                notifications.notify(self.context, "ip_block.create",
+                                     dict(a=1))
+                with self.context.session.begin_nested():
+                    notifications.notify(self.context, "ip_block.create",
+                                         dict(a=2))
+                self.assertFalse(self.notify.called)
+                raise ValueError()
+        with self.context.session.begin():
+            pass
+        self.assertFalse(self.notify.called)
+
+    def test_notify_batching_queues_committed_events(self):
+        cfg.CONF.set_override("notification_batching", True, "QUARK")
+        with mock.patch("quark.notifications.get_queue") as get_queue:
+            with self.context.session.begin():
+                notifications.notify(self.context, "ip_block.create",
+                                     dict(a=1))
+            get_queue.return_value.put.assert_called_once_with(
+                "ip_block.create", dict(a=1))
+        self.assertFalse(self.notify.called)
+
+
+class TestNotificationQueue(unittest2.TestCase):
+    def setUp(self):
+        super(TestNotificationQueue, self).setUp()
+        patcher = mock.patch("quark.notifications._send")
+        self.send = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            "quark.notifications.NotificationQueue._ensure_worker")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_grouped_by_event_type(self):
+        queue = notifications.NotificationQueue(10, 10, 0)
+        queue.put("ip_block.address.create", dict(a=1))
+        queue.put("ip_block.address.delete", dict(a=2))
+        queue.put("ip_block.address.create", dict(a=3))
+        queue.flush()
+        self.assertEqual(
+            [c[0][1:] for c in self.send.call_args_list],
+            [("ip_block.address.create", dict(events=[dict(a=1),
+                                                      dict(a=3)])),
+             ("ip_block.address.delete", dict(events=[dict(a=2)]))])
+
+    def test_next_batch_bounded_by_batch_size(self):
+        queue = notifications.NotificationQueue(10, 2, 0.01)
+        for i in xrange(3):
+            queue.put("ip_block.create", dict(a=i))
+        self.assertEqual(len(queue._next_batch()), 2)
+        self.assertEqual(len(queue._next_batch()), 1)
+
+    def test_full_queue_drops_events(self):
+        queue = notifications.NotificationQueue(2, 10, 0)
+        for i in xrange(3):
+            queue.put("ip_block.create", dict(a=i))
+        self.assertEqual(queue.dropped, 1)
+        queue.flush()
+        self.assertEqual(self.send.call_args[0][2],
+                         dict(events=[dict(a=0), dict(a=1)]))
+
+    def test_failed_send_keeps_worker_alive(self):
+        self.send.side_effect = Exception()
+        queue = notifications.NotificationQueue(10, 10, 0)
+        queue.put("ip_block.create", dict(a=1))
+        queue.flush()
+        self.assertEqual(self.send.call_count, 1)
@@ -438,6 +438,32 @@ class TestNVPDriverCreatePort(TestNVPDriver):
                     allowed_pairs=[{'mac_address': '0:0:0:0:0:0',
                                     'ip_address': '192.168.0.1'}])
 
+    def test_create_ports_chooses_switch_once(self):
+        ports = [dict(port_id=port_id, security_groups=[1])
+                 for port_id in ("a", "b", "c")]
+        with self._stubs(net_details=dict(foo=3)) as connection:
+            connection.securityprofile = self._create_security_profile()
+            nvp_ports = self.driver.create_ports(self.context, self.net_id,
+                                                 ports)
+            self.assertEqual(len(nvp_ports), 3)
+            self.assertEqual(
+                connection.lswitch().query().results.call_count, 1)
+            # Shared by the ports asking for the same groups
+            self.assertEqual(
+                connection.securityprofile().query().results.call_count, 2)
+            self.assertEqual(connection.lswitch_port().create.call_count, 3)
+            connection.lswitch_port().attachment_vif.assert_has_calls(
+                [mock.call("a"), mock.call("b"), mock.call("c")])
+
+    def test_create_ports_capped_switches_choose_per_port(self):
+        ports = [dict(port_id="a"), dict(port_id="b")]
+        with self._stubs(net_details=dict(foo=3)) as connection:
+            self.driver.limits['max_ports_per_switch'] = self.max_spanning
+            self.driver.create_ports(self.context, self.net_id, ports)
+            self.assertEqual(
+                connection.lswitch().query().results.call_count, 2)
+            self.assertEqual(connection.lswitch_port().create.call_count, 2)
+
 
 class TestNVPDriverUpdatePort(TestNVPDriver):
     @contextlib.contextmanager
@@ -165,6 +165,58 @@ class TestOptimizedNVPDriverDeletePortSingleSwitch(TestOptimizedNVPDriver):
             self.assertFalse(connection.lswitch().delete.called)
 
 
+class TestOptimizedNVPDriverDeletePorts(TestOptimizedNVPDriver):
+    @contextlib.contextmanager
+    def _stubs(self, port_count=2, switch_count=2):
+        with contextlib.nested(
+            mock.patch("%s.get_connection" % self.d_pkg),
+            mock.patch("%s._lports_select_by_ids" % self.d_pkg),
+            mock.patch("%s._lswitch_select_by_nvp_id" % self.d_pkg),
+            mock.patch("%s._lswitches_for_network" % self.d_pkg),
+            mock.patch("%s._lswitch_from_port" % self.d_pkg),
+        ) as (get_connection, select_ports, select_switch, switches,
+              from_port):
+            connection = self._create_connection()
+            switch = self._create_lswitch_mock()
+            switch.port_count = port_count
+            lports = [mock.Mock(port_id="port%d" % i, switch=switch)
+                      for i in xrange(2)]
+            get_connection.return_value = connection
+            select_ports.return_value = lports
+            select_switch.return_value = switch
+            switches.return_value = [switch] * switch_count
+            self.context.session.delete = mock.Mock(return_value=None)
+            yield (connection, switch, switches, from_port,
+                   self.context.session.delete)
+
+    def test_delete_ports_updates_switch_once(self):
+        with self._stubs(port_count=3) as (connection, switch, switches,
+                                           from_port, context_delete):
+            self.driver.delete_ports(self.context, ["port0", "port1"])
+            self.assertEqual(switch.port_count, 1)
+            self.assertEqual(2, connection.lswitch_port().delete.call_count)
+            self.assertEqual(2, context_delete.call_count)
+            self.assertFalse(switches.called)
+            self.assertFalse(from_port.called)
+
+    def test_delete_ports_empties_switch(self):
+        with self._stubs() as (connection, switch, switches, from_port,
+                               context_delete):
+            self.driver.delete_ports(self.context, ["port0", "port1"])
+            self.assertEqual(switch.port_count, 0)
+            self.assertEqual(1, switches.call_count)
+            self.assertTrue(connection.lswitch().delete.called)
+            self.assertEqual(3, context_delete.call_count)
+
+    def test_delete_ports_looks_up_unknown_ports(self):
+        with self._stubs(port_count=3) as (connection, switch, switches,
+                                           from_port, context_delete):
+            self.driver.delete_ports(self.context,
+                                     ["port0", "port1", "other"])
+            from_port.assert_called_once_with(self.context, "other")
+            self.assertEqual(3, connection.lswitch_port().delete.call_count)
+
+
 class TestOptimizedNVPDriverCreatePort(TestOptimizedNVPDriver):
     '''In no case should the optimized driver query for an lswitch.'''
     @contextlib.contextmanager
@@ -304,6 +356,18 @@ class TestOptimizedNVPDriverCreatePort(TestOptimizedNVPDriver):
                 admin_status_enabled.call_args
             self.assertTrue(False in status_args)
 
+    def test_create_ports_records_every_port(self):
+        with self._stubs() as (connection, create_opt):
+            self.driver.create_ports(self.context, self.net_id,
+                                     [dict(port_id="a"), dict(port_id="b")])
+            self.assertEqual(connection.lswitch_port().create.call_count, 2)
+            lports = [args[0] for args, kwargs
+                      in self.context.session.add.call_args_list
+                      if isinstance(args[0],
+                                    quark.drivers.optimized_nvp_driver.
+                                    LSwitchPort)]
+            self.assertEqual(len(lports), 2)
+
 
 class TestOptimizedNVPDriverUpdatePort(TestOptimizedNVPDriver):
     def test_update_port(self):
@@ -55,6 +55,12 @@ class TestUnmanagedDriver(test_base.TestBase):
         self.driver.create_port(context=self.context,
                                 network_id="public_network", port_id=2)
 
+    def test_create_ports(self):
+        backend = self.driver.create_ports(
+            context=self.context, network_id="public_network",
+            ports=[dict(port_id=2), dict(port_id=3)])
+        self.assertEqual([p["uuid"] for p in backend], [2, 3])
+
     def test_update_port(self):
         self.driver.update_port(context=self.context,
                                 network_id="public_network", port_id=2)
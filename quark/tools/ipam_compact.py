@@ -0,0 +1,97 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Moves long deallocated IP and MAC addresses into the archive tables, and
+folds the counter deltas recorded by optimistic IP claims into their subnets.
+
+Meant to be run periodically. Each batch is its own transaction, so the
+live tables are only ever locked for a bounded number of rows at a time.
+"""
+
+import datetime
+import sys
+
+from neutron.common import config as neutron_cfg
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark.db import models
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+compact_opts = [
+    cfg.IntOpt("archive_after", default=30 * 24 * 60 * 60,
+               help=_("Seconds an address stays deallocated before it is "
+                      "moved to the archive")),
+    cfg.IntOpt("batch_size", default=500,
+               help=_("Addresses moved per transaction"))
+]
+
+CONF.register_cli_opts(compact_opts)
+
+
+def compact(context, archive, deallocated_before, batch_size):
+    """Archives in batches until one comes up short, returns the total."""
+    total = 0
+    moved = batch_size
+    while moved == batch_size:
+        with context.session.begin():
+            moved = archive(context, deallocated_before, batch_size)
+        total += moved
+    return total
+
+
+def fold_ip_counts(context):
+    """Folds pending counter deltas, one subnet per transaction."""
+    total = 0
+    for subnet_id in db_api.subnet_ip_count_deltas_subnet_ids(context):
+        with context.session.begin():
+            total += db_api.subnet_ip_count_deltas_fold(context, subnet_id)
+    return total
+
+
+def compact_all(context, archive_after, batch_size):
+    if archive_after < CONF.QUARK.ipam_reuse_after:
+        LOG.warn("Archiving addresses before they may be reused, they will "
+                 "be handed out again as newly generated addresses")
+    deallocated_before = (timeutils.utcnow() -
+                          datetime.timedelta(seconds=archive_after))
+    moved = compact(context, db_api.ip_address_archive, deallocated_before,
+                    batch_size)
+    LOG.info("Archived %d IP addresses" % moved)
+    moved = compact(context, db_api.mac_address_archive, deallocated_before,
+                    batch_size)
+    LOG.info("Archived %d MAC addresses" % moved)
+    folded = fold_ip_counts(context)
+    LOG.info("Folded %d subnet counter deltas" % folded)
+
+
+def main():
+    neutron_cfg.init(sys.argv[1:])
+    neutron_cfg.setup_logging(neutron_cfg.cfg.CONF)
+    neutron_db_api.configure_db()
+    neutron_db_api.register_models(base=models.BASEV2)
+    compact_all(neutron_context.get_admin_context(), CONF.archive_after,
+                CONF.batch_size)
+
+
+if __name__ == "__main__":
+    main()
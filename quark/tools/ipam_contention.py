@@ -0,0 +1,141 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures IP allocation throughput of IPAM strategies under contention.
+
+Each strategy gets a fresh network with a single subnet, then a number of
+worker threads allocate addresses on it concurrently, one transaction per
+address. Run it against the database of a test deployment, sqlite
+serializes every writer and shows no contention at all.
+"""
+
+import sys
+import threading
+import time
+
+import netaddr
+from neutron.common import config as neutron_cfg
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark.db import models
+from quark import ipam
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+contention_opts = [
+    cfg.ListOpt("strategies",
+                default=["ANY", "ANY_OPTIMISTIC", "ANY_SHARDED"],
+                help=_("IPAM strategies to compare")),
+    cfg.IntOpt("workers", default=8,
+               help=_("Threads allocating concurrently")),
+    cfg.IntOpt("allocations", default=100,
+               help=_("Addresses each worker allocates")),
+    cfg.StrOpt("cidr", default="10.0.0.0/16",
+               help=_("CIDR of the subnet addresses are allocated from"))
+]
+
+CONF.register_cli_opts(contention_opts)
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+def _allocate(strategy, net_id, count, results):
+    context = neutron_context.get_admin_context()
+    latencies = []
+    failures = 0
+    for i in xrange(count):
+        start = time.time()
+        try:
+            with context.session.begin():
+                strategy.allocate_ip_address(context, net_id, None,
+                                             CONF.QUARK.ipam_reuse_after)
+        except Exception as e:
+            LOG.debug("Allocation failed: %s" % e)
+            failures += 1
+            continue
+        latencies.append(time.time() - start)
+    results.append((latencies, failures))
+
+
+def run_strategy(context, strategy_name):
+    strategy = ipam.IPAM_REGISTRY.get_strategy(strategy_name)
+    cidr = netaddr.IPNetwork(CONF.cidr)
+    with context.session.begin():
+        net = db_api.network_create(context, name="ipam-contention",
+                                    network_plugin="BASE",
+                                    ipam_strategy=strategy_name)
+        subnet = db_api.subnet_create(context, network=net, cidr=str(cidr),
+                                      ip_version=cidr.version)
+
+    results = []
+    workers = [threading.Thread(target=_allocate,
+                                args=(strategy, net["id"], CONF.allocations,
+                                      results))
+               for i in xrange(CONF.workers)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    with context.session.begin():
+        db_api.subnet_delete(context, subnet)
+        db_api.network_delete(context, net)
+
+    latencies = []
+    failures = 0
+    for worker_latencies, worker_failures in results:
+        latencies.extend(worker_latencies)
+        failures += worker_failures
+    return dict(strategy=strategy_name,
+                allocations=len(latencies),
+                failures=failures,
+                per_second=len(latencies) / elapsed,
+                p50=_percentile(latencies, 50),
+                p99=_percentile(latencies, 99))
+
+
+def main():
+    neutron_cfg.init(sys.argv[1:])
+    neutron_cfg.setup_logging(neutron_cfg.cfg.CONF)
+    neutron_db_api.configure_db()
+    neutron_db_api.register_models(base=models.BASEV2)
+    context = neutron_context.get_admin_context()
+
+    print("%-24s %8s %8s %10s %10s %10s" % ("strategy", "allocs", "failed",
+                                            "allocs/s", "p50 ms",
+                                            "p99 ms"))
+    for strategy_name in CONF.strategies:
+        result = run_strategy(context, strategy_name)
+        print("%-24s %8d %8d %10.1f %10.1f %10.1f" % (
+            result["strategy"], result["allocations"], result["failures"],
+            result["per_second"], result["p50"] * 1000,
+            result["p99"] * 1000))
+
+
+if __name__ == "__main__":
+    main()
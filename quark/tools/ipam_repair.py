@@ -0,0 +1,69 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Rebuilds the denormalized IPAM state from the address tables.
+"""
+
+import sys
+
+from neutron.common import config as neutron_cfg
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common import log as logging
+
+from quark.db import api as db_api
+from quark.db import models
+
+LOG = logging.getLogger(__name__)
+
+
+def repair_subnet(context, subnet):
+    LOG.info("Rebuilding free range index for subnet %s" % subnet["id"])
+    db_api.subnet_free_ranges_rebuild(context, subnet)
+    LOG.info("Recomputing address counters for subnet %s" % subnet["id"])
+    db_api.subnet_ip_counts_rebuild(context, subnet)
+    LOG.info("Queueing deallocated addresses of subnet %s for reuse" %
+             subnet["id"])
+    db_api.ip_address_reuse_queue_rebuild(context, subnet)
+
+
+def repair_mac_address_range(context, mac_address_range):
+    LOG.info("Rebuilding free block index for MAC address range %s" %
+             mac_address_range["id"])
+    db_api.mac_address_range_rebuild(context, mac_address_range)
+
+
+def repair_all(context):
+    subnets = db_api.subnet_find(context, scope=db_api.ALL) or []
+    for subnet in subnets:
+        with context.session.begin(subtransactions=True):
+            repair_subnet(context, subnet)
+    ranges = db_api.mac_address_range_find(context, scope=db_api.ALL) or []
+    for mac_address_range in ranges:
+        with context.session.begin(subtransactions=True):
+            repair_mac_address_range(context, mac_address_range)
+
+
+def main():
+    neutron_cfg.init(sys.argv[1:])
+    neutron_cfg.setup_logging(neutron_cfg.cfg.CONF)
+    neutron_db_api.configure_db()
+    neutron_db_api.register_models(base=models.BASEV2)
+    repair_all(neutron_context.get_admin_context())
+
+
+if __name__ == "__main__":
+    main()
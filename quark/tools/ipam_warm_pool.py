@@ -0,0 +1,150 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Keeps the warm address pools of CONF.QUARK.ipam_warm_pool_sizes topped up.
+
+Runs as a daemon next to the API servers. On start it releases the
+reservations nobody wants anymore, those of networks dropped from the
+configuration or beyond a shrunk pool size. Then every interval seconds it
+refills each short subnet pool in a transaction of its own and logs how
+long the pool was short as its refill lag.
+"""
+
+import sys
+import time
+
+from neutron.common import config as neutron_cfg
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark.db import models
+from quark import ipam
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+warm_pool_opts = [
+    cfg.FloatOpt("interval", default=1.0,
+                 help=_("Seconds between two refills of the pools"))
+]
+
+CONF.register_cli_opts(warm_pool_opts)
+
+
+def pool_sizes():
+    sizes = {}
+    for net_id, size in CONF.QUARK.ipam_warm_pool_sizes.items():
+        sizes[net_id] = int(size)
+    return sizes
+
+
+def reclaim(context, sizes):
+    """Releases reservations beyond sizes, returns how many."""
+    with context.session.begin():
+        reserved = db_api.ip_address_pool_find(context, lock_mode=True,
+                                               scope=db_api.ALL)
+        kept = {}
+        surplus = []
+        for address in reserved:
+            subnet_id = address["subnet_id"]
+            if kept.get(subnet_id, 0) < sizes.get(address["network_id"], 0):
+                kept[subnet_id] = kept.get(subnet_id, 0) + 1
+            else:
+                surplus.append(address)
+        db_api.ip_address_pool_release(context, surplus)
+    return len(surplus)
+
+
+class PoolFiller(object):
+    """Tops up the pools, remembering since when each one is short."""
+    def __init__(self, context, sizes):
+        self.context = context
+        self.sizes = sizes
+        self.short_since = {}
+
+    def _refilled(self, subnet_id):
+        since = self.short_since.pop(subnet_id, None)
+        if since is not None:
+            LOG.info("Warm pool of subnet %s refilled, refill lag %.3fs" %
+                     (subnet_id, time.time() - since))
+
+    def fill_network(self, net_id, size):
+        """Tops up the pool of every subnet of a network.
+
+        Returns how many addresses were reserved.
+        """
+        net = db_api.network_find(self.context, id=net_id, scope=db_api.ONE)
+        if not net:
+            LOG.warn("Network %s of the warm pools not found" % net_id)
+            return 0
+        strategy = ipam.IPAM_REGISTRY.get_strategy(net["ipam_strategy"])
+        counts = db_api.ip_address_pool_counts(self.context, net_id)
+        subnets = db_api.subnet_find(self.context, network_id=net_id,
+                                     scope=db_api.ALL)
+        reserved = 0
+        for subnet in subnets:
+            if subnet["do_not_use"]:
+                continue
+            missing = size - counts.get(subnet["id"], 0)
+            if missing > 0:
+                self.short_since.setdefault(subnet["id"], time.time())
+                with self.context.session.begin():
+                    addresses = strategy.reserve_ip_addresses(
+                        self.context, net_id, subnet["id"], missing)
+                reserved += len(addresses)
+                missing -= len(addresses)
+            if missing <= 0:
+                self._refilled(subnet["id"])
+        return reserved
+
+    def fill(self):
+        """One pass over all pools, returns how many addresses it reserved."""
+        reserved = 0
+        for net_id, size in self.sizes.items():
+            try:
+                reserved += self.fill_network(net_id, size)
+            except Exception:
+                LOG.exception("Failed to fill the warm pools of network %s" %
+                              net_id)
+        return reserved
+
+
+def main():
+    neutron_cfg.init(sys.argv[1:])
+    neutron_cfg.setup_logging(neutron_cfg.cfg.CONF)
+    neutron_db_api.configure_db()
+    neutron_db_api.register_models(base=models.BASEV2)
+    context = neutron_context.get_admin_context()
+
+    sizes = pool_sizes()
+    LOG.info("Released %d leftover warm pool reservations" %
+             reclaim(context, sizes))
+    if not sizes:
+        LOG.warn("No warm pools configured in ipam_warm_pool_sizes")
+        return
+    filler = PoolFiller(context, sizes)
+    while True:
+        reserved = filler.fill()
+        LOG.debug("Reserved %d addresses, %d pools short" %
+                  (reserved, len(filler.short_since)))
+        time.sleep(CONF.interval)
+
+
+if __name__ == "__main__":
+    main()